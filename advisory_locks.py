@@ -0,0 +1,24 @@
+"""
+PostgreSQL advisory lock keys used by the app.
+
+Advisory locks share one key space per database, so two features that
+picked the same number would block each other (a session-level lock held by
+a long-running leader starves every transaction-level waiter on that key).
+Every key lives here; add new ones to ALL_KEYS.
+"""
+
+# Single bigint keys
+MIGRATION_LOCK_ID = 727001  # run_migrations(), held per migration transaction
+DIALER_LOCK_ID = 727002  # campaign dialer leader, held for the leader's whole session
+ARCHIVE_LOCK_ID = 727003  # call_archive.archive_expired(), held for one archival run
+PARTITION_LOCK_ID = 727004  # call_archive.ensure_partitions(), held per transaction
+
+# First half of the two-int form pg_advisory_xact_lock(namespace, hashtext(name)) for locks
+# keyed by a name. Two-int keys never collide with the single bigint keys above.
+METRICS_CACHE_NAMESPACE = 727101
+CALL_ROW_NAMESPACE = 727102  # status_writer, per call_sid: a calls row insert vs. callbacks that beat it
+
+ALL_KEYS = (MIGRATION_LOCK_ID, DIALER_LOCK_ID, ARCHIVE_LOCK_ID, PARTITION_LOCK_ID, METRICS_CACHE_NAMESPACE,
+            CALL_ROW_NAMESPACE)
+if len(set(ALL_KEYS)) != len(ALL_KEYS):
+    raise RuntimeError("Duplicate advisory lock key")
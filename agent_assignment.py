@@ -0,0 +1,151 @@
+"""
+Atomic agent assignment for incoming calls.
+
+An agent is picked and marked 'on_call' in a single statement: the candidate
+row is locked with FOR UPDATE SKIP LOCKED, so concurrent callers in other
+gunicorn workers skip it instead of queueing behind the lock (or both
+dialing the same agent). The call row is linked to the agent in the same
+round trip, and only while it is still before 'transferred' in the call
+state machine: a call that already ended (or was handed to another agent)
+gets no agent, so a late claim can never move it backwards or leave an
+agent 'on_call' for a call nobody is on.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sequence holding the id of the last agent handed out by the round-robin strategy.
+# setval()/last_value are non-transactional, so the pointer never becomes a hot row lock.
+ROUND_ROBIN_SEQUENCE = 'agent_round_robin_seq'
+
+
+class AssignmentStrategy:
+    """Decides which available agent is claimed first.
+
+    `order_by` is an SQL ORDER BY expression over the `agents` table aliased
+    as `a`. `on_claim` is an optional SQL expression evaluated once over the
+    claimed row (aliased as `claimed`), e.g. to advance a shared pointer.
+    """
+
+    def __init__(self, name, order_by, on_claim=None):
+        self.name = name
+        self.order_by = order_by
+        self.on_claim = on_claim
+
+    def __repr__(self):
+        return f"AssignmentStrategy({self.name!r})"
+
+
+STRATEGIES = {}
+
+
+def register_strategy(strategy):
+    """Make a strategy selectable by name (e.g. via AGENT_ASSIGNMENT_STRATEGY)."""
+    STRATEGIES[strategy.name] = strategy
+    return strategy
+
+
+# Agent who has been sitting in 'available' the longest goes first
+register_strategy(AssignmentStrategy(
+    'longest_idle',
+    order_by="a.last_status_update ASC NULLS FIRST, a.id",
+))
+
+# Next agent id after the one assigned last, wrapping around to the lowest id
+register_strategy(AssignmentStrategy(
+    'round_robin',
+    order_by=f"a.id <= (SELECT last_value FROM {ROUND_ROBIN_SEQUENCE}), a.id",
+    on_claim=f"setval('{ROUND_ROBIN_SEQUENCE}', claimed.id)",
+))
+
+# Agent who has taken the fewest calls since midnight (UTC), ties broken by idle time
+register_strategy(AssignmentStrategy(
+    'least_calls_today',
+    order_by=(
+        "(SELECT COUNT(*) FROM calls c WHERE c.agent_id = a.id "
+        "AND c.start_time >= date_trunc('day', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'), "
+        "a.last_status_update ASC NULLS FIRST, a.id"
+    ),
+))
+
+DEFAULT_STRATEGY = 'longest_idle'
+
+
+def get_strategy(name=None):
+    """Look up a registered strategy, raising ValueError for unknown names."""
+    name = name or DEFAULT_STRATEGY
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"Unknown agent assignment strategy: {name}. Choose from: {', '.join(sorted(STRATEGIES))}")
+
+
+def build_claim_query(strategy):
+    """Build the single-statement claim query for a strategy."""
+    extra = f", {strategy.on_claim}" if strategy.on_claim else ""
+    return f"""
+        WITH target AS (
+            -- Locked, so the call can't end between this check and the link below
+            SELECT calls.call_sid
+            FROM calls
+            WHERE calls.call_sid = %(call_sid)s
+              AND call_status_rank(calls.status) < call_status_rank('transferred')
+            FOR UPDATE
+        ), candidate AS (
+            SELECT a.id
+            FROM agents a
+            WHERE a.status = 'available'
+              AND (%(call_sid)s::text IS NULL OR EXISTS (SELECT 1 FROM target))
+            ORDER BY {strategy.order_by}
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ), claimed AS (
+            UPDATE agents
+            SET status = 'on_call', last_status_update = CURRENT_TIMESTAMP
+            FROM candidate
+            WHERE agents.id = candidate.id AND agents.status = 'available'
+            RETURNING agents.id, agents.name, agents.phone_number
+        ), linked AS (
+            UPDATE calls
+            SET agent_id = claimed.id, status = 'transferred',
+                ai_interaction_summary = COALESCE(%(ai_summary)s::text, calls.ai_interaction_summary)
+            FROM claimed
+            WHERE calls.call_sid = %(call_sid)s
+              AND call_status_rank(calls.status) < call_status_rank('transferred')
+            RETURNING calls.id
+        )
+        SELECT claimed.id, claimed.name, claimed.phone_number{extra}
+        FROM claimed
+    """
+
+
+_claim_queries = {}
+
+
+def claim_query(strategy=None):
+    """The (cached) claim statement for a strategy name or object; parameters: call_sid, ai_summary."""
+    strategy = get_strategy(strategy) if not isinstance(strategy, AssignmentStrategy) else strategy
+    query = _claim_queries.get(strategy)
+    if query is None:
+        query = _claim_queries[strategy] = build_claim_query(strategy)
+    return query
+
+
+def claim_agent(cursor, call_sid=None, strategy=None, ai_summary=None):
+    """Atomically claim an available agent and link it to `call_sid`.
+
+    `ai_summary`, when given, is stored on the call in the same statement.
+
+    Returns a dict with the agent's id, name and phone_number, or None when
+    no agent is available or the call can no longer be transferred (it has
+    no calls row, or has already been transferred or ended); no agent is
+    claimed then. The caller owns the transaction and must commit.
+    """
+    strategy = get_strategy(strategy) if not isinstance(strategy, AssignmentStrategy) else strategy
+    cursor.execute(claim_query(strategy), {'call_sid': call_sid, 'ai_summary': ai_summary})
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    agent = {'id': row[0], 'name': row[1], 'phone_number': row[2]}
+    logger.info(f"Assigned agent {agent['id']} to call {call_sid} using {strategy.name} strategy")
+    return agent
@@ -0,0 +1,198 @@
+"""
+In-memory agent presence registry kept coherent with PostgreSQL LISTEN/NOTIFY.
+
+A trigger on the agents table publishes every row change on the
+'agent_presence' channel. Each worker process keeps one dedicated listening
+connection, applies those notifications to an index of agents by status
+(so availability counts are O(1) dictionary reads) and fans the deltas out
+to Server-Sent Events subscribers.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'agent_presence'
+AGENT_COLUMNS = ('id', 'name', 'phone_number', 'status', 'last_status_update')
+
+
+class AgentPresenceRegistry:
+    """Process-local index of agents by id and by status."""
+
+    def __init__(self, dsn, channel=CHANNEL, subscriber_queue_size=100):
+        self.dsn = dsn
+        self.channel = channel
+        self.subscriber_queue_size = subscriber_queue_size
+        self._lock = threading.Lock()
+        self._agents = {}
+        self._by_status = {}
+        self._subscribers = set()
+        self._ready = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.version = 0
+        # XOR of a digest per agent: identifies the current state, in any worker, in O(1) per change
+        self._digests = {}
+        self._state_digest = 0
+
+    # -- state ----------------------------------------------------------------
+
+    def _apply(self, agent):
+        """Insert or replace one agent. Caller holds the lock."""
+        previous = self._agents.get(agent['id'])
+        if previous is not None:
+            self._by_status.get(previous['status'], set()).discard(agent['id'])
+        self._agents[agent['id']] = agent
+        self._by_status.setdefault(agent['status'], set()).add(agent['id'])
+        digest = int.from_bytes(hashlib.blake2b(
+            json.dumps(agent, sort_keys=True, default=str).encode(), digest_size=8).digest(), 'big')
+        self._state_digest ^= self._digests.get(agent['id'], 0) ^ digest
+        self._digests[agent['id']] = digest
+        self.version += 1
+
+    def _remove(self, agent_id):
+        previous = self._agents.pop(agent_id, None)
+        if previous is not None:
+            self._by_status.get(previous['status'], set()).discard(agent_id)
+            self._state_digest ^= self._digests.pop(agent_id)
+            self.version += 1
+
+    def _load_snapshot(self, cursor):
+        cursor.execute(f"SELECT {', '.join(AGENT_COLUMNS)} FROM agents")
+        agents = [dict(zip(AGENT_COLUMNS, row)) for row in cursor.fetchall()]
+        for agent in agents:
+            if agent['last_status_update'] is not None:
+                agent['last_status_update'] = agent['last_status_update'].isoformat()
+        with self._lock:
+            self._agents = {}
+            self._by_status = {}
+            self._digests = {}
+            self._state_digest = 0
+            for agent in agents:
+                self._apply(agent)
+        self._publish('snapshot', self.list_agents())
+
+    def _handle_notification(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed agent presence notification: {payload!r}")
+            return
+        agent = message.get('agent') or {}
+        with self._lock:
+            if message.get('op') == 'DELETE':
+                self._remove(agent.get('id'))
+            else:
+                self._apply({column: agent.get(column) for column in AGENT_COLUMNS})
+        self._publish('deleted' if message.get('op') == 'DELETE' else 'agent', agent)
+
+    # -- reads ------------------------------------------------------------------
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def count(self, status):
+        with self._lock:
+            return len(self._by_status.get(status, ()))
+
+    def counts(self):
+        with self._lock:
+            counts = {status: len(ids) for status, ids in self._by_status.items()}
+            counts['total'] = len(self._agents)
+        return counts
+
+    def list_agents(self):
+        with self._lock:
+            return [dict(self._agents[agent_id]) for agent_id in sorted(self._agents)]
+
+    def state_tag(self):
+        """Identifies the agents currently held; equal in every worker holding the same agents."""
+        with self._lock:
+            return f"{len(self._agents)}-{self._state_digest:016x}"
+
+    # -- subscribers --------------------------------------------------------------
+
+    def subscribe(self):
+        """Return a queue that receives (event, data) tuples, starting with a snapshot."""
+        subscriber = queue.Queue(maxsize=self.subscriber_queue_size)
+        subscriber.put(('snapshot', self.list_agents()))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # A slow client gets resynchronized with a fresh snapshot instead of a backlog
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(('snapshot', self.list_agents()))
+
+    # -- listener -----------------------------------------------------------------
+
+    def ensure_started(self, wait=0.0):
+        """Start the listener thread in this process (once), optionally waiting for the first snapshot."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._ready.clear()
+                    self._subscribers = set()
+                    self._thread = threading.Thread(target=self._listen_forever, name='agent-presence', daemon=True)
+                    self._thread.start()
+        if wait:
+            self._ready.wait(wait)
+        return self.ready
+
+    def _listen_forever(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    # LISTEN before the snapshot so no change can slip between the two
+                    cursor.execute(f"LISTEN {self.channel}")
+                    self._load_snapshot(cursor)
+                self._ready.set()
+                backoff = 1.0
+                while True:
+                    if select.select([conn], [], [], 30.0) == ([], [], []):
+                        # Idle: make sure the connection is still alive
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle_notification(conn.notifies.pop(0).payload)
+            except Exception as e:
+                # Readers fall back to the database until we have resynchronized
+                self._ready.clear()
+                logger.error(f"Agent presence listener error, reconnecting in {backoff:.0f}s: {str(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
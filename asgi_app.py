@@ -0,0 +1,396 @@
+"""
+ASGI serving mode for high-concurrency Twilio webhook traffic.
+
+    pip install -r requirements-asgi.txt
+    flask --app test_call_app init-db
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 4
+
+The routes Twilio hammers during a call (/request_call, /voice, /ivr/<step>
+and /twilio_status_callback) run natively on the event loop: PostgreSQL
+through asyncpg and the Twilio REST API through httpx, so a worker waiting
+on a slow Twilio request or query keeps serving other calls and can hold
+thousands of them in flight. They run the same SQL (see async_db.pg_query),
+IVR flow, session store, status write-behind and templates as the Flask
+views in test_call_app.py. Every other route is the unchanged Flask app,
+mounted through a WSGI adapter that runs it in a thread pool.
+
+The native routes apply the same rate limits and idempotency keys as the
+Flask views, sharing their limiter and store objects. Their per-IP limit
+takes the client address from X-Forwarded-For by the same TRUSTED_PROXY_HOPS
+rule as the Flask app's ProxyFix, so uvicorn's --proxy-headers isn't needed.
+"""
+import math
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from functools import wraps
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import agent_assignment
+import call_dispatch
+import call_queue
+import fast_json
+import idempotency
+import instrumentation
+import status_writer
+import test_call_app as core
+from async_db import create_pool, pg_query
+
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 2))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
+TWILIO_MAX_CONNECTIONS = int(os.environ.get('TWILIO_MAX_CONNECTIONS', 100))
+# Threads serving the mounted Flask routes
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 10))
+
+
+class TwilioRestClient:
+    """The Twilio REST call the webhooks make, over one pooled async HTTP client."""
+
+    def __init__(self, account_sid, auth_token, base_url=None, timeout=15.0, max_connections=100):
+        self.account_sid = account_sid
+        self.http = httpx.AsyncClient(
+            base_url=base_url or 'https://api.twilio.com',
+            auth=(account_sid, auth_token),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def create_call(self, to, from_, url, status_callback, status_callback_event):
+        """Start an outbound call; returns its CallSid."""
+        form = [('To', to), ('From', from_), ('Url', url), ('StatusCallback', status_callback)]
+        form.extend(('StatusCallbackEvent', event) for event in status_callback_event)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await self.http.post(f"/2010-04-01/Accounts/{self.account_sid}/Calls.json", data=form)
+            status = str(response.status_code)
+        finally:
+            instrumentation.TWILIO_API_DURATION.observe(time.perf_counter() - started, ('POST', status))
+        if response.status_code >= 400:
+            raise RuntimeError(f"Twilio API error {response.status_code}: {response.text[:200]}")
+        return response.json()['sid']
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def json_response(payload, status_code=200, headers=None):
+    return Response(fast_json.dumps(payload), status_code=status_code, headers=headers, media_type='application/json')
+
+
+def twiml_response(twiml):
+    return Response(twiml, media_type='text/xml')
+
+
+def timed(route):
+    """Record the handler's latency in /metrics under the same labels the Flask views use."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            started = time.perf_counter()
+            status = '500'
+            try:
+                response = await f(request)
+                status = str(response.status_code)
+                return response
+            finally:
+                instrumentation.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, (route, request.method, status))
+        return decorated_function
+    return decorator
+
+
+def db_connection(request):
+    """Acquire an asyncpg connection for the duration of an `async with` block."""
+    pool = request.app.state.db
+    if pool is None:
+        raise RuntimeError("DATABASE_URL is not set")
+    return pool.acquire()
+
+
+async def twilio_params(request):
+    """Query string and form fields merged, like Flask's request.values."""
+    values = dict(request.query_params)
+    if request.method == 'POST':
+        values.update((await request.form()).items())
+    return values
+
+
+async def check_rate_limit(request, limiter, key):
+    """Async check_rate_limit(): None if allowed, else a 429 response with Retry-After."""
+    if not core.RATE_LIMIT_ENABLED:
+        return None
+    if limiter.shared and request.app.state.db is not None:
+        async with db_connection(request) as conn:
+            retry_after = await limiter.check_async(key, conn)
+    else:
+        retry_after = limiter.check(key)
+    if not retry_after:
+        return None
+    instrumentation.RATE_LIMITED_REQUESTS.inc(labels=(limiter.name,))
+    seconds = math.ceil(retry_after)
+    return json_response({"error": "Too many requests, please retry later.", "retry_after": seconds}, 429,
+                         headers={'Retry-After': str(seconds)})
+
+
+def client_ip(request):
+    """request.remote_addr as ProxyFix(x_for=TRUSTED_PROXY_HOPS) computes it for the Flask app."""
+    if core.TRUSTED_PROXY_HOPS:
+        forwarded = [ip.strip() for ip in request.headers.get('x-forwarded-for', '').split(',')]
+        if len(forwarded) >= core.TRUSTED_PROXY_HOPS:
+            return forwarded[-core.TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else None
+
+
+def rate_limited_by_ip(limiter):
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            return await check_rate_limit(request, limiter, client_ip(request)) or await f(request)
+        return decorated_function
+    return decorator
+
+
+def idempotency_connection(request):
+    store = core.idempotency_store
+    return db_connection(request) if store.shared and request.app.state.db is not None else nullcontext()
+
+
+async def release_idempotency_key(request, key):
+    try:
+        async with idempotency_connection(request) as conn:
+            await core.idempotency_store.release_async(key, conn)
+    except Exception as e:
+        core.logger.error(f"Could not release idempotency key {key}: {str(e)}")
+
+
+def idempotent(header=idempotency.HEADER):
+    """Async idempotent(): keys are scoped and fingerprinted as in the Flask views, so both modes share them."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            key = request.headers.get(header)
+            if not key:
+                return await f(request)
+            if len(key) > idempotency.MAX_KEY_LENGTH:
+                return json_response({"error": f"{header} must be at most {idempotency.MAX_KEY_LENGTH} characters"}, 400)
+            # Same key and fingerprint as Flask's request.endpoint and request.full_path
+            key = f"{f.__name__}:{key}"
+            fingerprint = idempotency.fingerprint(request.method, f"{request.url.path}?{request.url.query}",
+                                                  await request.body())
+            store = core.idempotency_store
+            async with idempotency_connection(request) as conn:
+                state, stored = await store.begin_async(key, fingerprint, conn)
+            instrumentation.IDEMPOTENT_REQUESTS.inc(labels=(state,))
+            if state == idempotency.REPLAY:
+                headers = dict(stored.headers, **{'Idempotent-Replayed': 'true'})
+                return Response(stored.body, status_code=stored.status_code, headers=headers)
+            if state == idempotency.IN_PROGRESS:
+                return json_response({"error": "A request with this key is still being processed."}, 409,
+                                     headers={'Retry-After': '1'})
+            if state == idempotency.MISMATCH:
+                return json_response({"error": f"{header} was already used for a different request."}, 422)
+            try:
+                response = await f(request)
+            except Exception:
+                await release_idempotency_key(request, key)
+                raise
+            if not idempotency.cacheable(response.status_code):
+                await release_idempotency_key(request, key)
+                return response
+            async with idempotency_connection(request) as conn:
+                await store.complete_async(key, idempotency.StoredResponse.capture(
+                    response.status_code, response.headers.items(), response.body), conn)
+            return response
+        return decorated_function
+    return decorator
+
+
+# -- outbound calls -------------------------------------------------------------------
+
+def submit_call_request(to_phone_number):
+    """Queue a callback request with the (threaded) dispatcher; returns its request id."""
+    with core.db_pool_connection() as conn:
+        with conn.cursor() as cursor:
+            request_id, start = core.call_dispatcher.submit(cursor, to_phone_number)
+    # Only once the request row is committed
+    start()
+    return request_id
+
+
+def record_initiated_call(call_sid, to_phone_number):
+    # Through the psycopg2 pool: insert_calls also replays callbacks that beat the row (see status_writer)
+    with core.db_pool_connection() as conn:
+        with conn.cursor() as cursor:
+            core.record_initiated_call(cursor, call_sid, to_phone_number)
+
+
+@timed('/request_call')
+@rate_limited_by_ip(core.request_call_ip_limiter)
+@idempotent()
+async def request_call(request):
+    """Initiate an outbound call to the provided number (synchronously, or queued with a 202)."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return json_response({"error": "Request body must be a JSON object"}, 400)
+    to_phone_number = data.get('phoneNumber') or data.get('phone_number')
+    if not to_phone_number:
+        return json_response({"error": "Phone number is required"}, 400)
+    rejected = await check_rate_limit(request, core.request_call_number_limiter, core.number_key(to_phone_number))
+    if rejected is not None:
+        return rejected
+    if core.wants_async_dispatch(data, request.query_params.get('mode'), request.headers.get('Prefer', '')) \
+            and core.call_dispatcher is not None:
+        try:
+            request_id = await run_in_threadpool(submit_call_request, to_phone_number)
+        except call_dispatch.DispatchQueueFull as e:
+            return json_response({"error": str(e)}, 503)
+        status_url = f"/api/calls/{request_id}"
+        return json_response({
+            "message": "Call request queued.",
+            "request_id": request_id,
+            "status": "queued",
+            "status_url": status_url
+        }, 202, headers={'Location': status_url})
+    try:
+        twilio = request.app.state.twilio
+        if twilio is None:
+            raise RuntimeError("Twilio client is not configured")
+        call_sid = await twilio.create_call(
+            to_phone_number,
+            core.TWILIO_PHONE_NUMBER,
+            url=f"{core.DEPLOYED_BACKEND_URL}/voice",
+            status_callback=f"{core.DEPLOYED_BACKEND_URL}/twilio_status_callback",
+            status_callback_event=core.STATUS_CALLBACK_EVENTS
+        )
+        await run_in_threadpool(record_initiated_call, call_sid, to_phone_number)
+        print(f"Logged initiated call for {to_phone_number} with CallSid: {call_sid}")
+        return json_response({"message": f"Call initiated successfully! Call SID: {call_sid}", "call_sid": call_sid})
+    except Exception as e:
+        print(f"Error initiating call for {to_phone_number}: {e}")
+        return json_response({"error": f"Error initiating call: {e}"}, 500)
+
+
+# -- status callbacks -----------------------------------------------------------------
+
+def apply_status_event(event):
+    with core.db_pool_connection() as conn:
+        with conn.cursor() as cursor:
+            result = core.apply_status_events(cursor, [event])
+    core.notify_agents_released(result)
+
+
+@timed('/twilio_status_callback')
+async def twilio_status_callback(request):
+    """Receives call status updates from Twilio."""
+    event = status_writer.event_from_twilio(await request.form())
+    if event is None:
+        return Response(status_code=204)
+    if core.status_event_writer is None or not core.status_event_writer.submit(event):
+        # Write-behind queue is full (or there is no pool): apply this one before answering
+        await run_in_threadpool(apply_status_event, event)
+    return Response(status_code=204)
+
+
+# -- IVR --------------------------------------------------------------------------------
+
+async def complete_ivr(request, call_sid, answers, values):
+    """Async complete_ivr(): same statements, same transaction, same TwiML."""
+    caller_name, age = core.ivr_summary(answers)
+    print(f"Collected Name: {caller_name}, Age: {age} (CallSid: {call_sid})")
+    ai_summary = f"Name: {caller_name}, Age: {age}" if call_sid else None
+    agent = None
+    queued = False
+    async with db_connection(request) as conn:
+        async with conn.transaction():
+            if core.agents_maybe_available() is not False:
+                row = await conn.fetchrow(*pg_query(agent_assignment.claim_query(core.AGENT_ASSIGNMENT_STRATEGY),
+                                                    {'call_sid': call_sid, 'ai_summary': ai_summary}))
+                if row is not None:
+                    agent = {'id': row[0], 'name': row[1], 'phone_number': row[2]}
+            if not agent and call_sid:
+                await conn.execute(*pg_query(core.UPDATE_CALL_SUMMARY, (ai_summary, call_sid)))
+            queued = bool(not agent and call_sid and core.call_queue_dispatcher is not None)
+            if queued:
+                await conn.execute(*pg_query(call_queue.ENQUEUE_QUERY, (call_sid, core.caller_number(values), 0)))
+    return core.finish_ivr(call_sid, caller_name, age, agent, queued)
+
+
+async def run_ivr_step(request, step_name, attempt=None):
+    values = await twilio_params(request)
+    call_sid = values.get('CallSid')
+    store = core.ivr_session_store
+    async with (db_connection(request) if store.shared else nullcontext()) as conn:
+        answers = await store.get_async(call_sid, conn, require=core.IVR_FLOW.fields_before.get(step_name, ()))
+        if 'caller_name' not in answers and values.get('caller_name'):
+            answers['caller_name'] = values['caller_name']
+        outcome = core.IVR_FLOW.handle(step_name, values, answers, attempt)
+        if not outcome.complete and outcome.updates and call_sid:
+            await store.update_async(call_sid, conn, **outcome.updates)
+    if outcome.complete:
+        return twiml_response(await complete_ivr(request, call_sid, dict(answers, **outcome.updates), values))
+    return twiml_response(outcome.twiml)
+
+
+@timed('/ivr/<step>')
+@idempotent(idempotency.TWILIO_HEADER)
+async def ivr_step(request):
+    """Generic Twilio webhook for every step of IVR_FLOW."""
+    step = request.path_params['step']
+    if step not in core.IVR_FLOW.steps:
+        return json_response({"error": f"Unknown IVR step: {step}"}, 404)
+    attempt = request.query_params.get('attempt')
+    return await run_ivr_step(request, step, int(attempt) if attempt and attempt.isdigit() else None)
+
+
+@timed('/voice')
+@idempotent(idempotency.TWILIO_HEADER)
+async def voice(request):
+    """Called by Twilio when an outbound call connects; enters the IVR at its first step."""
+    return await run_ivr_step(request, core.IVR_FLOW.start)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.db = await create_pool(core.DATABASE_URL, min_size=ASYNC_DB_POOL_MIN_SIZE,
+                                     max_size=ASYNC_DB_POOL_MAX_SIZE) if core.DATABASE_URL else None
+    app.state.twilio = TwilioRestClient(
+        core.TWILIO_ACCOUNT_SID, core.TWILIO_AUTH_TOKEN, base_url=core.TWILIO_API_BASE_URL or None,
+        timeout=core.TWILIO_HTTP_TIMEOUT, max_connections=TWILIO_MAX_CONNECTIONS,
+    ) if core.TWILIO_ACCOUNT_SID and core.TWILIO_AUTH_TOKEN else None
+    # Status writer, dispatchers and presence listener, as the Flask app starts them on its first request
+    await run_in_threadpool(core.start_background_workers)
+    try:
+        yield
+    finally:
+        if app.state.twilio is not None:
+            await app.state.twilio.aclose()
+        if app.state.db is not None:
+            await app.state.db.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/request_call', request_call, methods=['POST']),
+        Route('/twilio_status_callback', twilio_status_callback, methods=['POST']),
+        Route('/voice', voice, methods=['GET', 'POST']),
+        Route('/ivr/{step}', ivr_step, methods=['GET', 'POST']),
+        # Everything else: the Flask app as is
+        Mount('/', app=WSGIMiddleware(core.app, workers=WSGI_THREADS)),
+    ],
+    # Same policy as the Flask app's CORS(); sets (not appends) the headers, so mounted routes aren't doubled
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+                           allow_headers=["Content-Type", "Authorization", idempotency.HEADER],
+                           expose_headers=["Retry-After", "Idempotent-Replayed"])],
+    lifespan=lifespan,
+)
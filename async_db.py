@@ -0,0 +1,67 @@
+"""
+asyncpg support for the ASGI serving mode (asgi_app.py).
+
+The app's SQL is written for psycopg2's %s / %(name)s placeholders.
+pg_query() rewrites a statement into asyncpg's $1, $2, ... form (once per
+statement, then cached) and orders the arguments to match, so the Flask
+and ASGI modes run exactly the same statements against the same schema.
+
+    await conn.fetchrow(*pg_query(agent_assignment.claim_query(), {'call_sid': sid, 'ai_summary': None}))
+"""
+import json
+import re
+
+try:
+    import asyncpg
+except ImportError:  # only the ASGI mode needs asyncpg (requirements-asgi.txt)
+    asyncpg = None
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+_converted = {}
+
+
+def _convert(sql):
+    names = []
+    positional = 0
+
+    def replace(match):
+        nonlocal positional
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            positional += 1
+            return f"${positional}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    text = _PLACEHOLDER.sub(replace, sql)
+    if names and positional:
+        raise ValueError("Cannot mix %s and %(name)s placeholders")
+    return text, tuple(names)
+
+
+def pg_query(sql, params=()):
+    """Return (sql, *args) for asyncpg from a psycopg2-style statement and its parameters."""
+    converted = _converted.get(sql)
+    if converted is None:
+        converted = _converted[sql] = _convert(sql)
+    text, names = converted
+    if names:
+        return (text, *(params[name] for name in names))
+    return (text, *params)
+
+
+async def _init_connection(conn):
+    # JSON columns in and out as Python objects, like psycopg2's Json()/json typecaster
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def create_pool(dsn, min_size=2, max_size=20, command_timeout=30.0):
+    """Create an asyncpg pool whose connections decode JSON/JSONB columns."""
+    if asyncpg is None:
+        raise RuntimeError("asyncpg is not installed; pip install -r requirements-asgi.txt")
+    return await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size,
+                                     command_timeout=command_timeout, init=_init_connection)
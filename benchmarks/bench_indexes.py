@@ -0,0 +1,134 @@
+"""
+Benchmark dashboard and lookup queries before and after the index migration.
+
+Seeds a scratch schema with agents and 1M calls, times the hot queries with
+only the base tables (migration 1), applies the remaining migrations and
+times them again.
+
+    DATABASE_URL=postgresql://... python benchmarks/bench_indexes.py --calls 1000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import migrations  # noqa: E402
+
+SCHEMA = 'bench_indexes'
+
+QUERIES = {
+    'calls today (range)': """
+        SELECT COUNT(*) FROM calls
+        WHERE start_time >= date_trunc('day', now()) AND start_time < date_trunc('day', now()) + INTERVAL '1 day'
+    """,
+    'avg completed duration 24h': """
+        SELECT AVG(EXTRACT(EPOCH FROM (end_time - start_time))) FROM calls
+        WHERE status = 'completed' AND start_time >= now() - INTERVAL '1 day' AND end_time IS NOT NULL
+    """,
+    'call log first page': """
+        SELECT id, caller_number, status, start_time FROM calls
+        WHERE start_time IS NOT NULL ORDER BY start_time DESC, id DESC LIMIT 51
+    """,
+    'calls by agent': "SELECT COUNT(*) FROM calls WHERE agent_id = 7",
+    'failed calls': "SELECT COUNT(*) FROM calls WHERE status = 'failed'",
+    'caller number prefix': "SELECT id FROM calls WHERE caller_number LIKE '+1555000012%' LIMIT 50",
+    'first available agent': """
+        SELECT id, phone_number FROM agents WHERE status = 'available'
+        ORDER BY last_status_update, id LIMIT 1
+    """,
+}
+
+
+def seed(conn, calls, agents):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO agents (name, phone_number, status, last_status_update)
+            SELECT 'Agent ' || i, '+1444' || lpad(i::text, 7, '0'),
+                   CASE WHEN i %% 20 = 0 THEN 'available' WHEN i %% 3 = 0 THEN 'on_call' ELSE 'offline' END,
+                   now() - (i || ' minutes')::interval
+            FROM generate_series(1, %s) AS i
+        """, (agents,))
+        # Calls spread over the last 180 days; most completed, some failed/busy/no-answer
+        cursor.execute("""
+            INSERT INTO calls (call_sid, caller_number, agent_id, start_time, end_time, duration, status)
+            SELECT 'CA' || md5(i::text), '+1555' || lpad((i %% 10000000)::text, 7, '0'),
+                   1 + (i %% %(agents)s),
+                   t.start_time, t.start_time + (d.secs || ' seconds')::interval, d.secs,
+                   CASE WHEN i %% 10 < 8 THEN 'completed' WHEN i %% 10 = 8 THEN 'failed' ELSE 'no-answer' END
+            FROM generate_series(1, %(calls)s) AS i,
+                 LATERAL (SELECT now() - random() * INTERVAL '180 days' AS start_time) t,
+                 LATERAL (SELECT (30 + random() * 600)::int AS secs) d
+        """, {'calls': calls, 'agents': agents})
+        cursor.execute("ANALYZE agents; ANALYZE calls;")
+    conn.commit()
+
+
+def time_queries(conn, repeat):
+    results = {}
+    with conn.cursor() as cursor:
+        for name, sql in QUERIES.items():
+            cursor.execute(sql)  # warm the cache
+            cursor.fetchall()
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(samples)
+    conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help="keep the scratch schema afterwards")
+    args = parser.parse_args()
+
+    dsn = os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit("Set DATABASE_URL (or BENCH_DATABASE_URL) to a scratch PostgreSQL database.")
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}")
+        conn.commit()
+
+        migrations.run_migrations(conn, target=1)
+        print(f"Seeding {args.agents} agents and {args.calls:,} calls...")
+        started = time.perf_counter()
+        seed(conn, args.calls, args.agents)
+        print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+        before = time_queries(conn, args.repeat)
+        started = time.perf_counter()
+        migrations.run_migrations(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE agents; ANALYZE calls;")
+        conn.commit()
+        print(f"Applied remaining migrations in {time.perf_counter() - started:.1f}s")
+        after = time_queries(conn, args.repeat)
+
+        print(f"\n{'query':<30} {'before (ms)':>12} {'after (ms)':>12} {'speedup':>9}")
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<30} {before[name]:>12.2f} {after[name]:>12.2f} {speedup:>8.1f}x")
+    finally:
+        if not args.keep:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark JSON encoding of a large call list.
+
+Compares the previous path (rows copied into dicts, then encoded by the
+stdlib json module with a Python callback for every datetime) against
+fast_json (raw cursor tuples in a RowSet, encoded by orjson when it is
+installed). Rows are synthetic but shaped like /api/calls output; pass
+--from-db to encode real rows from DATABASE_URL instead.
+
+    python benchmarks/bench_json.py --rows 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fast_json  # noqa: E402
+
+FIELDS = ('id', 'call_sid', 'caller_number', 'agent_id', 'agent_name', 'start_time', 'end_time',
+          'duration', 'status', 'ai_interaction_summary')
+
+
+def synthetic_rows(count):
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        start = base + timedelta(seconds=i * 37)
+        rows.append((i, f"CA{i:032x}", f"+1555{i % 10000000:07d}", i % 200, f"Agent {i % 200}", start,
+                     start + timedelta(seconds=30 + i % 600), 30 + i % 600,
+                     'completed' if i % 10 < 8 else 'failed', f"Name: Caller {i}, Age: {18 + i % 60}"))
+    return rows
+
+
+def db_rows(count):
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.id, c.call_sid, c.caller_number, c.agent_id, a.name, c.start_time, c.end_time,
+                       c.duration, c.status, c.ai_interaction_summary
+                FROM calls c LEFT JOIN agents a ON a.id = c.agent_id
+                ORDER BY c.start_time DESC NULLS LAST, c.id DESC
+                LIMIT %s
+            """, (count,))
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def stdlib_default(value):
+    # What Flask's default provider does with datetimes
+    if isinstance(value, datetime):
+        return format_datetime(value, usegmt=True)
+    raise TypeError(type(value).__name__)
+
+
+def before(rows):
+    data = [dict(zip(FIELDS, row)) for row in rows]
+    return json.dumps({'data': data}, default=stdlib_default).encode('utf-8')
+
+
+def after(rows):
+    return fast_json.dumps({'data': fast_json.RowSet(FIELDS, rows)})
+
+
+def time_it(func, rows, repeat):
+    func(rows)  # warm up
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(rows)
+        runs.append(time.perf_counter() - started)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--from-db', action='store_true', help="encode rows read from DATABASE_URL")
+    args = parser.parse_args()
+
+    rows = db_rows(args.rows) if args.from_db else synthetic_rows(args.rows)
+    print(f"Encoding {len(rows):,} rows with fast_json backend: {fast_json.BACKEND}")
+    results = {
+        'dicts + stdlib json': time_it(before, rows, args.repeat),
+        f'RowSet + {fast_json.BACKEND}': time_it(after, rows, args.repeat),
+    }
+    baseline = results['dicts + stdlib json']
+    print(f"\n{'path':<24} {'ms':>9} {'rows/s':>12} {'speedup':>8}")
+    for label, seconds in results.items():
+        print(f"{label:<24} {seconds * 1000:>9.1f} {len(rows) / seconds:>12,.0f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
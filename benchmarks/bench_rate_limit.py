@@ -0,0 +1,129 @@
+"""
+Benchmark the /request_call guards: rate-limit checks and idempotency keys.
+
+Runs KeyedRateLimiter.check() from several threads over a pool of client
+keys, the way gunicorn threads share one worker's limiter, then
+IdempotencyStore begin/complete cycles and replays. 'abusive' hammers a
+handful of keys so nearly every check is a rejection, the path that has to
+stay O(1). With --shared the same runs go through the UNLOGGED tables in
+DATABASE_URL (apply migrations first, e.g. with seed_dataset.py):
+
+    python benchmarks/bench_rate_limit.py --checks 200000 --threads 8
+    DATABASE_URL=postgresql://localhost/callcentre_bench python benchmarks/bench_rate_limit.py --shared
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import idempotency  # noqa: E402
+from rate_limit import KeyedRateLimiter  # noqa: E402
+
+
+def connect():
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    return conn
+
+
+def run_threads(threads, work, per_thread, shared):
+    """Run work(cursor, index) per_thread times in each thread; returns (seconds, per-call latencies)."""
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(offset):
+        conn = connect() if shared else None
+        cursor = conn.cursor() if conn else None
+        local = []
+        barrier.wait()
+        for i in range(per_thread):
+            started = time.perf_counter()
+            work(cursor, offset + i)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+        if conn is not None:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(n * per_thread,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started, latencies
+
+
+def report(label, calls, seconds, latencies, extra=''):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    print(f"{label:<26} {calls / seconds:>12,.0f} {statistics.median(latencies) * 1e6:>9.1f} "
+          f"{p99 * 1e6:>9.1f}  {extra}".rstrip())
+
+
+def bench_limiter(label, args, keys):
+    limiter = KeyedRateLimiter(f"bench_{label}", rate=args.rate, capacity=args.burst, shared=args.shared)
+    pool = [f"203.0.113.{n % 256}/{n}" for n in range(keys)]
+    rng = random.Random(1)
+    picks = [rng.choice(pool) for _ in range(args.checks)]
+    per_thread = args.checks // args.threads
+    seconds, latencies = run_threads(args.threads, lambda cursor, i: limiter.check(picks[i], cursor),
+                                     per_thread, args.shared)
+    stats = limiter.stats()
+    report(label, per_thread * args.threads, seconds, latencies,
+           f"allowed {stats['allowed']:,} / rejected {stats['rejected']:,}")
+
+
+def bench_idempotency(args):
+    store = idempotency.IdempotencyStore(max_entries=args.checks, shared=args.shared)
+    response = idempotency.StoredResponse.capture(
+        200, [('Content-Type', 'application/json')], b'{"message": "Call initiated successfully!"}')
+    fingerprint = idempotency.fingerprint('POST', '/request_call?', b'{"phoneNumber": "+15550100000"}')
+    run = f"{time.time_ns()}"
+    per_thread = args.checks // args.threads
+
+    def first(cursor, i):
+        key = f"request_call:{run}:{i}"
+        store.begin(key, fingerprint, cursor)
+        store.complete(key, response, cursor)
+
+    def retry(cursor, i):
+        store.begin(f"request_call:{run}:{i}", fingerprint, cursor)
+
+    seconds, latencies = run_threads(args.threads, first, per_thread, args.shared)
+    report('idempotency new', per_thread * args.threads, seconds, latencies)
+    seconds, latencies = run_threads(args.threads, retry, per_thread, args.shared)
+    report('idempotency replay', per_thread * args.threads, seconds, latencies, f"replays {store.replays:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checks', type=int, default=200_000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=50_000, help="distinct clients in the 'spread' run")
+    parser.add_argument('--rate', type=float, default=0.5, help="tokens per second per key")
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--shared', action='store_true', help="check against PostgreSQL (DATABASE_URL) too")
+    args = parser.parse_args()
+    if args.shared and not os.environ.get('DATABASE_URL'):
+        sys.exit("Set DATABASE_URL for --shared.")
+    if args.shared:
+        # Allowed checks and new keys are a database round trip each
+        args.checks = min(args.checks, 20_000)
+
+    print(f"{args.checks:,} calls per run on {args.threads} threads ({'shared' if args.shared else 'in-memory'})")
+    print(f"\n{'run':<26} {'calls/s':>12} {'p50 us':>9} {'p99 us':>9}")
+    bench_limiter('spread', args, args.keys)
+    bench_limiter('abusive', args, 10)
+    bench_idempotency(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Measure worker cold start: import time and time to the first served request.
+
+Each trial starts a fresh interpreter that imports the app, calls
+create_app() and serves one request through the Flask test client, the way
+a new gunicorn worker would. 'lazy' is the default boot; 'eager' does what
+every worker used to do at import (migrations and seeding, Twilio client,
+a database connection):
+
+    DATABASE_URL=postgresql://localhost/callcentre_bench python benchmarks/bench_startup.py --trials 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import test_call_app
+imported = time.perf_counter()
+app = test_call_app.create_app()
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': served - created, 'status': response.status_code}))
+"""
+
+MODES = {
+    'eager': {'INIT_DB_ON_START': 'true', 'WARM_ON_START': 'true'},
+    'lazy': {'INIT_DB_ON_START': 'false', 'WARM_ON_START': 'false'},
+}
+
+
+def run_trial(mode, path):
+    env = dict(os.environ, **MODES[mode])
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD, path], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    total = time.perf_counter() - started
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # Interpreter start-up included
+    timings['total'] = total
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--path', default='/api/agents', help="endpoint requested after start-up")
+    parser.add_argument('--modes', default='eager,lazy')
+    args = parser.parse_args()
+
+    columns = ('import', 'create_app', 'first_request', 'total')
+    print(f"{'mode':<8} " + ' '.join(f"{column + ' ms':>17}" for column in columns) + f" {'status':>7}")
+    for mode in args.modes.split(','):
+        trials = [run_trial(mode, args.path) for _ in range(args.trials)]
+        medians = [statistics.median(t[column] for t in trials) * 1000 for column in columns]
+        print(f"{mode:<8} " + ' '.join(f"{value:>17.1f}" for value in medians) + f" {trials[-1]['status']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Side-by-side load test of the gunicorn/Flask deployment and the ASGI mode.
+
+Starts each server in turn on the same port against the same database and
+fake Twilio API, replays the same call flows with load_test.CallSimulator
+and prints p50/p95/p99 per endpoint for both. A slow fake Twilio
+(--twilio-latency-ms) is what separates them: every in-flight /request_call
+holds a gunicorn thread, while the ASGI worker just awaits the response.
+
+    DATABASE_URL=postgresql://localhost/callcentre_bench python benchmarks/compare_servers.py \\
+        --calls 2000 --concurrency 200 --twilio-latency-ms 500 --json compare.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_twilio import FakeTwilio
+from load_test import CallSimulator, Recorder
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def server_commands(args):
+    bind = f"127.0.0.1:{args.port}"
+    return {
+        'flask': ['gunicorn', '-w', str(args.workers), '--threads', str(args.threads), '-k', 'gthread',
+                  '-b', bind, 'test_call_app:app'],
+        'asgi': [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--workers', str(args.workers),
+                 '--host', '127.0.0.1', '--port', str(args.port), '--no-access-log'],
+    }
+
+
+def wait_until_up(base_url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + '/metrics', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout:.0f}s")
+
+
+def run(mode, command, args, env):
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(base_url)
+        recorder = Recorder()
+        simulator = CallSimulator(base_url, recorder, dashboard_ratio=args.dashboard_ratio)
+        # Both modes share the database, so callers left on hold by one would skew the other
+        depth_before = simulator.queue_depth()
+        if depth_before:
+            print(f"[{mode}] WARNING: {depth_before} callers are already waiting in the hold queue")
+        print(f"[{mode}] replaying {args.calls} calls at concurrency {args.concurrency}...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            completed = sum(executor.map(simulator.run, range(args.calls)))
+        elapsed = time.perf_counter() - started
+        depth_after = simulator.queue_depth()
+        if depth_before is not None and depth_after is not None and depth_after > depth_before:
+            print(f"[{mode}] QUEUE LEAK: {depth_after - depth_before} simulated callers were left waiting")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {'completed_flows': completed, 'elapsed_seconds': round(elapsed, 2),
+            'flows_per_second': round(completed / elapsed, 2), 'endpoints': recorder.report(elapsed),
+            'queue_depth': {'before': depth_before, 'after': depth_after}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4, help="processes per server")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--dashboard-ratio', type=float, default=0.1)
+    parser.add_argument('--twilio-port', type=int, default=8099)
+    parser.add_argument('--twilio-latency-ms', type=float, default=300.0)
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--json', help="write both results to this file")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit("Set DATABASE_URL to a scratch PostgreSQL database (see seed_dataset.py).")
+    fake = FakeTwilio(latency=args.twilio_latency_ms / 1000)
+    twilio_server = fake.serve(port=args.twilio_port)
+    env = dict(os.environ, TWILIO_API_BASE_URL=f"http://127.0.0.1:{args.twilio_port}",
+               TWILIO_ACCOUNT_SID='ACbench', TWILIO_AUTH_TOKEN='bench', CALL_DISPATCH_MODE='sync',
+               # Every simulated caller comes from 127.0.0.1 and a 429 counts as a failure
+               RATE_LIMIT_ENABLED='false')
+
+    commands = server_commands(args)
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            results[mode] = run(mode, commands[mode], args, env)
+    finally:
+        twilio_server.shutdown()
+
+    labels = sorted({label for result in results.values() for label in result['endpoints']})
+    print(f"\n{'endpoint':<34} " + ' '.join(f"{mode + ' p50':>11} {mode + ' p95':>11} {mode + ' p99':>11}" for mode in results))
+    for label in labels:
+        cells = []
+        for result in results.values():
+            row = result['endpoints'].get(label)
+            cells.extend(f"{row[f'p{p}_ms']:>11.2f}" if row else f"{'-':>11}" for p in (50, 95, 99))
+        print(f"{label:<34} " + ' '.join(cells))
+    for mode, result in results.items():
+        print(f"{mode}: {result['completed_flows']}/{args.calls} flows in {result['elapsed_seconds']}s "
+              f"({result['flows_per_second']} flows/s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
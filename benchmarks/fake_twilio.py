@@ -0,0 +1,120 @@
+"""
+Local stand-in for the parts of the Twilio REST API the backend uses.
+
+Answers call creation (POST .../Calls.json) and call updates
+(POST .../Calls/<sid>.json) with Twilio-shaped JSON, optionally after an
+artificial delay, and remembers the calls it created. Start the backend with
+TWILIO_API_BASE_URL pointing here (plus any non-empty TWILIO_ACCOUNT_SID and
+TWILIO_AUTH_TOKEN) so outbound calls never leave the machine.
+
+    python benchmarks/fake_twilio.py --port 8099 --latency-ms 80
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+CALLS_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<account>AC\w+)/Calls(?:/(?P<sid>CA\w+))?\.json$')
+
+
+class FakeTwilio:
+    """Thread-safe record of the calls created and updated through the fake API."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.updates = 0
+        self._lock = threading.Lock()
+
+    def create_call(self, account_sid, form):
+        sid = 'CA' + uuid.uuid4().hex
+        call = {
+            'sid': sid,
+            'account_sid': account_sid,
+            'to': form.get('To'),
+            'from': form.get('From'),
+            'status': 'queued',
+            'direction': 'outbound-api',
+            'date_created': format_datetime(datetime.now(timezone.utc)),
+            'uri': f"/2010-04-01/Accounts/{account_sid}/Calls/{sid}.json",
+        }
+        with self._lock:
+            self.calls[sid] = call
+        return call
+
+    def update_call(self, account_sid, sid, form):
+        with self._lock:
+            call = self.calls.get(sid)
+            self.updates += 1
+            if call is None:
+                return None
+            if form.get('Status'):
+                call['status'] = form['Status']
+            return dict(call)
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                match = CALLS_PATH.match(self.path.split('?', 1)[0])
+                if match is None:
+                    return self._reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if match.group('sid') is None:
+                    return self._reply(201, fake.create_call(match.group('account'), form))
+                call = fake.update_call(match.group('account'), match.group('sid'), form)
+                if call is None:
+                    return self._reply(404, {'code': 20404, 'message': 'Call not found', 'status': 404})
+                return self._reply(200, call)
+
+        return Handler
+
+    def serve(self, host='127.0.0.1', port=8099):
+        """Start serving in a daemon thread; returns the server (call shutdown() to stop)."""
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='fake-twilio', daemon=True).start()
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="delay added to every API response")
+    args = parser.parse_args()
+    fake = FakeTwilio(latency=args.latency_ms / 1000)
+    fake.serve(args.host, args.port)
+    print(f"Fake Twilio API listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"Created {len(fake.calls)} calls, {fake.updates} updates")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Load test the Flask backend with simulated Twilio call flows.
+
+Each virtual call replays what Twilio and the dashboard would send:
+/request_call, status callbacks, /voice, the IVR Gather steps (following
+the action URLs in the returned TwiML, answering a name and then an age),
+for callers put on hold the <Enqueue> wait URL and, when they hang up, its
+action URL, then the completion callback, plus optional dashboard polling. Calls run at a
+fixed concurrency and the report shows p50/p95/p99 latency and throughput
+per endpoint. A fake Twilio REST API runs in-process, so start the backend
+pointed at it, against a database prepared with seed_dataset.py, and with
+the /request_call rate limits off (every simulated caller is 127.0.0.1):
+
+    TWILIO_API_BASE_URL=http://127.0.0.1:8099 TWILIO_ACCOUNT_SID=ACbench TWILIO_AUTH_TOKEN=bench \\
+        RATE_LIMIT_ENABLED=false gunicorn -w 4 -b 127.0.0.1:5000 test_call_app:app
+    python benchmarks/load_test.py --calls 2000 --concurrency 50 --json results.json
+
+Pass --baseline results.json to fail (exit 1) when any endpoint's p95 is
+more than --max-regression slower than in the baseline run. The hold queue
+must be empty before and after a run (callers left waiting would skew the
+dispatcher and every later run); reset it with seed_dataset.py otherwise.
+"""
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import requests
+
+from fake_twilio import FakeTwilio
+
+GATHER_ACTION = re.compile(r'<Gather[^>]*\saction="([^"]+)"')
+ENQUEUE_TAG = re.compile(r'<Enqueue([^>]*)>')
+ATTRIBUTE = re.compile(r'\s([A-Za-z]+)="([^"]*)"')
+FIRST_NAMES = ('Ada', 'Grace', 'Alan', 'Edsger', 'Barbara', 'Donald', 'Frances', 'Ken', 'Radia', 'Linus')
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """Latency samples and error counts per endpoint label."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, ok):
+        with self._lock:
+            self.samples[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def report(self, elapsed):
+        rows = {}
+        for label in sorted(self.samples):
+            samples = sorted(self.samples[label])
+            row = {'count': len(samples), 'errors': self.errors[label], 'rps': round(len(samples) / elapsed, 1),
+                   'mean_ms': round(statistics.fmean(samples) * 1000, 2)}
+            for p in PERCENTILES:
+                # Nearest-rank percentile
+                index = max(0, min(len(samples) - 1, int(round(p / 100 * len(samples))) - 1))
+                row[f"p{p}_ms"] = round(samples[index] * 1000, 2)
+            rows[label] = row
+        return rows
+
+
+class CallSimulator:
+    """Plays one call flow against the backend, recording every request."""
+
+    def __init__(self, base_url, recorder, async_dispatch=False, dashboard_ratio=0.0, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.async_dispatch = async_dispatch
+        self.dashboard_ratio = dashboard_ratio
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # One keep-alive session per worker thread
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _send(self, label, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.add(label, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def _twilio_form(self, call_sid, phone_number, **extra):
+        form = {'AccountSid': 'ACbench', 'CallSid': call_sid, 'From': '+19787836427', 'To': phone_number,
+                'Direction': 'outbound-api'}
+        form.update(extra)
+        return form
+
+    def _status(self, call_sid, phone_number, status, sequence, duration=None):
+        form = self._twilio_form(call_sid, phone_number, CallStatus=status, SequenceNumber=str(sequence),
+                                 Timestamp=format_datetime(datetime.now(timezone.utc)))
+        if duration is not None:
+            form['CallDuration'] = str(duration)
+        self._send('POST /twilio_status_callback', 'POST', '/twilio_status_callback', data=form)
+
+    def _place_call(self, phone_number):
+        body = {'phoneNumber': phone_number, 'async': self.async_dispatch}
+        response = self._send('POST /request_call', 'POST', '/request_call', json=body)
+        if response is None:
+            return None
+        data = response.json()
+        if response.status_code != 202:
+            return data.get('call_sid')
+        # Async dispatch: poll the request until the call has been placed
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            polled = self._send('GET /api/calls/<request_id>', 'GET', data['status_url'])
+            if polled is not None:
+                status = polled.json()
+                if status.get('call_sid'):
+                    return status['call_sid']
+                if status.get('status') == 'failed':
+                    return None
+            time.sleep(0.05)
+        return None
+
+    def run(self, index):
+        rng = random.Random(index)
+        phone_number = '+1555' + str(rng.randrange(10 ** 7)).zfill(7)
+        call_sid = self._place_call(phone_number)
+        if call_sid is None:
+            return False
+        sequence = 0
+        for status in ('initiated', 'ringing', 'in-progress'):
+            self._status(call_sid, phone_number, status, sequence)
+            sequence += 1
+
+        response = self._send('POST /voice', 'POST', '/voice', data=self._twilio_form(call_sid, phone_number))
+        answers = [f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}son", str(rng.randint(18, 90))]
+        for answer in answers:
+            match = GATHER_ACTION.search(response.text) if response is not None else None
+            if match is None:
+                break
+            action = match.group(1).replace('&amp;', '&')
+            label = 'POST ' + re.sub(r'\?.*$', '', action)
+            response = self._send(label, 'POST', action, data=self._twilio_form(call_sid, phone_number, SpeechResult=answer))
+
+        # No agent free: the caller is on hold until they hang up
+        enqueue = ENQUEUE_TAG.search(response.text) if response is not None else None
+        queue = dict(ATTRIBUTE.findall(enqueue.group(1))) if enqueue is not None else {}
+        if queue.get('waitUrl'):
+            self._send('POST /queue/wait', 'POST', queue['waitUrl'], data=self._twilio_form(call_sid, phone_number))
+        enqueued_at = time.monotonic()
+
+        if self.dashboard_ratio and rng.random() < self.dashboard_ratio:
+            self._send('GET /api/metrics/summary', 'GET', '/api/metrics/summary')
+            self._send('GET /api/calls', 'GET', '/api/calls', params={'limit': 50})
+
+        if queue.get('action'):
+            self._send('POST /queue/leave', 'POST', queue['action'], data=self._twilio_form(
+                call_sid, phone_number, QueueResult='hangup', QueueTime=str(round(time.monotonic() - enqueued_at))))
+        self._status(call_sid, phone_number, 'completed', sequence, duration=rng.randint(30, 600))
+        return response is not None
+
+    def queue_depth(self):
+        """Callers currently waiting in the hold queue, or None if the backend didn't say."""
+        response = self._send('GET /api/queue/metrics', 'GET', '/api/queue/metrics')
+        return response.json().get('depth') if response is not None else None
+
+
+def compare(results, baseline, max_regression):
+    """Return the endpoints whose p95 regressed beyond the allowed ratio."""
+    regressions = []
+    for label, row in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(label)
+        if before and before['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append((label, before['p95_ms'], row['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=25)
+    parser.add_argument('--async-dispatch', action='store_true', help="use the 202 /request_call mode")
+    parser.add_argument('--dashboard-ratio', type=float, default=0.1, help="share of calls that also poll the dashboard")
+    parser.add_argument('--twilio-port', type=int, default=8099)
+    parser.add_argument('--twilio-latency-ms', type=float, default=50.0, help="simulated Twilio API latency")
+    parser.add_argument('--no-fake-twilio', action='store_true', help="a fake Twilio server is already running")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="allowed p95 slowdown vs baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    fake = None
+    if not args.no_fake_twilio:
+        fake = FakeTwilio(latency=args.twilio_latency_ms / 1000)
+        server = fake.serve(port=args.twilio_port)
+
+    recorder = Recorder()
+    simulator = CallSimulator(args.base_url, recorder, async_dispatch=args.async_dispatch,
+                              dashboard_ratio=args.dashboard_ratio)
+    depth_before = simulator.queue_depth()
+    if depth_before:
+        print(f"WARNING: {depth_before} callers are already waiting in the hold queue; "
+              f"reset the database with seed_dataset.py for comparable runs")
+    print(f"Replaying {args.calls} calls at concurrency {args.concurrency} against {args.base_url}...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        completed = sum(executor.map(simulator.run, range(args.calls)))
+    elapsed = time.perf_counter() - started
+    depth_after = simulator.queue_depth()
+    if fake is not None:
+        server.shutdown()
+
+    results = {
+        'calls': args.calls,
+        'concurrency': args.concurrency,
+        'completed_flows': completed,
+        'elapsed_seconds': round(elapsed, 2),
+        'flows_per_second': round(completed / elapsed, 2),
+        'endpoints': recorder.report(elapsed),
+        'queue_depth': {'before': depth_before, 'after': depth_after},
+    }
+    print(f"\n{'endpoint':<34} {'count':>7} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, row in results['endpoints'].items():
+        print(f"{label:<34} {row['count']:>7} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+    print(f"\n{completed}/{args.calls} call flows completed in {elapsed:.1f}s ({results['flows_per_second']} flows/s)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = False
+    if depth_before is not None and depth_after is not None and depth_after > depth_before:
+        print(f"QUEUE LEAK: {depth_after - depth_before} simulated callers were left waiting in the hold queue")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for label, before, after in regressions:
+            print(f"REGRESSION {label}: p95 {before:.2f}ms -> {after:.2f}ms")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
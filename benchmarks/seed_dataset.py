@@ -0,0 +1,95 @@
+"""
+Seed a local PostgreSQL database with a reproducible load-test dataset.
+
+Applies the migrations, then (optionally after wiping the call centre
+tables) inserts agents and a history of calls spread over the last
+`--days` days, and rebuilds the rollups so the dashboard endpoints have
+realistic data to aggregate. The same --seed always produces the same data.
+
+    DATABASE_URL=postgresql://localhost/callcentre_bench python benchmarks/seed_dataset.py --reset --calls 200000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import call_archive  # noqa: E402
+import migrations  # noqa: E402
+import rollups  # noqa: E402
+
+RESET_TABLES = (
+    'rate_limit_buckets', 'idempotency_keys', 'call_archives', 'queued_calls', 'ivr_sessions', 'call_requests',
+    'call_events', 'campaign_numbers', 'campaigns', 'call_rollups_hourly', 'call_rollups_daily', 'metrics_cache',
+    'call_sids', 'calls', 'agents',
+)
+
+
+def seed(conn, calls, agents, days, available_ratio, seed_value):
+    with conn.cursor() as cursor:
+        # Monthly partitions for the whole history, so no seeded call lands in calls_default
+        call_archive.ensure_partitions(cursor, since=datetime.now(timezone.utc) - timedelta(days=days))
+        # setseed() makes random() repeatable for the rest of the session
+        cursor.execute("SELECT setseed(%s)", (seed_value,))
+        cursor.execute("""
+            INSERT INTO agents (name, phone_number, status, last_status_update)
+            SELECT 'Load Agent ' || i, '+1444' || lpad(i::text, 7, '0'),
+                   CASE WHEN random() < %(available)s THEN 'available' ELSE 'offline' END,
+                   now() - (i || ' minutes')::interval
+            FROM generate_series(1, %(agents)s) AS i
+            ON CONFLICT (phone_number) DO NOTHING
+        """, {'agents': agents, 'available': available_ratio})
+        cursor.execute("""
+            INSERT INTO calls (call_sid, caller_number, agent_id, start_time, end_time, duration, status, ai_interaction_summary)
+            SELECT 'CASEED' || md5(i::text), '+1555' || lpad((i %% 10000000)::text, 7, '0'),
+                   a.id, t.start_time, t.start_time + (d.secs || ' seconds')::interval, d.secs,
+                   CASE WHEN i %% 10 < 8 THEN 'completed' WHEN i %% 10 = 8 THEN 'failed' ELSE 'no-answer' END,
+                   'Name: Caller ' || i || ', Age: ' || (18 + i %% 60)
+            FROM generate_series(1, %(calls)s) AS i,
+                 LATERAL (SELECT now() - random() * %(days)s * INTERVAL '1 day' AS start_time) t,
+                 LATERAL (SELECT (30 + random() * 600)::int AS secs) d,
+                 LATERAL (SELECT id FROM agents ORDER BY id OFFSET (i %% %(agents)s) LIMIT 1) a
+            -- call_sid is only unique per start_time on the partitioned table, so skip re-seeded calls explicitly
+            WHERE NOT EXISTS (SELECT 1 FROM calls x WHERE x.call_sid = 'CASEED' || md5(i::text))
+        """, {'calls': calls, 'agents': agents, 'days': days})
+        cursor.execute("ANALYZE agents; ANALYZE calls;")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200_000)
+    parser.add_argument('--agents', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--available-ratio', type=float, default=0.8, help="share of agents seeded as available")
+    parser.add_argument('--seed', type=float, default=0.42, help="random seed in [-1, 1]")
+    parser.add_argument('--reset', action='store_true', help="empty the call centre tables first")
+    args = parser.parse_args()
+
+    dsn = os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit("Set DATABASE_URL (or BENCH_DATABASE_URL) to a scratch PostgreSQL database.")
+
+    conn = psycopg2.connect(dsn)
+    try:
+        migrations.run_migrations(conn)
+        if args.reset:
+            with conn.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY CASCADE")
+            conn.commit()
+        print(f"Seeding {args.agents} agents and {args.calls:,} calls over {args.days} days...")
+        started = time.perf_counter()
+        seed(conn, args.calls, args.agents, args.days, args.available_ratio, args.seed)
+        print(f"Seeded in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        rollups.rebuild(conn)
+        print(f"Rebuilt rollups in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+Monthly partitions of the calls table, and archival of old months.
+
+Since migration 12, calls is range-partitioned on start_time into one
+partition per UTC month (calls_YYYY_MM) plus calls_default, which holds
+calls without a start_time and any that fall outside the existing months.
+Queries bounded on start_time (the dashboard summary, dated call log
+pages, rollups rebuilds) only scan the months they cover.
+
+ensure_partitions() keeps the next few months created ahead of time.
+archive_expired() writes every month that ended more than `retain_days`
+ago to a gzip'd NDJSON file, records it in call_archives, then detaches
+and drops the partition, so the hot table and its indexes stay bounded.
+Archived calls remain readable on demand through iter_archived_calls().
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+
+import change_tracking
+import fast_json
+from advisory_locks import ARCHIVE_LOCK_ID, PARTITION_LOCK_ID
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^calls_(\d{4})_(\d{2})$')
+PARTITION_MONTHS_AHEAD = 3
+
+ARCHIVE_GZIP_LEVEL = 6
+# Detaching needs a brief exclusive lock on calls; give up rather than stall traffic behind it
+DETACH_LOCK_TIMEOUT = '5s'
+
+
+def month_start(ts):
+    return ts.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"calls_{month:%Y_%m}"
+
+
+def partition_range(name):
+    """[start, end) of a monthly partition, from its name."""
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        raise ValueError(f"Not a monthly calls partition: {name}")
+    start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+    return start, add_months(start, 1)
+
+
+def list_partitions(cursor):
+    """Monthly partitions currently attached to calls, oldest first, as (name, start, end)."""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'calls'::regclass
+    """)
+    names = sorted(row[0] for row in cursor.fetchall() if PARTITION_NAME.match(row[0]))
+    return [(name, *partition_range(name)) for name in names]
+
+
+def create_partition(cursor, month):
+    """Create the partition for `month`, moving any of its rows out of calls_default first."""
+    name = partition_name(month)
+    start, end = partition_range(name)
+    # Our own timestamps, not user input; literals because partition bounds can't be parameters
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM calls_default WHERE start_time >= %s AND start_time < %s)", (start, end))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF calls FOR VALUES {bounds}")
+        return name
+    # A new range can't be added while calls_default holds rows that belong in it
+    cursor.execute(f"CREATE TABLE {name} (LIKE calls INCLUDING DEFAULTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM calls_default WHERE start_time >= %s AND start_time < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    cursor.execute(f"ALTER TABLE calls ATTACH PARTITION {name} FOR VALUES {bounds}")
+    # The DELETE unregistered the moved call_sids but the detached INSERT didn't fire the trigger (migration 17)
+    cursor.execute(f"INSERT INTO call_sids (call_sid) SELECT call_sid FROM {name} WHERE call_sid IS NOT NULL")
+    return name
+
+
+def ensure_partitions(cursor, months_ahead=PARTITION_MONTHS_AHEAD, since=None, now=None):
+    """Create missing monthly partitions from `since` (default: this month) to `months_ahead` months out.
+
+    Months that were already archived are never recreated. Returns the names created; caller commits.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+    now = now or datetime.now(timezone.utc)
+    existing = {name for name, _, _ in list_partitions(cursor)}
+    cursor.execute("SELECT to_regclass('call_archives') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT partition_name FROM call_archives")
+        existing.update(row[0] for row in cursor.fetchall())
+    created = []
+    month = month_start(min(since, now) if since else now)
+    last = add_months(month_start(now), months_ahead)
+    while month <= last:
+        if partition_name(month) not in existing:
+            created.append(create_partition(cursor, month))
+        month = add_months(month, 1)
+    if created:
+        logger.info(f"Created calls partitions: {', '.join(created)}")
+    return created
+
+
+def _export(conn, name, path):
+    """Write every row of partition `name` to `path` as gzip'd NDJSON. Returns the row count."""
+    rows = 0
+    with open(path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=ARCHIVE_GZIP_LEVEL) as out:
+            with conn.cursor(name=f"archive_{name}") as source:
+                source.itersize = 5000
+                source.execute(f"SELECT * FROM {name} ORDER BY start_time, id")
+                fields = None
+                for row in source:
+                    if fields is None:
+                        fields = [column[0] for column in source.description]
+                    out.write(fast_json.dumps(dict(zip(fields, row))) + b'\n')
+                    rows += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    return rows
+
+
+def _digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def archive_partition(conn, name, archive_dir):
+    """Archive one monthly partition to `archive_dir`, then detach and drop it. Commits.
+
+    Writes to the month are blocked (SHARE lock) from the start of the export
+    until the partition is gone, so the file holds exactly what is dropped.
+    """
+    start, end = partition_range(name)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(archive_dir, f"{name}.ndjson.gz"))
+    tmp_path = path + '.tmp'
+    published = False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {name} IN SHARE MODE")
+        rows = _export(conn, name, tmp_path)
+        os.replace(tmp_path, path)
+        published = True
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO call_archives (partition_name, range_start, range_end, path, row_count, size_bytes, sha256)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (name, start, end, path, rows, os.path.getsize(path), _digest(path)))
+            cursor.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+            cursor.execute(f"ALTER TABLE calls DETACH PARTITION {name}")
+            # Dropping a partition fires no row triggers (see migration 17)
+            cursor.execute(f"DELETE FROM call_sids WHERE call_sid IN (SELECT call_sid FROM {name})")
+            cursor.execute(f"DROP TABLE {name}")
+            # DDL doesn't fire the statement triggers; cached call lists must still revalidate
+            change_tracking.record_change(cursor, 'calls')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # The partition is still in place, so no file may claim to hold it
+        for leftover in (tmp_path, path) if published else (tmp_path,):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    logger.info(f"Archived {rows} calls from {name} to {path}")
+    return {'partition': name, 'path': path, 'rows': rows}
+
+
+def archive_expired(conn, archive_dir, retain_days, now=None):
+    """Archive every monthly partition that ended more than `retain_days` ago.
+
+    Only one process archives at a time; others return [] immediately.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=retain_days)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (ARCHIVE_LOCK_ID,))
+        locked = cursor.fetchone()[0]
+        partitions = list_partitions(cursor) if locked else []
+    conn.commit()
+    if not locked:
+        return []
+    archived = []
+    try:
+        for name, _, end in partitions:
+            if end <= cutoff:
+                archived.append(archive_partition(conn, name, archive_dir))
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (ARCHIVE_LOCK_ID,))
+        conn.commit()
+    return archived
+
+
+def archived_until(cursor):
+    """End of the newest archived month (None when nothing has been archived)."""
+    cursor.execute("SELECT to_regclass('call_archives') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute("SELECT MAX(range_end) FROM call_archives")
+    return cursor.fetchone()[0]
+
+
+def list_archives(cursor, date_from=None, date_to=None):
+    """Catalogue entries whose month overlaps [date_from, date_to), oldest first."""
+    cursor.execute("""
+        SELECT partition_name, range_start, range_end, path, row_count, size_bytes, sha256, archived_at
+        FROM call_archives
+        WHERE (%(date_from)s::timestamptz IS NULL OR range_end > %(date_from)s)
+          AND (%(date_to)s::timestamptz IS NULL OR range_start < %(date_to)s)
+        ORDER BY range_start
+    """, {'date_from': date_from, 'date_to': date_to})
+    fields = [column[0] for column in cursor.description]
+    return [dict(zip(fields, row)) for row in cursor.fetchall()]
+
+
+def _as_utc(ts):
+    return ts if ts is None or ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def iter_archived_calls(archives, date_from=None, date_to=None, statuses=None, agent_id=None, caller_prefix=None):
+    """Yield archived calls (dicts, timestamps as ISO strings) from catalogue entries, filtered like /api/calls."""
+    date_from, date_to = _as_utc(date_from), _as_utc(date_to)
+    statuses = set(statuses) if statuses else None
+    for archive in archives:
+        with gzip.open(archive['path'], 'rb') as f:
+            for line in f:
+                call = fast_json.loads(line)
+                if statuses is not None and call.get('status') not in statuses:
+                    continue
+                if agent_id is not None and call.get('agent_id') != agent_id:
+                    continue
+                if caller_prefix and not (call.get('caller_number') or '').startswith(caller_prefix):
+                    continue
+                if date_from is not None or date_to is not None:
+                    start_time = call.get('start_time')
+                    if start_time is None:
+                        continue
+                    start_time = datetime.fromisoformat(start_time)
+                    if (date_from is not None and start_time < date_from) or (date_to is not None and start_time >= date_to):
+                        continue
+                yield call
+
+
+class CallArchiver:
+    """Background thread: keeps partitions created ahead and archives expired months.
+
+    Every worker runs one; the advisory locks make all but one of them a no-op.
+    retain_days=None only maintains partitions.
+    """
+
+    def __init__(self, pool, archive_dir, retain_days=None, interval=6 * 3600.0):
+        self.pool = pool
+        self.archive_dir = archive_dir
+        self.retain_days = retain_days
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'runs': 0, 'partitions_created': 0, 'partitions_archived': 0, 'failures': 0}
+
+    def run_once(self):
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                created = ensure_partitions(cursor)
+            conn.commit()
+            archived = archive_expired(conn, self.archive_dir, self.retain_days) if self.retain_days else []
+        finally:
+            self.pool.putconn(conn)
+        self._stats['runs'] += 1
+        self._stats['partitions_created'] += len(created)
+        self._stats['partitions_archived'] += len(archived)
+        return {'created': created, 'archived': archived}
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self._stats['failures'] += 1
+                logger.error(f"Call partition maintenance failed: {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='call-archiver', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats)
@@ -0,0 +1,279 @@
+"""
+Asynchronous dispatch of outbound callback requests.
+
+In async mode /request_call only validates the number, records a
+call_requests row and hands it to a background executor, so the gunicorn
+worker is free again straight away. The executor places the Twilio call
+(through the shared keep-alive HTTP session) and then records the call.
+Progress can be polled at /api/calls/<request_id>.
+
+A request is marked 'dispatching' before the Twilio call is placed, so a
+worker that dies (or loses the database) between the dial and recording it
+would leave the request stuck. A recovery thread in every worker reconciles
+requests 'dispatching' for longer than `dispatch_timeout`: with the CallSid if it got recorded, otherwise by
+looking the call up at Twilio, and as 'failed' when neither finds it.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+REQUEST_STATUSES = ('queued', 'dispatching', 'initiated', 'failed')
+
+
+class DispatchQueueFull(Exception):
+    """Raised when too many dispatches are already waiting in this process."""
+    code = 503
+
+
+# Claims stale 'dispatching' requests; bumping updated_at keeps other workers off them for another timeout
+CLAIM_STALE_DISPATCHING_QUERY = """
+    UPDATE call_requests SET updated_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM call_requests
+        WHERE status = 'dispatching' AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        ORDER BY updated_at
+        LIMIT 100
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, phone_number, call_sid, created_at
+"""
+MARK_INITIATED_QUERY = """
+    UPDATE call_requests SET status = 'initiated', call_sid = %s, updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s
+"""
+MARK_FAILED_QUERY = """
+    UPDATE call_requests SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s
+"""
+
+
+class CallDispatcher:
+    """Runs place_call(phone_number) off the request thread and tracks each request in call_requests.
+
+    `on_initiated(cursor, call_sid, phone_number)` records the new call inside
+    the same transaction that marks the request initiated. `find_call(phone_number,
+    since)` optionally looks up the CallSid of a call placed to the number
+    since then (None when there is none); it is used to reconcile requests
+    whose dial outcome was never recorded.
+    """
+
+    def __init__(self, pool, place_call, on_initiated, max_workers=8, max_pending=1000,
+                 find_call=None, dispatch_timeout=300.0, recovery_interval=60.0):
+        self.pool = pool
+        self.place_call = place_call
+        self.on_initiated = on_initiated
+        self.find_call = find_call
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # Longer than any dial can take, so a request still being dispatched is never reconciled
+        self.dispatch_timeout = dispatch_timeout
+        self.recovery_interval = recovery_interval
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'reconciled': 0, 'reconcile_failed': 0}
+
+    def _get_executor(self):
+        # Executor threads don't survive fork; each worker process gets its own
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='call-dispatch')
+                    self._pid = os.getpid()
+                    self._pending = 0
+        return self._executor
+
+    def submit(self, cursor, phone_number):
+        """Record a queued request in the caller's transaction and schedule it once committed.
+
+        Returns (request_id, start) where start() must be called after commit.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise DispatchQueueFull("Too many callback requests in progress, please retry shortly")
+        request_id = str(uuid.uuid4())
+        cursor.execute(
+            "INSERT INTO call_requests (id, phone_number, status) VALUES (%s, %s, 'queued')",
+            (request_id, phone_number)
+        )
+
+        def start():
+            executor = self._get_executor()
+            with self._lock:
+                self._pending += 1
+            executor.submit(self._dispatch, request_id)
+        return request_id, start
+
+    def _dispatch(self, request_id):
+        try:
+            self._run(request_id)
+        except Exception as e:
+            logger.error(f"Dispatch of call request {request_id} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _run(self, request_id):
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                # Claim the request so a retry or recovery pass never dials it twice
+                cursor.execute("""
+                    UPDATE call_requests SET status = 'dispatching', updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND status = 'queued'
+                    RETURNING phone_number
+                """, (request_id,))
+                row = cursor.fetchone()
+                conn.commit()
+                if row is None:
+                    return
+                phone_number = row[0]
+                try:
+                    call_sid = self.place_call(phone_number)
+                except Exception as e:
+                    logger.error(f"Error initiating call for {phone_number}: {e}")
+                    cursor.execute(MARK_FAILED_QUERY, (str(e)[:500], request_id))
+                    conn.commit()
+                    return
+                try:
+                    cursor.execute(MARK_INITIATED_QUERY, (call_sid, request_id))
+                    self.on_initiated(cursor, call_sid, phone_number)
+                    conn.commit()
+                except Exception:
+                    self._remember_call_sid(request_id, call_sid)
+                    raise
+                logger.info(f"Dispatched call request {request_id} as {call_sid}")
+        except Exception as e:
+            broken = isinstance(e, psycopg2.OperationalError)
+            raise
+        finally:
+            # putconn rolls back anything left uncommitted
+            self.pool.putconn(conn, close=broken)
+
+    def _remember_call_sid(self, request_id, call_sid):
+        """Best effort, on a fresh connection: keep the CallSid of a placed call for reconcile_stale()."""
+        try:
+            conn = self.pool.getconn()
+        except Exception as e:
+            logger.error(f"Could not record CallSid {call_sid} for call request {request_id}: {str(e)}")
+            return
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE call_requests SET call_sid = %s WHERE id = %s AND status = 'dispatching'",
+                    (call_sid, request_id)
+                )
+            conn.commit()
+        except Exception as e:
+            broken = isinstance(e, psycopg2.OperationalError)
+            logger.error(f"Could not record CallSid {call_sid} for call request {request_id}: {str(e)}")
+        finally:
+            self.pool.putconn(conn, close=broken)
+
+    def reconcile_stale(self, cursor):
+        """Settle requests stuck in 'dispatching' for longer than dispatch_timeout (commits per request).
+
+        The dial may or may not have happened. With a known CallSid (or one
+        find_call turns up) the request is initiated and the call recorded;
+        otherwise it is failed, never retried, since the call may exist.
+        """
+        cursor.execute(CLAIM_STALE_DISPATCHING_QUERY, (self.dispatch_timeout,))
+        stale = cursor.fetchall()
+        cursor.connection.commit()
+        for request_id, phone_number, call_sid, created_at in stale:
+            request_id = str(request_id)
+            error = None if self.find_call is not None else "Dispatch interrupted; the call may have been placed"
+            if call_sid is None and self.find_call is not None:
+                try:
+                    call_sid = self.find_call(phone_number, created_at)
+                except Exception as e:
+                    error = f"Dispatch interrupted and the call could not be looked up: {str(e)}"[:500]
+            if call_sid is not None:
+                cursor.execute(MARK_INITIATED_QUERY, (call_sid, request_id))
+                self.on_initiated(cursor, call_sid, phone_number)
+                self._stats['reconciled'] += 1
+                logger.warning(f"Reconciled stale call request {request_id} as {call_sid}")
+            else:
+                cursor.execute(MARK_FAILED_QUERY, (error or "Dispatch interrupted; no call was placed", request_id))
+                self._stats['reconcile_failed'] += 1
+                logger.warning(f"Failed stale call request {request_id}: {error or 'no call found'}")
+            cursor.connection.commit()
+        return len(stale)
+
+    def _reconcile_once(self):
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                self.reconcile_stale(cursor)
+        except Exception as e:
+            broken = isinstance(e, psycopg2.OperationalError)
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken)
+
+    def _recover_loop(self):
+        while not self._stop.wait(self.recovery_interval):
+            try:
+                self._reconcile_once()
+            except Exception as e:
+                logger.error(f"Reconciling stale call requests failed: {str(e)}")
+
+    def start_recovery(self):
+        """Run reconcile_stale() every recovery_interval seconds in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._recover_loop, name='call-request-recovery', daemon=True)
+        self._thread.start()
+
+    def stop_recovery(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def resubmit_stale(self, cursor, older_than_seconds=60):
+        """Schedule requests left 'queued' by a worker that died before dispatching them."""
+        cursor.execute("""
+            SELECT id FROM call_requests
+            WHERE status = 'queued' AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY created_at LIMIT 1000
+        """, (older_than_seconds,))
+        stale = [row[0] for row in cursor.fetchall()]
+        executor = self._get_executor()
+        for request_id in stale:
+            with self._lock:
+                self._pending += 1
+            executor.submit(self._dispatch, str(request_id))
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._pending, max_pending=self.max_pending, workers=self.max_workers)
+
+
+def get_request(cursor, request_id):
+    cursor.execute("""
+        SELECT r.id, r.phone_number, r.status, r.call_sid, r.error, r.created_at, r.updated_at,
+               c.status AS call_status
+        FROM call_requests r
+        LEFT JOIN calls c ON c.call_sid = r.call_sid
+        WHERE r.id = %s
+    """, (str(request_id),))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    result = dict(zip([d[0] for d in cursor.description], row))
+    result['id'] = str(result['id'])
+    return result
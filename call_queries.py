@@ -0,0 +1,203 @@
+"""
+Query building for the call log API.
+
+Call logs are paged with a keyset cursor on (start_time, id) instead of
+OFFSET, so every page is an index range scan no matter how deep it is, and
+only the requested columns are selected.
+"""
+import base64
+import csv
+import io
+import json
+from datetime import date, datetime
+
+import fast_json
+from fast_json import RowSet
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Public column name -> SQL expression. agent_name comes from a join so the
+# frontend doesn't need a second request to resolve agent ids.
+CALL_COLUMNS = {
+    'id': 'c.id',
+    'call_sid': 'c.call_sid',
+    'caller_number': 'c.caller_number',
+    'agent_id': 'c.agent_id',
+    'agent_name': 'a.name',
+    'start_time': 'c.start_time',
+    'end_time': 'c.end_time',
+    'duration': 'c.duration',
+    'status': 'c.status',
+    'recording_url': 'c.recording_url',
+    'ai_interaction_summary': 'c.ai_interaction_summary',
+}
+
+# Needed to build the next cursor, so always selected
+KEY_COLUMNS = ('id', 'start_time')
+
+
+def parse_fields(fields_param):
+    """Turn a comma-separated `fields` parameter into an ordered column list."""
+    if not fields_param:
+        return list(CALL_COLUMNS)
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in CALL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    for key in KEY_COLUMNS:
+        if key not in fields:
+            fields.append(key)
+    return fields
+
+
+def parse_limit(limit_param):
+    if not limit_param:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit_param)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _parse_timestamp(value, name):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or timestamp")
+
+
+def encode_cursor(start_time, call_id):
+    payload = json.dumps([start_time.isoformat() if start_time else None, call_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        start_time, call_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (datetime.fromisoformat(start_time) if start_time else None), int(call_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def build_filters(args):
+    """Build the WHERE clause and parameters from request query args."""
+    clauses = []
+    params = {}
+
+    status = args.get('status')
+    if status:
+        clauses.append("c.status = ANY(%(statuses)s)")
+        params['statuses'] = [s.strip() for s in status.split(',') if s.strip()]
+
+    agent_id = args.get('agent_id')
+    if agent_id:
+        try:
+            params['agent_id'] = int(agent_id)
+        except ValueError:
+            raise ValueError("agent_id must be an integer")
+        clauses.append("c.agent_id = %(agent_id)s")
+
+    date_from = args.get('from')
+    if date_from:
+        clauses.append("c.start_time >= %(date_from)s")
+        params['date_from'] = _parse_timestamp(date_from, 'from')
+
+    date_to = args.get('to')
+    if date_to:
+        clauses.append("c.start_time < %(date_to)s")
+        params['date_to'] = _parse_timestamp(date_to, 'to')
+
+    caller_number = args.get('caller_number')
+    if caller_number:
+        # Prefix match so a btree index on caller_number can still be used
+        escaped = caller_number.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("c.caller_number LIKE %(caller_number)s")
+        params['caller_number'] = escaped + '%'
+
+    return clauses, params
+
+
+def build_page_query(args):
+    """Return (sql, params, fields, limit) for one page of call logs.
+
+    Rows are ordered newest first; calls without a start_time sort last.
+    One extra row is fetched to know whether another page exists.
+    """
+    fields = parse_fields(args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    clauses, params = build_filters(args)
+
+    # Dated rows and undated rows are fetched as two index-ordered branches;
+    # the second one only runs when the first runs out of rows.
+    dated = clauses + ["c.start_time IS NOT NULL"]
+    undated = clauses + ["c.start_time IS NULL"]
+    cursor = args.get('cursor')
+    if cursor:
+        after_time, after_id = decode_cursor(cursor)
+        params['after_id'] = after_id
+        if after_time is None:
+            dated = None
+            undated.append("c.id < %(after_id)s")
+        else:
+            params['after_time'] = after_time
+            dated.append("(c.start_time, c.id) < (%(after_time)s, %(after_id)s)")
+
+    params['limit'] = limit + 1
+    undated_sql = f"({_select(fields, undated)} ORDER BY c.id DESC LIMIT %(limit)s)"
+    if dated is None:
+        sql = undated_sql
+    else:
+        dated_sql = f"({_select(fields, dated)} ORDER BY c.start_time DESC, c.id DESC LIMIT %(limit)s)"
+        sql = f"{dated_sql} UNION ALL {undated_sql} LIMIT %(limit)s"
+    return sql, params, fields, limit
+
+
+def build_export_query(args):
+    """Return (sql, params, fields) for a full, unpaged export."""
+    fields = parse_fields(args.get('fields'))
+    clauses, params = build_filters(args)
+    sql = _select(fields, clauses) + " ORDER BY c.start_time DESC NULLS LAST, c.id DESC"
+    return sql, params, fields
+
+
+def _select(fields, clauses):
+    columns = ', '.join(f"{CALL_COLUMNS[f]} AS {f}" for f in fields)
+    # Only join agents when the agent name was asked for
+    join = " LEFT JOIN agents a ON a.id = c.agent_id" if 'agent_name' in fields else ""
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"SELECT {columns} FROM calls c{join}{where}"
+
+
+def page_response(rows, fields, limit):
+    """Build the JSON page body from raw cursor tuples (serialized by fast_json without per-row dicts)."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[fields.index('start_time')], last[fields.index('id')])
+    return {'data': RowSet(fields, rows), 'next_cursor': next_cursor, 'limit': limit}
+
+
+def iter_ndjson(rows, fields):
+    for row in rows:
+        yield fast_json.dumps(dict(zip(fields, row))) + b'\n'
+
+
+def iter_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(v.isoformat() if isinstance(v, (datetime, date)) else v for v in row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, when there were no rows
+    if buffer.getvalue():
+        yield buffer.getvalue()
@@ -0,0 +1,303 @@
+"""
+Hold queue for callers who reach the end of the IVR while every agent is busy.
+
+The caller is parked on hold with TwiML <Enqueue> (Twilio plays the wait
+music) while the queue order itself lives in queued_calls: highest priority
+first, then arrival time, served by a partial index over waiting rows only.
+Whenever an agent may have been freed (an agent set to available, a call
+that just completed, or a periodic poll for frees seen by other workers)
+the dispatcher pops the next caller and claims an agent for them in one
+transaction, both with FOR UPDATE SKIP LOCKED, then redirects the held call
+to dial that agent. Every worker can run a dispatcher safely.
+
+A caller who hangs up on hold leaves the queue through the <Enqueue> action
+callback, but that can be late or lost; callers whose call has already ended
+are also dropped when their final status callback is written, and skipped
+(as abandoned) by the dispatcher, so an agent is never handed to nobody.
+"""
+import logging
+import math
+import threading
+import time
+
+import psycopg2
+
+import agent_assignment
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Results reported to the <Enqueue> action URL that mean the caller gave up or was dropped
+ABANDONED_RESULTS = ('hangup', 'leave', 'error', 'system-error', 'queue-full')
+
+WAIT_PERCENTILES = (0.5, 0.9, 0.95)
+
+
+ENQUEUE_QUERY = """
+    INSERT INTO queued_calls (call_sid, caller_number, priority)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (call_sid) DO NOTHING
+"""
+
+
+def enqueue(cursor, call_sid, caller_number=None, priority=0):
+    """Add a caller to the hold queue (idempotent per CallSid; caller commits)."""
+    cursor.execute(ENQUEUE_QUERY, (call_sid, caller_number, priority))
+
+
+def set_priority(cursor, call_sid, priority):
+    """Change a waiting caller's priority. Returns False if they are no longer waiting."""
+    cursor.execute(
+        "UPDATE queued_calls SET priority = %s WHERE call_sid = %s AND status = 'waiting'",
+        (priority, call_sid)
+    )
+    return cursor.rowcount > 0
+
+
+def mark_left(cursor, call_sid, queue_result, queue_time=None):
+    """Record a caller leaving the queue from Twilio's <Enqueue> action callback.
+
+    Returns True when the caller was still waiting and is now counted as abandoned.
+    """
+    if queue_result not in ABANDONED_RESULTS:
+        # 'redirected'/'bridged': the dispatcher already recorded the connection
+        return False
+    cursor.execute("""
+        UPDATE queued_calls
+        SET status = 'abandoned', left_at = CURRENT_TIMESTAMP,
+            wait_seconds = COALESCE(%s, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - enqueued_at))::INTEGER)
+        WHERE call_sid = %s AND status = 'waiting'
+    """, (queue_time, call_sid))
+    return cursor.rowcount > 0
+
+
+ABANDON_QUERY = """
+    UPDATE queued_calls
+    SET status = 'abandoned', left_at = CURRENT_TIMESTAMP,
+        wait_seconds = EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - enqueued_at))::INTEGER
+    WHERE call_sid = ANY(%s) AND status = 'waiting'
+"""
+
+
+def abandon_ended(cursor, call_sids):
+    """Count callers whose call just ended while still waiting as abandoned (caller commits)."""
+    cursor.execute(ABANDON_QUERY, (list(call_sids),))
+    return cursor.rowcount
+
+
+def dequeue_next(cursor, strategy=None):
+    """Pop the next waiting caller and claim an agent for them (caller commits).
+
+    Returns {'call_sid', 'agent', 'wait_seconds', 'call_status'} or None when
+    nobody is waiting or no agent is free. Waiting callers whose call can no
+    longer be transferred (it ended, or has no calls row) are marked abandoned
+    on the way. Rolling back undoes both claims.
+    """
+    while True:
+        cursor.execute("""
+            SELECT q.call_sid, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - q.enqueued_at))::INTEGER, c.status,
+                   c.call_sid IS NULL OR call_status_rank(c.status) >= call_status_rank('transferred')
+            FROM queued_calls q
+            LEFT JOIN calls c ON c.call_sid = q.call_sid
+            WHERE q.status = 'waiting'
+            ORDER BY q.priority DESC, q.enqueued_at, q.call_sid
+            LIMIT 1
+            FOR UPDATE OF q SKIP LOCKED
+        """)
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        call_sid, wait_seconds, call_status, gone = row
+        if not gone:
+            break
+        abandon_ended(cursor, [call_sid])
+        logger.info(f"Dropped queued call {call_sid} from the queue: its call is {call_status or 'missing'}")
+    # Also returns None if the call ended since the read above; the next run drops it then
+    agent = agent_assignment.claim_agent(cursor, call_sid=call_sid, strategy=strategy)
+    if agent is None:
+        return None
+    cursor.execute("""
+        UPDATE queued_calls
+        SET status = 'connected', agent_id = %s, left_at = CURRENT_TIMESTAMP, wait_seconds = %s
+        WHERE call_sid = %s
+    """, (agent['id'], wait_seconds, call_sid))
+    return {'call_sid': call_sid, 'agent': agent, 'wait_seconds': wait_seconds, 'call_status': call_status}
+
+
+def queue_metrics(cursor, window_hours=24):
+    """Queue depth, longest current wait, wait percentiles and abandonment over the window."""
+    cursor.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE status = 'waiting'),
+            MAX(EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - enqueued_at))) FILTER (WHERE status = 'waiting'),
+            COUNT(*) FILTER (WHERE status = 'connected'),
+            COUNT(*) FILTER (WHERE status = 'abandoned'),
+            percentile_cont(%(fractions)s::float8[]) WITHIN GROUP (ORDER BY wait_seconds)
+                FILTER (WHERE status = 'connected')
+        FROM queued_calls
+        WHERE status = 'waiting'
+           OR left_at >= CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 hour'
+    """, {'fractions': list(WAIT_PERCENTILES), 'window': window_hours})
+    depth, longest_wait, connected, abandoned, percentiles = cursor.fetchone()
+    left = connected + abandoned
+    return {
+        'depth': depth,
+        'longest_wait_seconds': round(longest_wait) if longest_wait is not None else 0,
+        'connected': connected,
+        'abandoned': abandoned,
+        'abandonment_rate': round(abandoned / left * 100, 1) if left else 0,
+        'wait_seconds': {
+            f"p{round(fraction * 100)}": round(value, 1) if value is not None else None
+            for fraction, value in zip(WAIT_PERCENTILES, percentiles or [None] * len(WAIT_PERCENTILES))
+        },
+        'window_hours': window_hours,
+    }
+
+
+class CallQueueDispatcher:
+    """Background thread that connects waiting callers to agents as they free up.
+
+    `connect_call(call_sid, agent)` redirects the held call to the agent and
+    raises if the call can no longer be redirected (e.g. the caller hung up).
+    `agents_available()` is an optional cheap check (e.g. the presence
+    registry) used to skip the database while nobody is free.
+    """
+
+    def __init__(self, pool, connect_call, strategy=None, agents_available=None, poll_interval=5.0,
+                 handle_time_window_hours=2, default_handle_time=180.0, handle_time_ttl=60.0):
+        self.pool = pool
+        self.connect_call = connect_call
+        self.strategy = strategy
+        self.agents_available = agents_available
+        self.poll_interval = poll_interval
+        self.handle_time_window_hours = handle_time_window_hours
+        self.default_handle_time = default_handle_time
+        self.handle_time_ttl = handle_time_ttl
+        self._handle_time = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'dispatched': 0, 'connect_failures': 0, 'runs': 0}
+
+    def notify(self):
+        """Wake the dispatcher, e.g. right after an agent was freed in this process."""
+        self._wake.set()
+
+    def average_handle_time(self, cursor):
+        """Rolling average talk time of agent-handled calls, read from the hourly rollups."""
+        cached = self._handle_time
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        cursor.execute("""
+            SELECT SUM(duration_sum)::float / NULLIF(SUM(duration_count), 0)
+            FROM call_rollups_hourly
+            WHERE bucket_start >= date_trunc('hour', CURRENT_TIMESTAMP) - %s * INTERVAL '1 hour'
+              AND agent_id <> %s AND status = 'completed'
+        """, (self.handle_time_window_hours, rollups.NO_AGENT))
+        value = cursor.fetchone()[0] or self.default_handle_time
+        self._handle_time = (value, time.monotonic() + self.handle_time_ttl)
+        return value
+
+    def estimate_wait(self, cursor, call_sid, staffed_agents=None):
+        """Return (position, estimated_seconds) for a waiting caller, or (None, None) if not waiting.
+
+        The estimate is the callers ahead of this one (plus this one) times
+        the average handle time, divided by the agents currently working.
+        """
+        cursor.execute("""
+            SELECT COUNT(q.call_sid)
+            FROM queued_calls me
+            LEFT JOIN queued_calls q
+              ON q.status = 'waiting'
+             AND (q.priority > me.priority
+                  OR (q.priority = me.priority AND (q.enqueued_at, q.call_sid) < (me.enqueued_at, me.call_sid)))
+            WHERE me.call_sid = %s AND me.status = 'waiting'
+            GROUP BY me.call_sid
+        """, (call_sid,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, None
+        position = row[0] + 1
+        if staffed_agents is None:
+            cursor.execute("SELECT COUNT(*) FROM agents WHERE status IN ('available', 'on_call')")
+            staffed_agents = cursor.fetchone()[0]
+        seconds = position * self.average_handle_time(cursor) / max(staffed_agents, 1)
+        return position, math.ceil(seconds)
+
+    def run_once(self, max_connects=50):
+        """Connect waiting callers until the queue or the free agents run out."""
+        self._stats['runs'] += 1
+        connected = 0
+        while connected < max_connects:
+            if self.agents_available is not None and self.agents_available() is False:
+                break
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                with conn.cursor() as cursor:
+                    item = dequeue_next(cursor, self.strategy)
+                conn.commit()
+            except Exception as e:
+                broken = isinstance(e, psycopg2.OperationalError)
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken)
+            if item is None:
+                break
+            try:
+                self.connect_call(item['call_sid'], item['agent'])
+                self._stats['dispatched'] += 1
+                logger.info(f"Connected queued call {item['call_sid']} to agent {item['agent']['id']} after {item['wait_seconds']}s")
+            except Exception as e:
+                self._stats['connect_failures'] += 1
+                logger.warning(f"Could not connect queued call {item['call_sid']}: {str(e)}")
+                self._undo_connect(item)
+            connected += 1
+        return connected
+
+    def _undo_connect(self, item):
+        # The caller is gone: count them as abandoned, unlink the call and hand the agent back
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE queued_calls SET status = 'abandoned' WHERE call_sid = %s",
+                    (item['call_sid'],)
+                )
+                # Unless a status callback has moved the call on since the claim
+                cursor.execute("""
+                    UPDATE calls SET agent_id = NULL, status = %s
+                    WHERE call_sid = %s AND agent_id = %s AND status = 'transferred'
+                """, (item['call_status'], item['call_sid'], item['agent']['id']))
+                cursor.execute("""
+                    UPDATE agents SET status = 'available', last_status_update = CURRENT_TIMESTAMP
+                    WHERE id = %s AND status = 'on_call'
+                """, (item['agent']['id'],))
+            conn.commit()
+        finally:
+            self.pool.putconn(conn)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Call queue dispatch failed: {str(e)}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='call-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats)
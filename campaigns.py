@@ -0,0 +1,393 @@
+"""
+Bulk outbound callback campaigns.
+
+A campaign is a batch of phone numbers stored in campaign_numbers. The
+CampaignDialer claims pending numbers with FOR UPDATE SKIP LOCKED, dials
+them from a thread pool through a token bucket (so the Twilio account's
+calls-per-second limit is respected), and never has more live campaign calls
+than there are available agents to take them. Transient Twilio failures are
+retried with exponential backoff, and results (including the new calls
+rows) are written back in bulk.
+
+Only one process dials at a time: the dialer holds a PostgreSQL advisory
+lock while it is the leader, so every gunicorn worker can run one safely.
+"""
+import csv
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extras
+
+import status_writer
+from advisory_locks import DIALER_LOCK_ID
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+E164_PATTERN = re.compile(r'^\+[1-9]\d{1,14}$')
+
+MAX_CAMPAIGN_NUMBERS = 100000
+CAMPAIGN_STATUSES = ('running', 'paused', 'canceled', 'completed')
+
+# A dialed campaign call holds a slot for an agent until it is transferred or ends,
+# but calls that never got a status callback stop counting after this long
+LIVE_CALL_WINDOW = '10 minutes'
+
+
+def normalize_numbers(numbers):
+    """Strip, validate (E.164) and de-duplicate numbers, keeping their order.
+
+    Returns (valid_numbers, invalid_numbers).
+    """
+    seen = set()
+    valid, invalid = [], []
+    for number in numbers:
+        number = str(number).strip().replace(' ', '').replace('-', '')
+        if not number:
+            continue
+        if not E164_PATTERN.match(number):
+            invalid.append(number)
+        elif number not in seen:
+            seen.add(number)
+            valid.append(number)
+    return valid, invalid
+
+
+def parse_numbers_csv(text):
+    """Read phone numbers from CSV text: the 'phone_number' column if there is a header, else column one."""
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        return []
+    header = [h.strip().lower() for h in rows[0]]
+    for name in ('phone_number', 'phonenumber', 'phone', 'number'):
+        if name in header:
+            column = header.index(name)
+            return [row[column] for row in rows[1:] if len(row) > column]
+    return [row[0] for row in rows if row]
+
+
+def create_campaign(cursor, name, numbers):
+    """Insert a campaign and its numbers in bulk. Returns the new campaign row as a dict."""
+    if not numbers:
+        raise ValueError("A campaign needs at least one valid phone number")
+    if len(numbers) > MAX_CAMPAIGN_NUMBERS:
+        raise ValueError(f"A campaign can have at most {MAX_CAMPAIGN_NUMBERS} numbers")
+    cursor.execute(
+        "INSERT INTO campaigns (name, status) VALUES (%s, 'running') RETURNING id, name, status, created_at",
+        (name,)
+    )
+    campaign_id, name, status, created_at = cursor.fetchone()
+    psycopg2.extras.execute_values(
+        cursor,
+        "INSERT INTO campaign_numbers (campaign_id, phone_number) VALUES %s",
+        [(campaign_id, number) for number in numbers],
+        page_size=1000
+    )
+    return {'id': campaign_id, 'name': name, 'status': status, 'created_at': created_at,
+            'total_numbers': len(numbers)}
+
+
+CAMPAIGN_PROGRESS_QUERY = """
+    SELECT c.id, c.name, c.status, c.created_at, c.completed_at,
+           COUNT(n.id) AS total_numbers,
+           COUNT(n.id) FILTER (WHERE n.status = 'pending') AS pending,
+           COUNT(n.id) FILTER (WHERE n.status = 'dialing') AS dialing,
+           COUNT(n.id) FILTER (WHERE n.status = 'dialed') AS dialed,
+           COUNT(n.id) FILTER (WHERE n.status = 'failed') AS failed
+    FROM campaigns c
+    LEFT JOIN campaign_numbers n ON n.campaign_id = c.id
+"""
+
+
+def get_campaign(cursor, campaign_id):
+    cursor.execute(CAMPAIGN_PROGRESS_QUERY + " WHERE c.id = %s GROUP BY c.id", (campaign_id,))
+    row = cursor.fetchone()
+    return dict(zip([d[0] for d in cursor.description], row)) if row else None
+
+
+def list_campaigns(cursor, limit=50):
+    cursor.execute(CAMPAIGN_PROGRESS_QUERY + " GROUP BY c.id ORDER BY c.id DESC LIMIT %s", (limit,))
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def set_campaign_status(cursor, campaign_id, status):
+    if status not in ('running', 'paused', 'canceled'):
+        raise ValueError("status must be one of: running, paused, canceled")
+    cursor.execute("""
+        UPDATE campaigns SET status = %s
+        WHERE id = %s AND status NOT IN ('completed', 'canceled')
+        RETURNING id
+    """, (status, campaign_id))
+    if cursor.fetchone() is None:
+        raise ValueError("Campaign not found or already finished")
+    if status == 'canceled':
+        cursor.execute(
+            "UPDATE campaign_numbers SET status = 'failed', last_error = 'campaign canceled' "
+            "WHERE campaign_id = %s AND status = 'pending'",
+            (campaign_id,)
+        )
+
+
+def is_transient(error):
+    """True for failures worth retrying: Twilio throttling/5xx and network errors."""
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # Socket errors and requests' ConnectionError/Timeout (both OSError subclasses) carry no HTTP status
+    return isinstance(error, OSError)
+
+
+class CampaignDialer:
+    """Dials pending campaign numbers under rate, concurrency and agent-capacity limits.
+
+    `place_call(phone_number)` must start an outbound call and return its
+    CallSid; pass a stub to exercise the dialer without Twilio.
+    """
+
+    def __init__(self, pool, place_call, calls_per_second=1.0, max_workers=4, max_attempts=3,
+                 base_backoff=30.0, poll_interval=1.0):
+        self.pool = pool
+        self.place_call = place_call
+        self.bucket = TokenBucket(calls_per_second, capacity=1)
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='campaign-dial')
+        self._in_flight = 0
+        self._results = []
+        # Numbers claimed by this process whose result isn't committed yet; recover_stale leaves them alone
+        self._held = set()
+        self._results_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock_conn = None
+        self.stats = {'dialed': 0, 'retried': 0, 'failed': 0, 'is_leader': False}
+
+    # -- capacity -------------------------------------------------------------
+
+    def available_capacity(self, cursor):
+        """Available agents minus campaign calls that are live but not yet with an agent."""
+        cursor.execute(f"""
+            SELECT (SELECT COUNT(*) FROM agents WHERE status = 'available')
+                 - (SELECT COUNT(*) FROM campaign_numbers n
+                    JOIN calls c ON c.call_sid = n.call_sid
+                    WHERE n.status = 'dialed'
+                      AND call_status_rank(c.status) < call_status_rank('transferred')
+                      AND c.start_time > CURRENT_TIMESTAMP - INTERVAL '{LIVE_CALL_WINDOW}')
+        """)
+        return cursor.fetchone()[0]
+
+    # -- one scheduling step -----------------------------------------------------
+
+    def _claim(self, cursor, limit):
+        cursor.execute("""
+            UPDATE campaign_numbers SET status = 'dialing', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT n.id FROM campaign_numbers n
+                JOIN campaigns c ON c.id = n.campaign_id
+                WHERE n.status = 'pending' AND n.next_attempt_at <= CURRENT_TIMESTAMP AND c.status = 'running'
+                ORDER BY n.next_attempt_at, n.id
+                LIMIT %s
+                FOR UPDATE OF n SKIP LOCKED
+            )
+            RETURNING id, phone_number, attempts
+        """, (limit,))
+        return cursor.fetchall()
+
+    def _dial(self, number_id, phone_number, attempts):
+        self.bucket.acquire()
+        try:
+            call_sid = self.place_call(phone_number)
+            result = (number_id, phone_number, attempts, call_sid, None)
+        except Exception as e:
+            result = (number_id, phone_number, attempts, None, e)
+        with self._results_lock:
+            self._results.append(result)
+            self._in_flight -= 1
+
+    def _write_results(self, conn):
+        """Commit finished dial results. On failure they go back in the queue for the next attempt."""
+        with self._results_lock:
+            results, self._results = self._results, []
+        if not results:
+            return 0
+        try:
+            with conn.cursor() as cursor:
+                counts = self._apply_results(cursor, results)
+            conn.commit()
+        except Exception:
+            # These numbers were dialed (or failed): losing the results would leave them 'dialing'
+            # until recover_stale puts them back to 'pending' and the customers get called twice
+            with self._results_lock:
+                self._results[:0] = results
+            raise
+        with self._results_lock:
+            self._held.difference_update(result[0] for result in results)
+        self.stats['dialed'] += counts[0]
+        self.stats['retried'] += counts[1]
+        self.stats['failed'] += counts[2]
+        return len(results)
+
+    def _apply_results(self, cursor, results):
+        now = datetime.now(timezone.utc)
+        dialed, retry, failed = [], [], []
+        for number_id, phone_number, attempts, call_sid, error in results:
+            if error is None:
+                dialed.append((number_id, phone_number, call_sid))
+            elif is_transient(error) and attempts < self.max_attempts:
+                retry.append((number_id, self.base_backoff * 2 ** (attempts - 1), str(error)[:500]))
+            else:
+                failed.append((number_id, str(error)[:500]))
+            if error is not None:
+                logger.warning(f"Campaign dial to {phone_number} failed (attempt {attempts}): {error}")
+
+        if dialed:
+            status_writer.insert_calls(cursor, [(call_sid, phone_number, now, 'initiated')
+                                                for _, phone_number, call_sid in dialed])
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE campaign_numbers AS n SET status = 'dialed', call_sid = v.call_sid, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, call_sid) WHERE n.id = v.id
+            """, [(number_id, call_sid) for number_id, _, call_sid in dialed], template="(%s::bigint, %s)")
+        if retry:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE campaign_numbers AS n SET status = 'pending', last_error = v.error, updated_at = CURRENT_TIMESTAMP,
+                       next_attempt_at = CURRENT_TIMESTAMP + v.backoff * INTERVAL '1 second'
+                FROM (VALUES %s) AS v(id, backoff, error) WHERE n.id = v.id
+            """, retry, template="(%s::bigint, %s::float8, %s)")
+        if failed:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE campaign_numbers AS n SET status = 'failed', last_error = v.error, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, error) WHERE n.id = v.id
+            """, failed, template="(%s::bigint, %s)")
+        # Campaigns with nothing left to dial are done
+        cursor.execute("""
+            UPDATE campaigns c SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE c.status = 'running' AND NOT EXISTS (
+                SELECT 1 FROM campaign_numbers n
+                WHERE n.campaign_id = c.id AND n.status IN ('pending', 'dialing')
+            )
+        """)
+        return len(dialed), len(retry), len(failed)
+
+    def run_once(self):
+        """Write finished dial results back, then claim and dispatch as many numbers as capacity allows.
+
+        Returns the number of dials dispatched.
+        """
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            self._write_results(conn)
+            with conn.cursor() as cursor:
+                with self._results_lock:
+                    in_flight = self._in_flight
+                free_workers = self.max_workers - in_flight
+                capacity = self.available_capacity(cursor) - in_flight
+                limit = min(free_workers, capacity)
+                claimed = self._claim(cursor, limit) if limit > 0 else []
+                conn.commit()
+        except Exception as e:
+            broken = isinstance(e, psycopg2.OperationalError)
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken)
+        for number_id, phone_number, attempts in claimed:
+            with self._results_lock:
+                self._in_flight += 1
+                self._held.add(number_id)
+            self._executor.submit(self._dial, number_id, phone_number, attempts)
+        return len(claimed)
+
+    def recover_stale(self, cursor):
+        """Put numbers left in 'dialing' by a crashed leader back in the queue.
+
+        Numbers this process is still dialing, or holds an unwritten result
+        for (e.g. from before it lost leadership), are skipped.
+        """
+        with self._results_lock:
+            held = sorted(self._held)
+        cursor.execute("""
+            UPDATE campaign_numbers SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'dialing' AND updated_at < CURRENT_TIMESTAMP - INTERVAL '5 minutes'
+              AND id <> ALL(%s::bigint[])
+        """, (held,))
+
+    # -- background loop ----------------------------------------------------------
+
+    def _try_become_leader(self):
+        if self._lock_conn is None:
+            self._lock_conn = self.pool.getconn()
+        with self._lock_conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (DIALER_LOCK_ID,))
+            is_leader = cursor.fetchone()[0]
+            if is_leader:
+                self.recover_stale(cursor)
+        self._lock_conn.commit()
+        if not is_leader:
+            # Hand the connection back while another process is leading
+            self.pool.putconn(self._lock_conn)
+            self._lock_conn = None
+        return is_leader
+
+    def _check_leadership(self):
+        """Ping the session holding the advisory lock; it lives outside the pool's health checks."""
+        with self._lock_conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self._lock_conn.commit()
+
+    def _give_up_leadership(self):
+        # Our session (and the advisory lock with it) may be gone
+        if self._lock_conn is not None:
+            self.pool.putconn(self._lock_conn, close=True)
+            self._lock_conn = None
+        self.stats['is_leader'] = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.stats['is_leader']:
+                    self.stats['is_leader'] = self._try_become_leader()
+                    if not self.stats['is_leader']:
+                        self._stop.wait(self.poll_interval * 5)
+                        continue
+                    logger.info("Campaign dialer acquired leadership.")
+                else:
+                    try:
+                        self._check_leadership()
+                    except psycopg2.Error as e:
+                        logger.error(f"Campaign dialer lost its leader connection: {str(e)}")
+                        self._give_up_leadership()
+                        continue
+                self.run_once()
+            except psycopg2.Error as e:
+                logger.error(f"Campaign dialer database error: {str(e)}")
+                self._give_up_leadership()
+            except Exception as e:
+                logger.error(f"Campaign dialer error: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='campaign-dialer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        conn = self.pool.getconn()
+        try:
+            self._write_results(conn)
+        finally:
+            self.pool.putconn(conn)
+            self._give_up_leadership()
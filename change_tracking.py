@@ -0,0 +1,99 @@
+"""
+Commit-ordered change counters for the tables the dashboard polls.
+
+Statement-level triggers (see migration 14) add one row per writing
+transaction to table_change_log. The row becomes visible when the writer
+commits and vanishes if it rolls back, so a table's version -- its count
+folded into table_change_versions plus its rows still in the log -- moves
+exactly when committed data does. Writers only insert (never update a shared
+counter row), so they don't queue behind each other; ChangeLogCompactor
+folds the log into the counters in the background to keep reads cheap.
+
+Versions are what ETags (http_cache) and the metrics cache are keyed on.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Both reads come from one snapshot, so a concurrent compaction can't be counted twice or missed
+VERSIONS_QUERY = """
+    SELECT COALESCE((SELECT v.version FROM table_change_versions v WHERE v.table_name = t.name), 0)
+           + (SELECT COUNT(*) FROM table_change_log l WHERE l.table_name = t.name)
+    FROM unnest(%s::text[]) WITH ORDINALITY AS t(name, position)
+    ORDER BY t.position
+"""
+RECORD_QUERY = "INSERT INTO table_change_log (table_name) VALUES (%s) ON CONFLICT DO NOTHING"
+# Rows of transactions that haven't committed are invisible to the DELETE and stay for the next run
+COMPACT_QUERY = """
+    WITH folded AS (
+        DELETE FROM table_change_log RETURNING table_name
+    )
+    INSERT INTO table_change_versions AS v (table_name, version)
+    SELECT table_name, COUNT(*) FROM folded GROUP BY table_name
+    ON CONFLICT (table_name) DO UPDATE SET version = v.version + EXCLUDED.version
+"""
+
+
+def table_versions(cursor, tables):
+    """Current version of each tracked table, in one query."""
+    cursor.execute(VERSIONS_QUERY, (list(tables),))
+    return tuple(row[0] for row in cursor.fetchall())
+
+
+def record_change(cursor, table):
+    """Count a change the triggers can't see (e.g. a dropped partition), inside the writer's transaction."""
+    cursor.execute(RECORD_QUERY, (table,))
+
+
+def compact(conn):
+    """Fold the log into the per-table counters. Commits."""
+    with conn.cursor() as cursor:
+        cursor.execute(COMPACT_QUERY)
+    conn.commit()
+
+
+class ChangeLogCompactor:
+    """Background thread running compact() every `interval` seconds.
+
+    Every worker runs one. Concurrent runs are redundant but safe: a log row
+    being folded by one run is skipped by the others.
+    """
+
+    def __init__(self, pool, interval=10.0):
+        self.pool = pool
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'runs': 0, 'failures': 0}
+
+    def run_once(self):
+        conn = self.pool.getconn()
+        try:
+            compact(conn)
+        finally:
+            self.pool.putconn(conn)
+        self._stats['runs'] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self._stats['failures'] += 1
+                logger.error(f"Change log compaction failed: {str(e)}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='change-log-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats)
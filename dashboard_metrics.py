@@ -0,0 +1,82 @@
+"""
+Dashboard summary metrics computed in a single aggregate pass.
+
+Every KPI on the dashboard comes out of one statement: one range scan over
+the last two days of calls (a plain start_time range, so the start_time
+index applies) plus one small GROUP BY over agents.
+"""
+from datetime import datetime, timezone
+
+SUMMARY_CACHE_KEY = 'metrics_summary'
+# Tracked tables the summary is computed from (see change_tracking)
+SUMMARY_TABLES = ('calls', 'agents')
+
+# Statuses that count as a missed call on the dashboard
+MISSED_STATUSES = ('failed', 'no-answer', 'busy', 'canceled')
+
+SUMMARY_QUERY = """
+    WITH bounds AS (
+        SELECT date_trunc('day', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS today_start,
+               CURRENT_TIMESTAMP AS now
+    ), call_stats AS (
+        SELECT
+            COUNT(*) FILTER (WHERE c.start_time >= b.today_start) AS calls_today,
+            COUNT(*) FILTER (WHERE c.start_time >= b.today_start - INTERVAL '1 day'
+                             AND c.start_time < b.today_start) AS calls_yesterday,
+            COUNT(*) FILTER (WHERE c.start_time >= b.today_start
+                             AND c.status = ANY(%(missed)s)) AS missed_today,
+            COUNT(*) FILTER (WHERE c.start_time >= b.today_start - INTERVAL '1 day'
+                             AND c.start_time < b.today_start
+                             AND c.status = ANY(%(missed)s)) AS missed_yesterday,
+            AVG(EXTRACT(EPOCH FROM (c.end_time - c.start_time)))
+                FILTER (WHERE c.status = 'completed' AND c.end_time IS NOT NULL
+                        AND c.start_time >= b.now - INTERVAL '1 day') AS avg_duration,
+            AVG(EXTRACT(EPOCH FROM (c.end_time - c.start_time)))
+                FILTER (WHERE c.status = 'completed' AND c.end_time IS NOT NULL
+                        AND c.start_time >= b.now - INTERVAL '2 days'
+                        AND c.start_time < b.now - INTERVAL '1 day') AS prev_avg_duration
+        FROM calls c, bounds b
+        WHERE c.start_time >= LEAST(b.today_start - INTERVAL '1 day', b.now - INTERVAL '2 days')
+    )
+    SELECT s.*,
+           (SELECT COALESCE(json_object_agg(status, n), '{}'::json)
+            FROM (SELECT status, COUNT(*) AS n FROM agents GROUP BY status) a) AS agent_counts
+    FROM call_stats s
+"""
+
+
+def percent_change(current, previous):
+    if not previous:
+        return 0
+    return round((current - previous) / previous * 100, 1)
+
+
+def compute_summary(cursor):
+    """Run the summary query and shape it like the dashboard's MetricsData."""
+    cursor.execute(SUMMARY_QUERY, {'missed': list(MISSED_STATUSES)})
+    (calls_today, calls_yesterday, missed_today, missed_yesterday,
+     avg_duration, prev_avg_duration, agent_counts) = cursor.fetchone()
+    avg_duration = float(avg_duration or 0)
+    prev_avg_duration = float(prev_avg_duration or 0)
+    agent_counts = agent_counts or {}
+    return {
+        'dailyCalls': {
+            'total': calls_today,
+            'change': percent_change(calls_today, calls_yesterday),
+        },
+        'avgDuration': {
+            'seconds': round(avg_duration),
+            'change': percent_change(avg_duration, prev_avg_duration),
+        },
+        'agentAvailability': {
+            'available': agent_counts.get('available', 0),
+            'on_call': agent_counts.get('on_call', 0),
+            'offline': agent_counts.get('offline', 0),
+            'total': sum(agent_counts.values()),
+        },
+        'missedCalls': {
+            'total': missed_today,
+            'change': percent_change(missed_today, missed_yesterday),
+        },
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+    }
@@ -0,0 +1,227 @@
+"""
+Per-process PostgreSQL connection pool used behind get_db().
+
+Each gunicorn worker gets its own pool. Connections are health-checked on
+checkout, idle connections above the minimum size are evicted after a while,
+and the pool re-initializes itself in a forked child so workers never share
+a socket inherited from the master process.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(psycopg2.OperationalError):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe, fork-aware pool of psycopg2 connections."""
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5.0, max_idle=300.0,
+                 health_check_after=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: need 0 <= min_size <= max_size and max_size >= 1")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        # Connections idle for less than this many seconds skip the SELECT 1 ping
+        self.health_check_after = health_check_after
+        self.connect_kwargs = connect_kwargs
+        self._init_state()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _init_state(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        # Idle connections as (connection, returned_at); most recently used on the right
+        self._idle = deque()
+        self._in_use = set()
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'idle_evictions': 0,
+            'health_check_failures': 0,
+        }
+
+    def _after_fork(self):
+        """Forget connections inherited from the parent process.
+
+        The inherited sockets still belong to the parent, so they must not be
+        closed here: psycopg2 would send a Terminate message on them and kill
+        the parent's sessions. Keeping a reference stops them from being
+        garbage collected (which would close them too).
+        """
+        inherited = [conn for conn, _ in getattr(self, '_idle', ())]
+        inherited.extend(getattr(self, '_in_use', ()))
+        self._inherited = getattr(self, '_inherited', []) + inherited
+        self._init_state()
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._after_fork()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        self._stats['connections_created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection and drop it from the pool size. Caller holds the lock."""
+        self._size -= 1
+        self._stats['connections_discarded'] += 1
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing pooled connection: {str(e)}")
+        self._cond.notify()
+
+    def _evict_idle(self, now):
+        """Close connections idle longer than max_idle, keeping at least min_size open."""
+        while self._idle and self._size > self.min_size:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.max_idle:
+                break
+            self._idle.popleft()
+            self._stats['idle_evictions'] += 1
+            self._discard(conn)
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled connection failed health check: {str(e)}")
+            self._stats['health_check_failures'] += 1
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up."""
+        self._check_pid()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed")
+                now = time.monotonic()
+                self._evict_idle(now)
+                conn = None
+                create = False
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = now - returned_at
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.timeout}s waiting for a database connection "
+                            f"(pool size {self._size}/{self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                    continue
+
+            # Connect and health check outside the lock so other threads aren't blocked
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_for):
+                with self._cond:
+                    self._discard(conn)
+                continue
+
+            wait_ms = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._in_use.add(conn)
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                self._stats['total_wait_ms'] += wait_ms
+                self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if os.getpid() != self._pid:
+            # Connection was checked out in another process; it is not ours to pool
+            return
+        if not close and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection after failed reset: {str(e)}")
+                close = True
+        with self._cond:
+            if conn not in self._in_use:
+                return
+            self._in_use.discard(conn)
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return a snapshot of pool counters for sizing and monitoring."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'pid': self._pid,
+            })
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
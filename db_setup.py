@@ -0,0 +1,64 @@
+"""
+One-off database setup: schema migrations and the demo agents.
+
+Runs once per deploy (the gunicorn on_starting hook in gunicorn.conf.py, or
+`flask init-db`) instead of in every worker at import time. It uses its own
+short-lived connection and retries while PostgreSQL is still coming up.
+"""
+import logging
+import time
+
+import psycopg2
+
+import migrations
+
+logger = logging.getLogger(__name__)
+
+MOCK_AGENTS = [
+    ("Sarah Johnson", "+919325484855", "available"),
+    ("Mike Chen", "+15552345678", "offline"),
+    ("Emily Rodriguez", "+15553456789", "available"),
+    ("David Kim", "+15554567890", "offline"),
+]
+
+
+def seed_mock_agents(conn):
+    """Insert the demo agents if the agents table is empty. Returns True if it seeded."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM agents;")
+        if cursor.fetchone()[0]:
+            return False
+        cursor.executemany(
+            # Another process may be seeding at the same moment
+            "INSERT INTO agents (name, phone_number, status) VALUES (%s, %s, %s) ON CONFLICT (phone_number) DO NOTHING;",
+            MOCK_AGENTS
+        )
+    conn.commit()
+    return True
+
+
+def setup_database(dsn, attempts=5, connect_timeout=5, backoff=1.0):
+    """Apply pending migrations and seed demo agents. Returns the migrations applied.
+
+    Connection failures are retried with exponential backoff; the last one is raised.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            conn = psycopg2.connect(dsn, connect_timeout=connect_timeout)
+            break
+        except psycopg2.OperationalError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"PostgreSQL not reachable (attempt {attempt}/{attempts}), retrying: {str(e)}")
+            time.sleep(backoff * 2 ** (attempt - 1))
+    try:
+        # Safe to run from several processes at once (advisory lock per migration)
+        applied = migrations.run_migrations(conn)
+        logger.info(f"PostgreSQL schema at version {migrations.current_version(conn)} (applied {len(applied)} migration(s)).")
+        if seed_mock_agents(conn):
+            logger.info("PostgreSQL database initialized with mock agents.")
+        else:
+            logger.info("PostgreSQL agents table already contains data.")
+        return applied
+    finally:
+        conn.close()
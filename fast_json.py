@@ -0,0 +1,97 @@
+"""
+Fast JSON encoding for API responses.
+
+Uses orjson when it is installed (it encodes datetimes, dates and UUIDs in
+C and returns bytes) and falls back to the standard library otherwise.
+Query results can be handed over as a RowSet of raw cursor tuples plus
+column names instead of a list of dicts; the rows become objects only
+inside the encoder, in one pass.
+
+    app.json = FastJSONProvider(app)
+"""
+import json
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is used without it
+    orjson = None
+
+
+class RowSet:
+    """Cursor rows (tuples) with their column names, serialized as a list of objects."""
+
+    __slots__ = ('fields', 'rows')
+
+    def __init__(self, fields, rows):
+        self.fields = tuple(fields)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def as_dicts(self):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in self.rows]
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        return cls([column[0] for column in cursor.description], cursor.fetchall())
+
+
+def default(value):
+    """Encode what neither encoder handles natively."""
+    if isinstance(value, RowSet):
+        return value.as_dicts()
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj):
+        """Serialize to compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        """Serialize to compact UTF-8 JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by dumps()/loads() above; used by jsonify()."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skip the bytes -> str -> bytes round trip of the base implementation
+        return self._app.response_class(dumps(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings (loaded automatically from the working directory).
+
+Schema setup runs once in the master before any worker is forked, so
+workers boot without touching the database. Set DB_SETUP_ON_START=false to
+skip it (e.g. when `flask init-db` runs as a separate release step).
+"""
+import logging
+import os
+
+
+def on_starting(server):
+    if os.environ.get('DB_SETUP_ON_START', 'true').lower() != 'true':
+        return
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        server.log.warning("DATABASE_URL is not set; skipping database setup.")
+        return
+    logging.basicConfig(level=logging.INFO)
+    # Only the light setup module is imported here; the app itself loads in each worker
+    import db_setup
+    try:
+        db_setup.setup_database(dsn)
+    except Exception as e:
+        # Workers still start; database-backed endpoints fail until PostgreSQL is reachable
+        server.log.error(f"Database setup failed: {str(e)}")
@@ -0,0 +1,132 @@
+"""
+Conditional GETs and response compression for the dashboard's polling APIs.
+
+Validators come from committed per-table versions (see change_tracking):
+the tuple of versions identifies the data a response was built from.
+Checking If-None-Match therefore costs one small query that reads no data
+rows, and an unchanged poll is answered 304 without running the endpoint
+at all. Endpoints served from in-process state (the presence registry, the
+metrics cache) are validated against a tag of that state instead, which
+needs no query at all.
+
+Large JSON/CSV bodies are compressed with brotli (when the optional
+`brotli` package is installed) or gzip, whichever the client prefers.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request
+
+from change_tracking import table_versions
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv')
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+class ConditionalGet:
+    """Decorator factory adding ETag/Last-Modified handling to GET endpoints.
+
+    `get_cursor()` returns a cursor on the request's connection. Versions
+    carry no timestamp, so Last-Modified is the time this worker first saw
+    a given set of versions; ETag is authoritative and takes precedence, as
+    clients send If-None-Match alongside If-Modified-Since.
+    """
+
+    def __init__(self, get_cursor, max_tracked=1000):
+        self.get_cursor = get_cursor
+        self.max_tracked = max_tracked
+        self._first_seen = {}
+        self._lock = threading.Lock()
+        self.not_modified = 0
+
+    def _last_modified(self, key):
+        with self._lock:
+            seen = self._first_seen.get(key)
+            if seen is None:
+                if len(self._first_seen) >= self.max_tracked:
+                    self._first_seen.clear()
+                # HTTP dates have one-second resolution
+                seen = self._first_seen[key] = datetime.fromtimestamp(int(time.time()), timezone.utc)
+        return seen
+
+    def _respond(self, etag, build):
+        last_modified = self._last_modified(etag)
+        if request.if_none_match:
+            unchanged = request.if_none_match.contains_weak(etag)
+        else:
+            unchanged = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if unchanged:
+            self.not_modified += 1
+            response = make_response('', 304)
+        else:
+            response = build()
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        # Cacheable, but always revalidated
+        response.cache_control.no_cache = True
+        return response
+
+    def __call__(self, *tables, per_day=False, live=None):
+        """Validate against the committed versions of `tables`.
+
+        per_day also changes the ETag at UTC midnight (for 'today' figures).
+        live is for endpoints served from in-process state that can briefly
+        lag the tables: it returns a string identifying exactly the state the
+        handler will serve, or None when that state isn't available and the
+        handler falls back to reading `tables`.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                parts = [request.path, request.query_string.decode('latin-1')]
+                tag = live() if live is not None else None
+                if tag is not None:
+                    parts.append(f"live:{tag}")
+                else:
+                    parts.extend(map(str, table_versions(self.get_cursor(), tables)))
+                if per_day:
+                    parts.append(datetime.now(timezone.utc).date().isoformat())
+                etag = hashlib.blake2b('|'.join(parts).encode(), digest_size=12).hexdigest()
+                return self._respond(etag, lambda: make_response(f(*args, **kwargs)))
+            return decorated_function
+        return decorator
+
+
+def negotiate_encoding(accept_encodings):
+    """Pick 'br', 'gzip' or None from a werkzeug Accept-Encoding header."""
+    offers = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(offers)
+
+
+def compress_response(response):
+    """after_request hook: compress large, uncompressed, non-streamed text responses."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,225 @@
+"""
+Idempotency keys: the first response to a request is replayed for its retries.
+
+Clients send `Idempotency-Key`; Twilio marks webhook retries with
+`I-Twilio-Idempotency-Token`. The first request with a key claims it, runs,
+and its response (status, headers, body) is kept for `ttl` seconds; a retry
+gets that response back without running the handler again, so a double
+submit can't dial twice or claim a second agent. A retry that arrives while
+the first request is still running is told so (409), and reusing a key for
+a different request body is rejected (422).
+
+Keys live in an in-process LRU. With `shared=True` claims and responses are
+also stored in the UNLOGGED idempotency_keys table, since a retry may reach
+another gunicorn worker. Database methods take a cursor whose writes the
+caller commits straight away (the claim must be visible before the handler
+runs), or an asyncpg connection for the *_async variants.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2.extras
+
+from async_db import pg_query
+
+HEADER = 'Idempotency-Key'
+TWILIO_HEADER = 'I-Twilio-Idempotency-Token'
+MAX_KEY_LENGTH = 255
+
+# Results of IdempotencyStore.begin()
+NEW = 'new'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+# Not replayed: recomputed by the server for every response (compared lowercased)
+SKIPPED_HEADERS = frozenset(('content-length', 'date', 'set-cookie', 'transfer-encoding', 'connection'))
+
+# Claims a key, or takes over one whose claim or stored response has expired
+CLAIM_QUERY = """
+    INSERT INTO idempotency_keys (idempotency_key, fingerprint, expires_at)
+    VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+    ON CONFLICT (idempotency_key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, status_code = NULL, headers = NULL, body = NULL,
+        expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+    RETURNING idempotency_key
+"""
+LOOKUP_QUERY = "SELECT fingerprint, status_code, headers, body FROM idempotency_keys WHERE idempotency_key = %s"
+COMPLETE_QUERY = """
+    UPDATE idempotency_keys
+    SET status_code = %s, headers = %s, body = %s, expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+    WHERE idempotency_key = %s
+"""
+RELEASE_QUERY = "DELETE FROM idempotency_keys WHERE idempotency_key = %s AND status_code IS NULL"
+PURGE_QUERY = "DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP"
+PURGE_EVERY = 1000
+
+
+def fingerprint(method, target, body):
+    """Identifies the request a key was first used for.
+
+    `target` is the path with its query string ('/path?a=1', as Flask's
+    request.full_path), so the same key on another query is a different request.
+    """
+    digest = hashlib.sha256(f"{method} {target}\n".encode())
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def cacheable(status_code):
+    """Whether a response is final for its key. Server errors and 429s are worth retrying, so aren't kept."""
+    return status_code < 500 and status_code != 429
+
+
+class StoredResponse:
+    __slots__ = ('status_code', 'headers', 'body')
+
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    def capture(cls, status_code, headers, body):
+        """From a response's status, (name, value) header pairs and body bytes."""
+        return cls(status_code, [[name, value] for name, value in headers if name.lower() not in SKIPPED_HEADERS], body)
+
+
+class IdempotencyStore:
+    """Claims and stored responses per key, in an LRU with TTL, optionally mirrored to PostgreSQL.
+
+    `in_progress_ttl` bounds how long a claim whose request never finished
+    (a crashed worker) blocks the key.
+    """
+
+    def __init__(self, ttl=86400.0, in_progress_ttl=60.0, max_entries=10000, shared=False):
+        self.ttl = ttl
+        self.in_progress_ttl = in_progress_ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        # key -> [fingerprint, StoredResponse or None while in progress, expires_at (monotonic)]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.replays = 0
+        self.conflicts = 0
+
+    def _set_local(self, key, fingerprint, response, ttl):
+        with self._lock:
+            self._entries[key] = [fingerprint, response, time.monotonic() + ttl]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry
+
+    def _resolve(self, fingerprint, stored_fingerprint, response):
+        if stored_fingerprint != fingerprint:
+            self.conflicts += 1
+            return MISMATCH, None
+        if response is None:
+            self.conflicts += 1
+            return IN_PROGRESS, None
+        self.replays += 1
+        return REPLAY, response
+
+    def _begin_local(self, key, fingerprint):
+        """Decide from the local entry alone; None when the database has to be asked."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None and not self.shared:
+                # Claim and check in one step, so two threads can't both claim the key
+                self._entries[key] = [fingerprint, None, time.monotonic() + self.in_progress_ttl]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return NEW, None
+        if entry is None:
+            return None
+        return self._resolve(fingerprint, entry[0], entry[1])
+
+    def _from_row(self, key, fingerprint, row):
+        if row is None:
+            # Expired and purged between our two statements; treat as in progress and let the client retry
+            self.conflicts += 1
+            return IN_PROGRESS, None
+        stored_fingerprint, status_code, headers, body = row
+        response = StoredResponse(status_code, headers, bytes(body)) if status_code is not None else None
+        if response is not None:
+            self._set_local(key, stored_fingerprint, response, self.ttl)
+        return self._resolve(fingerprint, stored_fingerprint, response)
+
+    def begin(self, key, fingerprint, cursor=None):
+        """Claim `key` for a request, or find what happened to it. Returns (state, StoredResponse or None)."""
+        local = self._begin_local(key, fingerprint)
+        if local is not None or cursor is None:
+            return local or (NEW, None)
+        cursor.execute(CLAIM_QUERY, (key, fingerprint, self.in_progress_ttl))
+        if cursor.fetchone() is not None:
+            self._set_local(key, fingerprint, None, self.in_progress_ttl)
+            return NEW, None
+        cursor.execute(LOOKUP_QUERY, (key,))
+        return self._from_row(key, fingerprint, cursor.fetchone())
+
+    async def begin_async(self, key, fingerprint, conn=None):
+        """begin() for the ASGI app, through an asyncpg connection."""
+        local = self._begin_local(key, fingerprint)
+        if local is not None or conn is None:
+            return local or (NEW, None)
+        if await conn.fetchrow(*pg_query(CLAIM_QUERY, (key, fingerprint, float(self.in_progress_ttl)))) is not None:
+            self._set_local(key, fingerprint, None, self.in_progress_ttl)
+            return NEW, None
+        return self._from_row(key, fingerprint, await conn.fetchrow(*pg_query(LOOKUP_QUERY, (key,))))
+
+    def _completed(self, key, response):
+        entry = self._get_local(key)
+        self._set_local(key, entry[0] if entry else None, response, self.ttl)
+        self._writes += 1
+        return self.shared and self._writes % PURGE_EVERY == 0
+
+    def complete(self, key, response, cursor=None):
+        """Store the response to replay for `key`."""
+        purge = self._completed(key, response)
+        if self.shared and cursor is not None:
+            cursor.execute(COMPLETE_QUERY, (response.status_code, psycopg2.extras.Json(response.headers),
+                                            psycopg2.Binary(response.body), self.ttl, key))
+            if purge:
+                cursor.execute(PURGE_QUERY)
+
+    async def complete_async(self, key, response, conn=None):
+        purge = self._completed(key, response)
+        if self.shared and conn is not None:
+            await conn.execute(*pg_query(COMPLETE_QUERY, (response.status_code, response.headers, response.body,
+                                                          float(self.ttl), key)))
+            if purge:
+                await conn.execute(PURGE_QUERY)
+
+    def release(self, key, cursor=None):
+        """Give up a claim without storing a response (see cacheable()), so a retry runs again."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared and cursor is not None:
+            cursor.execute(RELEASE_QUERY, (key,))
+
+    async def release_async(self, key, conn=None):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared and conn is not None:
+            await conn.execute(*pg_query(RELEASE_QUERY, (key,)))
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'max_entries': self.max_entries, 'shared': self.shared,
+                'replays': self.replays, 'conflicts': self.conflicts}
@@ -0,0 +1,266 @@
+"""
+Lightweight metrics in Prometheus text format, without extra dependencies.
+
+Counters and histograms are plain in-process structures (one lock per
+metric, bisect into fixed buckets), so recording a sample costs about a
+microsecond. Gauges are read from callbacks at scrape time. Every gunicorn
+worker keeps its own series; each sample carries a `worker` label (the pid)
+so a Prometheus sum() across scrapes of different workers stays correct.
+
+Database queries are timed by InstrumentedConnection, passed as
+`connection_factory` to the pool: every cursor it hands out (plain, dict or
+named) records duration and row counts per statement kind. Sampling and the
+slow-query log are opt-in via `configure()`.
+"""
+import bisect
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import psycopg2.extensions
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Holds metrics and renders them for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        worker = (('worker', os.getpid()),)
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, label_names, label_values, extra, value in metric.samples():
+                labels = _format_labels(label_names, label_values, extra + worker)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield '', self.labelnames, labels, (), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', self.labelnames, labels, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', self.labelnames, labels, (), total
+            yield '_count', self.labelnames, labels, (), cumulative
+
+
+class Gauge:
+    """Values computed at scrape time by callback() -> {label tuple: value} (or a single number)."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        registry.register(self)
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} callback failed: {str(e)}")
+            return
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            if value is not None:
+                yield '', self.labelnames, labels, (), value
+
+
+# -- standard metrics ---------------------------------------------------------------
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', "Flask request latency by route, method and status code.",
+    ('route', 'method', 'status'))
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', "Database statement latency by statement kind (sampled).", ('statement',))
+DB_QUERY_ROWS = Counter(
+    'db_query_rows_total', "Rows returned or affected by database statements (sampled).", ('statement',))
+DB_SLOW_QUERIES = Counter(
+    'db_slow_queries_total', "Statements slower than the slow-query threshold.", ('statement',))
+TWILIO_API_DURATION = Histogram(
+    'twilio_api_request_duration_seconds', "Twilio REST API latency by method and HTTP status.",
+    ('method', 'status'), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+RATE_LIMITED_REQUESTS = Counter(
+    'rate_limited_requests_total', "Requests rejected with a 429 by limiter.", ('limiter',))
+IDEMPOTENT_REQUESTS = Counter(
+    'idempotent_requests_total', "Requests carrying an idempotency key by outcome.", ('outcome',))
+
+_settings = {'sample_rate': 1.0, 'slow_query_seconds': None}
+
+
+def configure(sample_rate=1.0, slow_query_ms=None):
+    """Set the share of queries recorded in the histograms and the slow-query log threshold (None = off)."""
+    if not 0.0 <= sample_rate <= 1.0:
+        raise ValueError("sample_rate must be between 0 and 1")
+    _settings['sample_rate'] = sample_rate
+    _settings['slow_query_seconds'] = slow_query_ms / 1000 if slow_query_ms else None
+
+
+# -- database -------------------------------------------------------------------------
+
+_VERB = re.compile(r'\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+([a-z_][\w.]*)', re.IGNORECASE)
+_statement_labels = {}
+MAX_STATEMENT_LABELS = 2000
+
+
+def statement_label(sql):
+    """Low-cardinality label for a statement: its verb and first table, e.g. 'SELECT calls'."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    label = _statement_labels.get(sql)
+    if label is None:
+        verb = _VERB.match(sql)
+        table = _TABLE.search(sql)
+        label = (verb.group(1).upper() if verb else 'OTHER') + (f" {table.group(1)}" if table else '')
+        if len(_statement_labels) < MAX_STATEMENT_LABELS:
+            _statement_labels[sql] = label
+    return label
+
+
+class InstrumentedCursorMixin:
+    """Times execute()/executemany() and counts rows."""
+
+    def _timed(self, method, sql, args):
+        started = time.perf_counter()
+        try:
+            return method(sql, args)
+        finally:
+            elapsed = time.perf_counter() - started
+            slow = _settings['slow_query_seconds']
+            sampled = _settings['sample_rate'] >= 1.0 or random.random() < _settings['sample_rate']
+            if sampled or (slow is not None and elapsed >= slow):
+                label = statement_label(sql)
+                if sampled:
+                    DB_QUERY_DURATION.observe(elapsed, (label,))
+                    if self.rowcount > 0:
+                        DB_QUERY_ROWS.inc(self.rowcount, (label,))
+                if slow is not None and elapsed >= slow:
+                    DB_SLOW_QUERIES.inc(1, (label,))
+                    text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else sql
+                    logger.warning(f"Slow query ({elapsed * 1000:.1f}ms, {self.rowcount} rows): {' '.join(text.split())[:500]}")
+
+    def execute(self, sql, args=None):
+        return self._timed(super().execute, sql, args)
+
+    def executemany(self, sql, args_list):
+        return self._timed(super().executemany, sql, args_list)
+
+
+class InstrumentedCursor(InstrumentedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class InstrumentedDictCursor(InstrumentedCursorMixin, psycopg2.extras.DictCursor):
+    pass
+
+
+class InstrumentedRealDictCursor(InstrumentedCursorMixin, psycopg2.extras.RealDictCursor):
+    pass
+
+
+_CURSOR_CLASSES = {
+    None: InstrumentedCursor,
+    psycopg2.extensions.cursor: InstrumentedCursor,
+    psycopg2.extras.DictCursor: InstrumentedDictCursor,
+    psycopg2.extras.RealDictCursor: InstrumentedRealDictCursor,
+}
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors are timed, whatever cursor_factory the caller asks for."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory')
+        kwargs['cursor_factory'] = _CURSOR_CLASSES.get(factory, factory)
+        return super().cursor(*args, **kwargs)
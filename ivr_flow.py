@@ -0,0 +1,181 @@
+"""
+Declarative IVR flows rendered from precompiled TwiML templates.
+
+A Flow is a graph of Steps. Each step asks one question with <Gather>,
+validates the answer, stores it in the caller's IVR session under
+`step.field` and moves on to `step.next`; a step without `next` completes
+the flow. All TwiML is built once with VoiceResponse when the flow is
+compiled, with {{placeholders}} where per-call values go, so rendering a
+response is a join over precomputed chunks plus XML escaping of the values.
+
+One webhook (/ivr/<step>) drives every step:
+  - entering the step           -> the step's prompt
+  - an answer that validates    -> stored, then the next step's prompt
+  - a missing or invalid answer -> the step's reprompt, up to max_attempts
+"""
+import re
+from xml.sax.saxutils import escape
+
+from twilio.twiml.voice_response import VoiceResponse
+
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
+
+
+class TwimlTemplate:
+    """TwiML document split into literal chunks and {{field}} slots."""
+
+    def __init__(self, twiml):
+        self.source = str(twiml)
+        parts = PLACEHOLDER.split(self.source)
+        # Even indexes are literal text, odd ones are field names
+        self._literals = parts[0::2]
+        self.fields = tuple(parts[1::2])
+
+    def render(self, values=None):
+        if not self.fields:
+            return self.source
+        values = values or {}
+        out = [self._literals[0]]
+        for field, literal in zip(self.fields, self._literals[1:]):
+            out.append(escape(str(values.get(field, ''))))
+            out.append(literal)
+        return ''.join(out)
+
+
+class Step:
+    """One question of an IVR flow.
+
+    `prompt`/`reprompt` may reference session fields as {{field}}.
+    `input` is passed to <Gather> ('speech', 'dtmf' or 'dtmf speech').
+    `validator(answer)` returns the value to store, or None to reprompt.
+    """
+
+    def __init__(self, name, prompt, field=None, input='speech', validator=None, reprompt=None,
+                 next=None, max_attempts=3, gather_options=None):
+        self.name = name
+        self.prompt = prompt
+        self.field = field or name
+        self.input = input
+        self.validator = validator or non_empty
+        self.reprompt = reprompt or prompt
+        self.next = next
+        self.max_attempts = max_attempts
+        self.gather_options = dict(gather_options or {'speechTimeout': 'auto'})
+
+    def __repr__(self):
+        return f"Step({self.name!r})"
+
+
+class Outcome:
+    """Result of one webhook: TwiML to return, session fields to store, and whether the flow finished."""
+
+    __slots__ = ('twiml', 'updates', 'complete')
+
+    def __init__(self, twiml=None, updates=None, complete=False):
+        self.twiml = twiml
+        self.updates = updates or {}
+        self.complete = complete
+
+
+class Flow:
+    """A compiled graph of Steps plus any extra named templates the app renders itself."""
+
+    def __init__(self, steps, start=None, url_prefix='/ivr', voice='woman', language='en-US',
+                 goodbye="Sorry, we could not understand your answer. Goodbye."):
+        self.steps = {step.name: step for step in steps}
+        self.start = start or steps[0].name
+        self.url_prefix = url_prefix
+        self.voice = voice
+        self.language = language
+        self.goodbye = goodbye
+        self.templates = {}
+        for step in steps:
+            if step.next is not None and step.next not in self.steps:
+                raise ValueError(f"Step {step.name!r} continues to unknown step {step.next!r}")
+        # Session fields each step can rely on: everything answered on the way to it
+        self.fields_before = {}
+        fields, name = (), self.start
+        while name is not None and name not in self.fields_before:
+            self.fields_before[name] = fields
+            fields += (self.steps[name].field,)
+            name = self.steps[name].next
+        self._compile()
+
+    def url(self, step_name):
+        return f"{self.url_prefix}/{step_name}"
+
+    def say(self, verb, text):
+        verb.say(text, voice=self.voice, language=self.language)
+
+    def _gather(self, step, text):
+        # Both URLs carry the number of failed tries so far, so retries stay bounded
+        url = f"{self.url(step.name)}?attempt={{{{attempt}}}}"
+        resp = VoiceResponse()
+        gather = resp.gather(input=step.input, action=url, method='POST', **step.gather_options)
+        self.say(gather, text)
+        # Reached only when the caller says nothing
+        resp.redirect(url, method='POST')
+        return TwimlTemplate(resp)
+
+    def _compile(self):
+        for step in self.steps.values():
+            self.templates[(step.name, 'prompt')] = self._gather(step, step.prompt)
+            self.templates[(step.name, 'reprompt')] = self._gather(step, step.reprompt)
+        resp = VoiceResponse()
+        self.say(resp, self.goodbye)
+        resp.hangup()
+        self.templates['goodbye'] = TwimlTemplate(resp)
+
+    def template(self, name, build):
+        """Compile an app-defined template; build(resp) fills a fresh VoiceResponse."""
+        resp = VoiceResponse()
+        build(resp)
+        self.templates[name] = TwimlTemplate(resp)
+        return self.templates[name]
+
+    def render(self, name, values=None):
+        return self.templates[name].render(values)
+
+    def _ask(self, step, kind, session, attempt):
+        values = dict(session)
+        values['attempt'] = attempt
+        return self.templates[(step.name, kind)].render(values)
+
+    def handle(self, step_name, form, session, attempt=None):
+        """Run one webhook for `step_name`.
+
+        `form` is Twilio's request parameters, `session` the values collected
+        so far and `attempt` the failed tries so far from the query string
+        (None when entering the step). Raises KeyError for unknown steps.
+        """
+        step = self.steps[step_name]
+        answer = form.get('SpeechResult') or form.get('Digits')
+        if answer is None and attempt is None:
+            return Outcome(self._ask(step, 'prompt', session, 0))
+        value = step.validator(answer) if answer is not None else None
+        if value is None:
+            attempt = (attempt or 0) + 1
+            if attempt >= step.max_attempts:
+                return Outcome(self.render('goodbye'))
+            return Outcome(self._ask(step, 'reprompt', session, attempt))
+        updates = {step.field: value}
+        if step.next is None:
+            return Outcome(updates=updates, complete=True)
+        session = dict(session, **updates)
+        return Outcome(self._ask(self.steps[step.next], 'prompt', session, 0), updates)
+
+
+# -- validators -------------------------------------------------------------------
+
+def non_empty(answer):
+    answer = (answer or '').strip().rstrip('.')
+    return answer or None
+
+
+def age(answer):
+    """First whole number in the answer, if it's a plausible age ('I'm 42.' -> 42)."""
+    match = re.search(r'\d+', answer or '')
+    if match is None:
+        return None
+    value = int(match.group())
+    return value if 0 < value < 130 else None
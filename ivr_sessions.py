@@ -0,0 +1,164 @@
+"""
+Per-call IVR session state keyed by Twilio CallSid.
+
+Twilio only sends back what the <Gather> action URL carries, so values
+collected on one IVR step (the caller's name) have to be kept server side
+for the next one. Sessions live in an in-process LRU with TTL eviction.
+With `shared=True` every write is also upserted into the UNLOGGED
+ivr_sessions table, so the next webhook can land on any gunicorn worker:
+a worker that misses locally (or holds a copy without the keys it needs)
+reads the row by primary key. The *_async methods do the same through an
+asyncpg connection for the ASGI mode (asgi_app.py).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2.extras
+
+from async_db import pg_query
+
+logger = logging.getLogger(__name__)
+
+# Expired rows are deleted from the shared table once every this many writes
+PURGE_EVERY = 1000
+
+SELECT_QUERY = "SELECT data FROM ivr_sessions WHERE call_sid = %s AND expires_at > CURRENT_TIMESTAMP"
+# JSONB || merges with whatever other workers stored for this call
+UPSERT_QUERY = """
+    INSERT INTO ivr_sessions (call_sid, data, expires_at)
+    VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+    ON CONFLICT (call_sid) DO UPDATE
+    SET data = ivr_sessions.data || EXCLUDED.data, expires_at = EXCLUDED.expires_at
+    RETURNING data
+"""
+PURGE_QUERY = "DELETE FROM ivr_sessions WHERE expires_at <= CURRENT_TIMESTAMP"
+
+
+class IVRSessionStore:
+    """LRU + TTL map of CallSid -> dict, optionally mirrored to PostgreSQL.
+
+    Methods that may touch the database take the caller's cursor and never
+    commit, so a step's session write can share the transaction of its other
+    writes. The cursor may be None when the store is not shared.
+    """
+
+    def __init__(self, ttl=900.0, max_entries=10000, shared=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, call_sid):
+        with self._lock:
+            entry = self._sessions.get(call_sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._sessions[call_sid]
+                return None
+            self._sessions.move_to_end(call_sid)
+            return entry[0]
+
+    def _set_local(self, call_sid, data):
+        with self._lock:
+            self._sessions[call_sid] = (data, time.monotonic() + self.ttl)
+            self._sessions.move_to_end(call_sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def get(self, call_sid, cursor=None, require=()):
+        """Return a copy of the session for `call_sid` ({} if there is none).
+
+        In shared mode a local copy missing any of the `require` keys is
+        treated as a miss, since another worker may have handled the step
+        that sets them.
+        """
+        if not call_sid:
+            return {}
+        data, hit = self._lookup(call_sid, require)
+        if hit or not self.shared or cursor is None:
+            return dict(data or {})
+        cursor.execute(SELECT_QUERY, (call_sid,))
+        return self._loaded(call_sid, cursor.fetchone())
+
+    def _lookup(self, call_sid, require):
+        data = self._get_local(call_sid)
+        if data is not None and all(key in data for key in require):
+            self.hits += 1
+            return data, True
+        self.misses += 1
+        return data, False
+
+    def _loaded(self, call_sid, row):
+        data = row[0] if row else {}
+        if row:
+            self._set_local(call_sid, data)
+        return dict(data)
+
+    async def get_async(self, call_sid, conn=None, require=()):
+        """get() for the ASGI app, reading through an asyncpg connection."""
+        if not call_sid:
+            return {}
+        data, hit = self._lookup(call_sid, require)
+        if hit or not self.shared or conn is None:
+            return dict(data or {})
+        return self._loaded(call_sid, await conn.fetchrow(*pg_query(SELECT_QUERY, (call_sid,))))
+
+    def update(self, call_sid, cursor=None, **fields):
+        """Merge `fields` into the session in one write and return the merged session."""
+        if not call_sid:
+            return dict(fields)
+        data = dict(self._get_local(call_sid) or {})
+        data.update(fields)
+        if self.shared and cursor is not None:
+            cursor.execute(UPSERT_QUERY, (call_sid, psycopg2.extras.Json(fields), self.ttl))
+            data = cursor.fetchone()[0]
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self.purge_expired(cursor)
+        self._set_local(call_sid, data)
+        return dict(data)
+
+    async def update_async(self, call_sid, conn=None, **fields):
+        """update() for the ASGI app, writing through an asyncpg connection."""
+        if not call_sid:
+            return dict(fields)
+        data = dict(self._get_local(call_sid) or {})
+        data.update(fields)
+        if self.shared and conn is not None:
+            data = await conn.fetchval(*pg_query(UPSERT_QUERY, (call_sid, fields, float(self.ttl))))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                await conn.execute(PURGE_QUERY)
+        self._set_local(call_sid, data)
+        return dict(data)
+
+    def discard(self, call_sid, cursor=None):
+        """Drop a finished call's session."""
+        with self._lock:
+            self._sessions.pop(call_sid, None)
+        if self.shared and cursor is not None:
+            cursor.execute("DELETE FROM ivr_sessions WHERE call_sid = %s", (call_sid,))
+
+    def purge_expired(self, cursor=None):
+        """Evict expired sessions locally and, in shared mode, from the table."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for call_sid in expired:
+                del self._sessions[call_sid]
+        if self.shared and cursor is not None:
+            cursor.execute(PURGE_QUERY)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._sessions)
+        return {'size': size, 'max_entries': self.max_entries, 'shared': self.shared,
+                'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,112 @@
+"""
+TTL cache for dashboard metrics shared by every gunicorn worker.
+
+Entries live in an UNLOGGED PostgreSQL table so all workers see the same
+value, with a short in-process layer in front so repeated polls inside one
+worker don't even touch the database. When an entry is missing, workers
+take an advisory lock on its key so only one of them runs the aggregate
+query while the others wait and reuse the result.
+
+Each entry records the versions of the tables it was computed from (see
+change_tracking). Writers never touch the cache: a lookup that finds the
+versions moved treats the entry as stale, but keeps serving it until it is
+`refresh_interval` seconds old, so a steady stream of writes recomputes the
+aggregate at most once per interval instead of on every poll.
+"""
+import logging
+import threading
+import time
+
+import psycopg2.extras
+
+from advisory_locks import METRICS_CACHE_NAMESPACE
+from change_tracking import table_versions
+
+logger = logging.getLogger(__name__)
+
+# Seconds the entry stays usable: until it expires, or for stale versions until refresh_interval has passed
+LOOKUP_QUERY = """
+    SELECT payload, EXTRACT(EPOCH FROM (
+        CASE WHEN version = %(version)s THEN expires_at
+             ELSE LEAST(expires_at, computed_at + %(refresh)s * INTERVAL '1 second') END
+        - CURRENT_TIMESTAMP))
+    FROM metrics_cache
+    WHERE cache_key = %(key)s
+"""
+STORE_QUERY = """
+    INSERT INTO metrics_cache (cache_key, payload, version, computed_at, expires_at)
+    VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+    ON CONFLICT (cache_key) DO UPDATE
+    SET payload = EXCLUDED.payload, version = EXCLUDED.version,
+        computed_at = EXCLUDED.computed_at, expires_at = EXCLUDED.expires_at
+"""
+
+
+class SharedTTLCache:
+    """Two-level (process + PostgreSQL) cache validated against table versions."""
+
+    def __init__(self, ttl=30.0, local_ttl=2.0, refresh_interval=2.0):
+        self.ttl = ttl
+        # Bounds how stale a worker can be after the tables change
+        self.local_ttl = min(local_ttl, ttl)
+        self.refresh_interval = min(refresh_interval, ttl)
+        self._local = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+        return None
+
+    def _set_local(self, key, value, ttl):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + min(ttl, self.local_ttl))
+
+    def _get_shared(self, cursor, key, version):
+        cursor.execute(LOOKUP_QUERY, {'key': key, 'version': version, 'refresh': self.refresh_interval})
+        row = cursor.fetchone()
+        if row is None or row[1] <= 0:
+            return None, 0
+        return row[0], float(row[1])
+
+    def get_or_compute(self, conn, key, compute, tables=()):
+        """Return the cached value for `key`, calling compute(cursor) on a miss.
+
+        `tables` are the tracked tables compute reads. compute must return
+        something JSON-serializable. The connection is committed afterwards,
+        so call this outside any pending write.
+        """
+        value = self._get_local(key)
+        if value is not None:
+            return value
+
+        with conn.cursor() as cursor:
+            # Read before computing, so the data is at least as new as the versions stored with it
+            version = ','.join(map(str, table_versions(cursor, tables))) if tables else ''
+            value, remaining = self._get_shared(cursor, key, version)
+            if value is None:
+                # Serialize recomputation of this key across workers
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (METRICS_CACHE_NAMESPACE, key))
+                value, remaining = self._get_shared(cursor, key, version)
+                if value is None:
+                    with self._lock:
+                        self.misses += 1
+                    value = compute(cursor)
+                    cursor.execute(STORE_QUERY, (key, psycopg2.extras.Json(value), version, self.ttl))
+                    remaining = self.ttl
+            else:
+                with self._lock:
+                    self.hits += 1
+        # Release the advisory lock (and don't leave the connection idle in transaction)
+        conn.commit()
+        self._set_local(key, value, remaining)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'local_entries': len(self._local)}
@@ -0,0 +1,575 @@
+"""
+Versioned schema migrations for the call centre database.
+
+Migrations are applied in order and recorded in the schema_version table.
+A transaction-scoped advisory lock serializes concurrent runs, so several
+gunicorn workers can call run_migrations() at the same time: the first one
+applies pending migrations and the rest find nothing left to do.
+"""
+import logging
+from datetime import datetime, timezone
+
+from advisory_locks import MIGRATION_LOCK_ID
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function; it receives a cursor inside the migration transaction."""
+    def decorator(func):
+        if any(m[0] == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version: {version}")
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+@migration(1, "Create agents and calls tables")
+def _create_base_tables(cursor):
+    # Create agents table with PostgreSQL syntax (SERIAL for auto-increment)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agents (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            phone_number VARCHAR(255) NOT NULL UNIQUE,
+            status VARCHAR(50) NOT NULL DEFAULT 'offline',
+            last_status_update TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    # Create calls table with PostgreSQL syntax
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calls (
+            id SERIAL PRIMARY KEY,
+            call_sid VARCHAR(255) UNIQUE,
+            caller_number VARCHAR(255) NOT NULL,
+            agent_id INTEGER REFERENCES agents(id),
+            start_time TIMESTAMP WITH TIME ZONE,
+            end_time TIMESTAMP WITH TIME ZONE,
+            duration INTEGER, -- in seconds
+            status VARCHAR(50),
+            recording_url VARCHAR(255),
+            ai_interaction_summary TEXT
+        );
+    ''')
+    # Shared pointer for the round-robin agent assignment strategy
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS agent_round_robin_seq MINVALUE 0 START 0;")
+
+
+@migration(2, "Index calls and agents for dashboard metrics, paging and agent lookup")
+def _add_indexes(cursor):
+    # Call log paging (keyset on start_time, id) and date-range metrics
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calls_start_time_id ON calls (start_time DESC, id DESC);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calls_status ON calls (status);")
+    # Agent filter and the least_calls_today assignment strategy
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calls_agent_id_start_time ON calls (agent_id, start_time);")
+    # Average duration metrics only ever look at completed calls
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_calls_completed_start_time
+        ON calls (start_time) WHERE status = 'completed';
+    """)
+    # Caller number prefix search (text_pattern_ops so LIKE 'x%' can use it)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_calls_caller_number
+        ON calls (caller_number text_pattern_ops);
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_agents_status ON agents (status);")
+    # The few available agents, in the order the assignment strategies scan them
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_agents_available
+        ON agents (last_status_update, id) WHERE status = 'available';
+    """)
+
+
+@migration(3, "Create shared metrics cache table")
+def _create_metrics_cache(cursor):
+    # UNLOGGED: cache contents are disposable, so skip WAL for the frequent rewrites
+    cursor.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS metrics_cache (
+            cache_key VARCHAR(255) PRIMARY KEY,
+            payload JSONB NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+    ''')
+
+
+@migration(4, "Create hourly and daily call rollup tables")
+def _create_rollups(cursor):
+    # Element-wise sum of two equal-length integer arrays, for merging duration histograms
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION int_array_add(a INTEGER[], b INTEGER[]) RETURNS INTEGER[]
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT array_agg(COALESCE(x, 0) + COALESCE(y, 0) ORDER BY i)
+            FROM unnest(a, b) WITH ORDINALITY AS u(x, y, i)
+        $$;
+    ''')
+    for table in ('call_rollups_hourly', 'call_rollups_daily'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+                agent_id INTEGER NOT NULL, -- 0 when the call never reached an agent
+                status VARCHAR(50) NOT NULL,
+                call_count INTEGER NOT NULL DEFAULT 0,
+                completed_count INTEGER NOT NULL DEFAULT 0,
+                duration_sum BIGINT NOT NULL DEFAULT 0, -- in seconds
+                duration_count INTEGER NOT NULL DEFAULT 0,
+                duration_histogram INTEGER[] NOT NULL,
+                PRIMARY KEY (bucket_start, agent_id, status)
+            );
+        ''')
+
+
+@migration(5, "Record Twilio status callbacks per call and status")
+def _create_call_events(cursor):
+    # One row per (call, status): duplicate deliveries of the same callback are no-ops
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_events (
+            call_sid VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            event_time TIMESTAMP WITH TIME ZONE NOT NULL,
+            duration INTEGER, -- in seconds, reported with the final status
+            sequence_number INTEGER,
+            received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (call_sid, status)
+        );
+    ''')
+    # Position in the call state machine; a call's status only ever moves to a higher rank
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION call_status_rank(status TEXT) RETURNS INTEGER
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT CASE status
+                WHEN 'queued' THEN 0
+                WHEN 'initiated' THEN 1
+                WHEN 'ringing' THEN 2
+                WHEN 'answered' THEN 3
+                WHEN 'in-progress' THEN 3
+                WHEN 'transferred' THEN 4
+                WHEN 'completed' THEN 10
+                WHEN 'failed' THEN 10
+                WHEN 'busy' THEN 10
+                WHEN 'no-answer' THEN 10
+                WHEN 'canceled' THEN 10
+                ELSE -1
+            END
+        $$;
+    ''')
+
+
+@migration(6, "Create outbound campaign tables")
+def _create_campaigns(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL DEFAULT 'running', -- running, paused, canceled, completed
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP WITH TIME ZONE
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_numbers (
+            id BIGSERIAL PRIMARY KEY,
+            campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+            phone_number VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL DEFAULT 'pending', -- pending, dialing, dialed, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            call_sid VARCHAR(255),
+            last_error TEXT,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_campaign_numbers_campaign ON campaign_numbers (campaign_id, status);")
+    # The dialer's work queue: only pending rows, in retry order
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_campaign_numbers_pending
+        ON campaign_numbers (next_attempt_at, id) WHERE status = 'pending';
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_campaign_numbers_dialed
+        ON campaign_numbers (call_sid) WHERE status = 'dialed';
+    """)
+
+
+@migration(7, "Track asynchronous callback requests")
+def _create_call_requests(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_requests (
+            id UUID PRIMARY KEY,
+            phone_number VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL DEFAULT 'queued', -- queued, dispatching, initiated, failed
+            call_sid VARCHAR(255),
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_call_requests_queued
+        ON call_requests (created_at) WHERE status = 'queued';
+    """)
+
+
+@migration(8, "Publish agent changes on the agent_presence channel")
+def _notify_agent_presence(cursor):
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION notify_agent_presence() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            agent agents;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                agent := OLD;
+            ELSE
+                agent := NEW;
+            END IF;
+            PERFORM pg_notify('agent_presence', json_build_object(
+                'op', TG_OP,
+                'agent', json_build_object(
+                    'id', agent.id,
+                    'name', agent.name,
+                    'phone_number', agent.phone_number,
+                    'status', agent.status,
+                    'last_status_update', agent.last_status_update
+                )
+            )::text);
+            RETURN NULL;
+        END;
+        $$;
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS agents_presence_notify ON agents;")
+    cursor.execute('''
+        CREATE TRIGGER agents_presence_notify
+        AFTER INSERT OR UPDATE OR DELETE ON agents
+        FOR EACH ROW EXECUTE FUNCTION notify_agent_presence();
+    ''')
+
+
+
+@migration(9, "Create shared IVR session table")
+def _create_ivr_sessions(cursor):
+    # UNLOGGED: a session only matters for the few minutes a caller spends in the IVR
+    cursor.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS ivr_sessions (
+            call_sid VARCHAR(255) PRIMARY KEY,
+            data JSONB NOT NULL DEFAULT '{}'::jsonb,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+    ''')
+
+
+@migration(10, "Create the hold queue for callers waiting on an agent")
+def _create_queued_calls(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS queued_calls (
+            call_sid VARCHAR(255) PRIMARY KEY,
+            caller_number VARCHAR(255),
+            priority INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(50) NOT NULL DEFAULT 'waiting', -- waiting, connected, abandoned
+            agent_id INTEGER REFERENCES agents(id),
+            enqueued_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            left_at TIMESTAMP WITH TIME ZONE,
+            wait_seconds INTEGER
+        );
+    ''')
+    # Dequeue order; only waiting callers are indexed, so the index stays tiny
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queued_calls_waiting
+        ON queued_calls (priority DESC, enqueued_at, call_sid) WHERE status = 'waiting';
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_queued_calls_left_at ON queued_calls (left_at) WHERE left_at IS NOT NULL;")
+
+
+# Tables whose changes invalidate the dashboard's cached API responses
+CHANGE_TRACKED_TABLES = ('calls', 'agents')
+
+
+@migration(11, "Count changes to calls and agents for conditional GETs")
+def _create_change_sequences(cursor):
+    # One sequence per table, bumped once per modifying statement. nextval() is
+    # non-transactional, so concurrent writers never queue on a shared counter row.
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION bump_change_sequence() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM nextval(TG_ARGV[0]);
+            RETURN NULL;
+        END
+        $$;
+    ''')
+    for table in CHANGE_TRACKED_TABLES:
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_change_seq")
+        _create_change_trigger(cursor, table)
+
+
+def _create_change_trigger(cursor, table):
+    cursor.execute(f"DROP TRIGGER IF EXISTS {table}_change_counter ON {table}")
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_change_counter
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_change_sequence('{table}_change_seq');
+    ''')
+
+
+CALL_COLUMNS = ('id', 'call_sid', 'caller_number', 'agent_id', 'start_time', 'end_time', 'duration',
+                'status', 'recording_url', 'ai_interaction_summary')
+
+
+def _month_index(ts):
+    """Months since year 0 of a timestamp's UTC month."""
+    ts = ts.astimezone(timezone.utc)
+    return ts.year * 12 + ts.month - 1
+
+
+@migration(12, "Partition calls by month of start_time and catalogue call archives")
+def _partition_calls(cursor):
+    cursor.execute("ALTER TABLE calls RENAME TO calls_unpartitioned")
+    # Keep the id sequence (and its position) when the old table is dropped
+    cursor.execute("ALTER SEQUENCE calls_id_seq OWNED BY NONE")
+    # Unique constraints on a partitioned table must include start_time, so id and
+    # call_sid are unique per start_time; both come from generators that never repeat.
+    # Migration 17 enforces call_sid on its own again.
+    # start_time stays nullable: such rows live in calls_default.
+    cursor.execute('''
+        CREATE TABLE calls (
+            id INTEGER NOT NULL DEFAULT nextval('calls_id_seq'),
+            call_sid VARCHAR(255),
+            caller_number VARCHAR(255) NOT NULL,
+            agent_id INTEGER REFERENCES agents(id),
+            start_time TIMESTAMP WITH TIME ZONE,
+            end_time TIMESTAMP WITH TIME ZONE,
+            duration INTEGER, -- in seconds
+            status VARCHAR(50),
+            recording_url VARCHAR(255),
+            ai_interaction_summary TEXT
+        ) PARTITION BY RANGE (start_time);
+    ''')
+    cursor.execute("CREATE TABLE calls_default PARTITION OF calls DEFAULT;")
+    # One partition per UTC month from the oldest call to three months ahead; from then on
+    # call_archive.ensure_partitions() keeps months created. Spelled out here so this
+    # migration doesn't change when that module does.
+    cursor.execute("SELECT MIN(start_time) FROM calls_unpartitioned")
+    oldest = cursor.fetchone()[0]
+    now = datetime.now(timezone.utc)
+    month = _month_index(min(oldest, now) if oldest else now)
+    last = _month_index(now) + 3
+    while month <= last:
+        year, month_of_year = divmod(month, 12)
+        next_year, next_month_of_year = divmod(month + 1, 12)
+        cursor.execute(f'''
+            CREATE TABLE calls_{year:04d}_{month_of_year + 1:02d} PARTITION OF calls
+            FOR VALUES FROM ('{year:04d}-{month_of_year + 1:02d}-01 00:00:00+00')
+                       TO ('{next_year:04d}-{next_month_of_year + 1:02d}-01 00:00:00+00');
+        ''')
+        month += 1
+    columns = ', '.join(CALL_COLUMNS)
+    cursor.execute(f"INSERT INTO calls ({columns}) SELECT {columns} FROM calls_unpartitioned")
+    cursor.execute("DROP TABLE calls_unpartitioned")
+    cursor.execute("ALTER SEQUENCE calls_id_seq OWNED BY calls.id")
+    cursor.execute("ALTER TABLE calls ADD CONSTRAINT calls_id_start_time_key UNIQUE (id, start_time);")
+    cursor.execute("ALTER TABLE calls ADD CONSTRAINT calls_call_sid_start_time_key UNIQUE (call_sid, start_time);")
+    # Same secondary indexes as before; created on every partition
+    _add_indexes(cursor)
+    _create_change_trigger(cursor, 'calls')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_archives (
+            partition_name VARCHAR(63) PRIMARY KEY,
+            range_start TIMESTAMP WITH TIME ZONE NOT NULL,
+            range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+            path TEXT NOT NULL,
+            row_count BIGINT NOT NULL,
+            size_bytes BIGINT NOT NULL,
+            sha256 CHAR(64) NOT NULL,
+            archived_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+
+@migration(13, "Create shared rate-limit buckets and idempotency keys")
+def _create_request_guards(cursor):
+    # UNLOGGED like ivr_sessions: both only matter for minutes to a day, and
+    # losing them on a crash just resets limits and forgets replayable responses
+    cursor.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            bucket_key TEXT PRIMARY KEY,
+            tat TIMESTAMP WITH TIME ZONE NOT NULL -- when the bucket is full again
+        );
+    ''')
+    cursor.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS idempotency_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            fingerprint CHAR(64) NOT NULL,
+            status_code INTEGER, -- NULL while the first request is still running
+            headers JSONB,
+            body BYTEA,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+    ''')
+
+
+# Names change_tracking versions, and the tables whose writes move them
+CHANGE_LOG_TABLES = {
+    'calls': ('calls',),
+    'agents': ('agents',),
+    'call_rollups': ('call_rollups_hourly', 'call_rollups_daily'),
+}
+
+
+@migration(14, "Count committed changes in a change log instead of sequences")
+def _create_change_log(cursor):
+    # The sequences from migration 11 advanced before the writer committed (and on
+    # rollback), so a poll could tag uncommitted data with the new value. A log row
+    # per writing transaction becomes visible exactly when that transaction commits.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_change_log (
+            table_name TEXT NOT NULL,
+            xact_id xid8 NOT NULL DEFAULT pg_current_xact_id(),
+            PRIMARY KEY (table_name, xact_id)
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_change_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    ''')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION log_table_change() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO table_change_log (table_name) VALUES (TG_ARGV[0]) ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$;
+    ''')
+    for name, tables in CHANGE_LOG_TABLES.items():
+        for table in tables:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_change_counter ON {table}")
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_change_log ON {table}")
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_change_log
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION log_table_change('{name}');
+            ''')
+    # Start past the old sequence values, so no ETag issued before this migration can match again
+    cursor.execute('''
+        INSERT INTO table_change_versions (table_name, version)
+        SELECT name, (SELECT last_value + 1 FROM calls_change_seq) + (SELECT last_value + 1 FROM agents_change_seq)
+        FROM unnest(%s::text[]) AS name
+        ON CONFLICT (table_name) DO NOTHING
+    ''', (list(CHANGE_LOG_TABLES),))
+    cursor.execute("DROP SEQUENCE IF EXISTS calls_change_seq")
+    cursor.execute("DROP SEQUENCE IF EXISTS agents_change_seq")
+    cursor.execute("DROP FUNCTION IF EXISTS bump_change_sequence()")
+
+
+@migration(15, "Stamp metrics cache entries with the table versions they were computed from")
+def _version_metrics_cache(cursor):
+    # Entries are disposable; start over rather than guess the versions of existing ones
+    cursor.execute("TRUNCATE metrics_cache")
+    cursor.execute("ALTER TABLE metrics_cache ADD COLUMN IF NOT EXISTS version TEXT NOT NULL DEFAULT ''")
+    cursor.execute('''
+        ALTER TABLE metrics_cache
+        ADD COLUMN IF NOT EXISTS computed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ''')
+
+
+@migration(16, "Index call requests still being dispatched")
+def _index_dispatching_call_requests(cursor):
+    # The recovery pass looks for requests stuck in 'dispatching'
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_call_requests_dispatching
+        ON call_requests (updated_at) WHERE status = 'dispatching';
+    """)
+
+
+@migration(17, "Enforce one calls row per call_sid across partitions")
+def _register_call_sids(cursor):
+    # The partitioned calls table can only enforce UNIQUE (call_sid, start_time), but
+    # status callbacks, agent claims and the call queue all look a call up by call_sid
+    # alone. Every call_sid is also written to call_sids, whose primary key rejects a
+    # second calls row for it whatever its start_time. Row movement between partitions
+    # fires the DELETE then the INSERT trigger, so it passes too.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_sids (
+            call_sid VARCHAR(255) PRIMARY KEY
+        );
+    ''')
+    cursor.execute("INSERT INTO call_sids (call_sid) SELECT call_sid FROM calls WHERE call_sid IS NOT NULL")
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION register_call_sid() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.call_sid IS NOT NULL THEN
+                DELETE FROM call_sids WHERE call_sid = OLD.call_sid;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.call_sid IS NOT NULL THEN
+                INSERT INTO call_sids (call_sid) VALUES (NEW.call_sid);
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS calls_register_call_sid ON calls")
+    cursor.execute('''
+        CREATE TRIGGER calls_register_call_sid
+        AFTER INSERT OR DELETE OR UPDATE OF call_sid ON calls
+        FOR EACH ROW EXECUTE FUNCTION register_call_sid();
+    ''')
+
+
+def _ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_version')")
+        if cursor.fetchone()[0] is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+
+
+def run_migrations(conn, target=None):
+    """Apply every pending migration up to `target` (default: latest).
+
+    Each migration runs in its own transaction together with its
+    schema_version row, so a failure leaves the database at the last good
+    version. Returns the list of versions applied by this call.
+    """
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with conn.cursor() as cursor:
+            # Held until commit/rollback; other workers block here, then see the new version
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            _ensure_version_table(cursor)
+            cursor.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+            if cursor.fetchone():
+                conn.commit()
+                continue
+            try:
+                func(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"Migration {version} ({description}) failed.")
+                raise
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
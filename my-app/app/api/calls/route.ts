@@ -1,15 +1,24 @@
-import { NextResponse } from 'next/server';
+import { NextRequest, NextResponse } from 'next/server';
+import { forwardValidators, notModified, withValidators } from '@/lib/conditional-proxy';
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000';
 
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
-    const response = await fetch(`${BACKEND_URL}/api/calls`);
+    // Forward paging (limit, cursor), filters and field projection to the backend
+    // ...along with the browser's validators, so an unchanged page comes back as a 304
+    const response = await fetch(`${BACKEND_URL}/api/calls${request.nextUrl.search}`, {
+      headers: forwardValidators(request),
+      cache: 'no-store',
+    });
+    if (response.status === 304) {
+      return notModified(response);
+    }
     if (!response.ok) {
       throw new Error(`Backend responded with status: ${response.status}`);
     }
     const data = await response.json();
-    return NextResponse.json(data);
+    return withValidators(response, NextResponse.json(data));
   } catch (error) {
     console.error('Error fetching calls from backend:', error);
     return NextResponse.json(
@@ -1,6 +1,34 @@
 import { NextResponse } from 'next/server';
 
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000';
+
+interface TimeseriesPoint {
+  completed: number;
+  avg_duration: number | null;
+}
+
 export async function GET() {
-  // Dummy average call duration (in seconds)
-  return NextResponse.json({ data: 95 });
+  try {
+    // Average duration (in seconds) of completed calls over the last 24 hours
+    const response = await fetch(`${BACKEND_URL}/api/metrics/timeseries?bucket=hour&status=completed`);
+    if (!response.ok) {
+      throw new Error(`Backend responded with status: ${response.status}`);
+    }
+    const series = await response.json();
+    let totalSeconds = 0;
+    let totalCalls = 0;
+    series.data.forEach((point: TimeseriesPoint) => {
+      if (point.avg_duration !== null) {
+        totalSeconds += point.avg_duration * point.completed;
+        totalCalls += point.completed;
+      }
+    });
+    return NextResponse.json({ data: totalCalls > 0 ? Math.round(totalSeconds / totalCalls) : 0 });
+  } catch (error) {
+    console.error('Error fetching average call duration from backend:', error);
+    return NextResponse.json(
+      { error: 'Failed to fetch average call duration from backend' },
+      { status: 500 }
+    );
+  }
 }
@@ -1,12 +1,30 @@
 import { NextResponse } from 'next/server';
 
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000';
+
+interface TimeseriesPoint {
+  bucket_start: string;
+  count: number;
+}
+
 export async function GET() {
-  // Dummy daily calls data
-  const dailyCalls = [
-    { date: '2025-06-01', count: 10 },
-    { date: '2025-06-02', count: 15 },
-    { date: '2025-06-03', count: 8 },
-    { date: '2025-06-04', count: 12 },
-  ];
-  return NextResponse.json({ data: dailyCalls });
+  try {
+    // Daily call counts for the last 7 days, served from the backend's rollup tables
+    const response = await fetch(`${BACKEND_URL}/api/metrics/timeseries?bucket=day`);
+    if (!response.ok) {
+      throw new Error(`Backend responded with status: ${response.status}`);
+    }
+    const series = await response.json();
+    const dailyCalls = series.data.map((point: TimeseriesPoint) => ({
+      date: point.bucket_start.slice(0, 10),
+      count: point.count,
+    }));
+    return NextResponse.json({ data: dailyCalls });
+  } catch (error) {
+    console.error('Error fetching daily calls from backend:', error);
+    return NextResponse.json(
+      { error: 'Failed to fetch daily calls from backend' },
+      { status: 500 }
+    );
+  }
 }
@@ -1,21 +1,29 @@
-import { NextResponse } from 'next/server';
+import { NextRequest, NextResponse } from 'next/server';
+import { forwardValidators, notModified, withValidators } from '@/lib/conditional-proxy';
 
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000';
 
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
-    // Fetch all metrics in parallel
-    const [dailyCalls, avgDuration, agentAvailability] = await Promise.all([
-      fetch(`${BACKEND_URL}/api/metrics/daily_calls`).then(res => res.json()),
-      fetch(`${BACKEND_URL}/api/metrics/avg_call_duration`).then(res => res.json()),
-      fetch(`${BACKEND_URL}/api/metrics/agent_availability`).then(res => res.json())
-    ]);
+    // One cached backend call computes every dashboard metric
+    const response = await fetch(`${BACKEND_URL}/api/metrics/summary`, {
+      headers: forwardValidators(request),
+      cache: 'no-store',
+    });
+    if (response.status === 304) {
+      return notModified(response);
+    }
+    if (!response.ok) {
+      throw new Error(`Backend responded with status: ${response.status}`);
+    }
+    const { dailyCalls, avgDuration, agentAvailability, missedCalls } = await response.json();
 
-    return NextResponse.json({
+    return withValidators(response, NextResponse.json({
       dailyCalls,
       avgDuration,
-      agentAvailability
-    });
+      agentAvailability,
+      missedCalls
+    }));
   } catch (error) {
     console.error('Error fetching metrics from backend:', error);
     return NextResponse.json(
@@ -23,4 +31,4 @@ export async function GET() {
       { status: 500 }
     );
   }
-} 
\ No newline at end of file
+}
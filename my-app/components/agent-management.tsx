@@ -55,6 +55,31 @@ export default function AgentManagement() {
     };
 
     fetchAgents();
+
+    // Live updates: the backend pushes a snapshot, then one event per changed agent
+    if (typeof EventSource === "undefined") return;
+    const source = new EventSource(`${BACKEND_URL}/api/agents/stream`);
+    source.addEventListener("snapshot", (event) => {
+      setAgents(JSON.parse((event as MessageEvent).data));
+      setLoading(false);
+      setError(null);
+    });
+    source.addEventListener("agent", (event) => {
+      const agent: Agent = JSON.parse((event as MessageEvent).data);
+      setAgents((prevAgents) => {
+        const exists = prevAgents.some((a) => a.id === agent.id);
+        return exists
+          ? prevAgents.map((a) => (a.id === agent.id ? agent : a))
+          : [...prevAgents, agent];
+      });
+    });
+    source.addEventListener("deleted", (event) => {
+      const agent: Agent = JSON.parse((event as MessageEvent).data);
+      setAgents((prevAgents) => prevAgents.filter((a) => a.id !== agent.id));
+    });
+    // EventSource reconnects on its own; the initial fetch covers servers without the stream
+
+    return () => source.close();
   }, []);
 
   // Filter agents based on search term
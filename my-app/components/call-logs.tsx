@@ -24,32 +24,42 @@ interface CallLog {
   ai_interaction_summary: string | null;
 }
 
+// Columns the table actually renders; the backend only selects these
+const CALL_LOG_FIELDS = "id,caller_number,agent_name,duration,status,start_time";
+
 export default function CallLogs() {
   const [callLogs, setCallLogs] = useState<CallLog[]>([]) // Initialize with empty array
   const [searchTerm, setSearchTerm] = useState("")
   const [currentPage, setCurrentPage] = useState(1)
-  const [totalCalls, setTotalCalls] = useState(0); // State for total number of calls
+  // cursors[i] is the cursor that loads page i + 1 (page 1 needs none)
+  const [cursors, setCursors] = useState<(string | null)[]>([null]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true); // Add loading state
   const [error, setError] = useState<string | null>(null); // Add error state
 
 
   const itemsPerPage = 10 // Increased items per page to match backend default
 
-  // Fetch call logs from the backend API
+  // Fetch one page of call logs from the backend API
   useEffect(() => {
     const fetchCallLogs = async () => {
       setLoading(true);
       setError(null);
       try {
-        const response = await fetch(`${BACKEND_URL}/api/calls`);
+        const params = new URLSearchParams({ limit: String(itemsPerPage), fields: CALL_LOG_FIELDS });
+        const cursor = cursors[currentPage - 1];
+        if (cursor) {
+          params.set("cursor", cursor);
+        }
+        const response = await fetch(`${BACKEND_URL}/api/calls?${params}`);
         if (!response.ok) {
           throw new Error('Failed to fetch call logs');
         }
         const data = await response.json();
-        // Handle both response formats (array or {data, total})
+        // Handle both response formats (array or {data, next_cursor})
         const logs = Array.isArray(data) ? data : (data.data || []);
         setCallLogs(logs);
-        setTotalCalls(logs.length);
+        setNextCursor(Array.isArray(data) ? null : (data.next_cursor ?? null));
       } catch (err: unknown) {
         if (err instanceof Error) {
           setError(err.message);
@@ -59,19 +69,26 @@ export default function CallLogs() {
           console.error("An unknown error occurred:", err);
         }
         setCallLogs([]); // Clear logs on error
-        setTotalCalls(0);
+        setNextCursor(null);
       } finally {
         setLoading(false);
       }
     };
 
     fetchCallLogs();
-  }, []); // Only fetch once on mount
+  }, [currentPage, cursors]); // Refetch whenever the page changes
+
+  const goToNextPage = () => {
+    if (!nextCursor) return;
+    setCursors((prev) => [...prev.slice(0, currentPage), nextCursor]);
+    setCurrentPage((prev) => prev + 1);
+  };
 
-  // Calculate total pages based on totalCalls and itemsPerPage
-  const totalPages = Math.ceil(totalCalls / itemsPerPage);
+  const goToPreviousPage = () => {
+    setCurrentPage((prev) => Math.max(prev - 1, 1));
+  };
 
-  // Filter logs
+  // Filter logs on the current page
   const filteredLogs = callLogs.filter((log) => {
     const searchLower = searchTerm.toLowerCase();
     return (
@@ -81,13 +98,12 @@ export default function CallLogs() {
     );
   });
 
-  // Paginate the filtered logs (use filteredLogs directly as sorting is removed)
-  const startIndex = (currentPage - 1) * itemsPerPage;
-  const paginatedLogs = filteredLogs.slice(startIndex, startIndex + itemsPerPage);
+  const paginatedLogs = filteredLogs;
 
   // Calculate the range of items being displayed
-  const startItem = startIndex + 1;
-  const endItem = Math.min(startIndex + itemsPerPage, totalCalls);
+  const startIndex = (currentPage - 1) * itemsPerPage;
+  const startItem = callLogs.length > 0 ? startIndex + 1 : 0;
+  const endItem = startIndex + callLogs.length;
 
   const getStatusBadge = (status: string) => {
     const variants = {
@@ -193,38 +209,24 @@ export default function CallLogs() {
           {/* Pagination */}
           <div className="flex flex-col sm:flex-row items-center justify-between space-y-4 sm:space-y-0 space-x-2 py-4 w-full">
             <div className="text-sm text-muted-foreground">
-              Showing {startItem} to {endItem} of {totalCalls} results
+              Showing {startItem} to {endItem}{nextCursor ? "" : ` of ${endItem}`} results
             </div>
             <div className="flex items-center space-x-2">
               <Button
                 variant="outline"
                 size="sm"
-                onClick={() => setCurrentPage((prev) => Math.max(prev - 1, 1))}
-                disabled={currentPage === 1}
+                onClick={goToPreviousPage}
+                disabled={currentPage === 1 || loading}
               >
                 <ChevronLeft className="h-4 w-4" />
                 Previous
               </Button>
-              <div className="flex items-center space-x-1">
-                {totalPages <= 20 ? (Array.from({ length: totalPages }, (_, i) => i + 1).map((page) => (
-                  <Button
-                    key={page}
-                    variant={currentPage === page ? "default" : "outline"}
-                    size="sm"
-                    onClick={() => setCurrentPage(page)}
-                    className="w-8 h-8 p-0"
-                  >
-                    {page}
-                  </Button>
-                ))) : (
-                  <span className="text-sm text-muted-foreground">Page {currentPage} of {totalPages}</span>
-                )}
-              </div>
+              <span className="text-sm text-muted-foreground">Page {currentPage}</span>
               <Button
                 variant="outline"
                 size="sm"
-                onClick={() => setCurrentPage((prev) => Math.min(prev + 1, totalPages))}
-                disabled={currentPage === totalPages}
+                onClick={goToNextPage}
+                disabled={!nextCursor || loading}
               >
                 Next
                 <ChevronRight className="h-4 w-4" />
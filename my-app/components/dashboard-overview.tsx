@@ -42,6 +42,10 @@ interface MetricsData {
     offline: number;
     total: number;
   };
+  missedCalls: {
+    total: number;
+    change: number;
+  };
 }
 
 export default function DashboardOverview() {
@@ -89,27 +93,14 @@ export default function DashboardOverview() {
   useEffect(() => {
     const fetchMetrics = async () => {
       try {
-        // Make separate fetch calls to each specific metrics endpoint
-        const [dailyCallsResponse, avgDurationResponse, agentAvailabilityResponse] = await Promise.all([
-          fetch(`${BACKEND_URL}/api/metrics/daily_calls`),
-          fetch(`${BACKEND_URL}/api/metrics/avg_call_duration`),
-          fetch(`${BACKEND_URL}/api/metrics/agent_availability`),
-        ]);
+        // All dashboard KPIs come from one cached backend endpoint
+        const response = await fetch(`${BACKEND_URL}/api/metrics/summary`);
 
-        if (!dailyCallsResponse.ok || !avgDurationResponse.ok || !agentAvailabilityResponse.ok) {
-          throw new Error('Failed to fetch one or more metrics');
+        if (!response.ok) {
+          throw new Error('Failed to fetch metrics');
         }
 
-        const dailyCallsData = await dailyCallsResponse.json();
-        const avgDurationData = await avgDurationResponse.json();
-        const agentAvailabilityData = await agentAvailabilityResponse.json();
-
-        // Combine the fetched data into the expected structure
-        const data: MetricsData = {
-          dailyCalls: dailyCallsData,
-          avgDuration: avgDurationData,
-          agentAvailability: agentAvailabilityData,
-        };
+        const data: MetricsData = await response.json();
 
         // Update KPIs with real data
         setKpis([
@@ -139,9 +130,10 @@ export default function DashboardOverview() {
           },
           {
             title: "Missed Calls",
-            value: "0", // TODO: Add missed calls metric to backend
-            change: "-25%",
-            changeType: "positive",
+            value: data.missedCalls.total.toString(),
+            change: `${data.missedCalls.change > 0 ? '+' : ''}${data.missedCalls.change}%`,
+            // Fewer missed calls than yesterday is good news
+            changeType: data.missedCalls.change < 0 ? "positive" : data.missedCalls.change > 0 ? "negative" : "neutral",
             icon: PhoneMissed,
             description: "Compared to yesterday",
           },
@@ -154,8 +146,15 @@ export default function DashboardOverview() {
           { name: "Offline", value: data.agentAvailability.offline, color: "#ef4444" },
         ]);
 
-        // Update call data chart (placeholder for now)
-        setCallData([{ hour: "Now", calls: data.dailyCalls.total }]);
+        // Update call volume chart with hourly counts for the last 24 hours
+        const seriesResponse = await fetch(`${BACKEND_URL}/api/metrics/timeseries?bucket=hour`);
+        if (seriesResponse.ok) {
+          const series: { data: { bucket_start: string; count: number }[] } = await seriesResponse.json();
+          setCallData(series.data.map((point) => ({
+            hour: new Date(point.bucket_start).toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" }),
+            calls: point.count,
+          })));
+        }
 
       } catch (error) {
         console.error("Error fetching metrics:", error);
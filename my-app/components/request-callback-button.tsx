@@ -22,6 +22,27 @@ export function RequestCallbackButton() {
   const [isLoading, setIsLoading] = useState(false)
   const [isOpen, setIsOpen] = useState(false)
 
+  // Follow a queued request in the background and report it if dialing fails
+  const watchCallRequest = async (statusUrl: string) => {
+    for (let attempt = 0; attempt < 15; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, 2000))
+      try {
+        const response = await fetch(`${BACKEND_URL}${statusUrl}`)
+        if (!response.ok) return
+        const callRequest = await response.json()
+        if (callRequest.status === 'failed') {
+          toast.error("Error", {
+            description: callRequest.error || "We couldn't place your callback. Please try again.",
+          })
+          return
+        }
+        if (callRequest.status === 'initiated') return
+      } catch {
+        return
+      }
+    }
+  }
+
   const handleRequestCallback = async (e: React.FormEvent) => {
     e.preventDefault()
     setIsLoading(true)
@@ -31,6 +52,8 @@ export function RequestCallbackButton() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // Let the backend queue the call and answer straight away with a 202
+          'Prefer': 'respond-async',
         },
         body: JSON.stringify({ phoneNumber }),
       })
@@ -46,6 +69,10 @@ export function RequestCallbackButton() {
       })
       setIsOpen(false)
       setPhoneNumber("")
+
+      if (response.status === 202 && data.status_url) {
+        watchCallRequest(data.status_url)
+      }
     } catch (error) {
       toast.error("Error", {
         description: error instanceof Error ? error.message : "Failed to request callback",
@@ -0,0 +1,29 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+// Validators the browser sends on revalidation, and the ones the backend answers with
+const REQUEST_VALIDATORS = ['if-none-match', 'if-modified-since'];
+const RESPONSE_VALIDATORS = ['etag', 'last-modified', 'cache-control'];
+
+/** Conditional request headers to pass through to the backend. */
+export function forwardValidators(request: NextRequest): HeadersInit {
+  const headers: Record<string, string> = {};
+  for (const name of REQUEST_VALIDATORS) {
+    const value = request.headers.get(name);
+    if (value) headers[name] = value;
+  }
+  return headers;
+}
+
+/** Copy the backend's ETag/Last-Modified/Cache-Control onto the proxied response. */
+export function withValidators<T extends Response>(backend: Response, response: T): T {
+  for (const name of RESPONSE_VALIDATORS) {
+    const value = backend.headers.get(name);
+    if (value) response.headers.set(name, value);
+  }
+  return response;
+}
+
+/** 304 for the browser when the backend reports its cached copy is still current. */
+export function notModified(backend: Response): NextResponse {
+  return withValidators(backend, new NextResponse(null, { status: 304 }));
+}
@@ -0,0 +1,155 @@
+"""
+Token-bucket rate limiting.
+
+TokenBucket paces one stream of work (the campaign dialer). KeyedRateLimiter
+keeps a bucket per client key for the public endpoints, optionally backed
+by PostgreSQL so every worker shares the same limits.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from async_db import pg_query
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now; never blocks."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available. Returns False if `timeout` seconds pass first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# Shared buckets use GCRA, the single-timestamp form of a token bucket: `tat` is the time
+# the bucket will be full again, each request pushes it forward by 1/rate seconds, and a
+# request is allowed while tat stays within capacity/rate seconds of now. One upsert per check.
+SHARED_CHECK_QUERY = """
+    INSERT INTO rate_limit_buckets AS b (bucket_key, tat)
+    VALUES (%(key)s, CURRENT_TIMESTAMP + %(interval)s * INTERVAL '1 second')
+    ON CONFLICT (bucket_key) DO UPDATE
+    SET tat = GREATEST(b.tat, CURRENT_TIMESTAMP) + %(interval)s * INTERVAL '1 second'
+    WHERE GREATEST(b.tat, CURRENT_TIMESTAMP) + %(interval)s * INTERVAL '1 second'
+          <= CURRENT_TIMESTAMP + %(window)s * INTERVAL '1 second'
+    RETURNING tat
+"""
+# A bucket whose tat has passed is full, i.e. the same as no row at all
+SHARED_PURGE_QUERY = "DELETE FROM rate_limit_buckets WHERE tat < CURRENT_TIMESTAMP"
+SHARED_PURGE_EVERY = 1000
+
+
+class KeyedRateLimiter:
+    """Token buckets per key (a client IP, a phone number): `rate` per second, bursts of `capacity`.
+
+    check() is O(1): one dict lookup under a lock, with the least recently
+    used keys evicted beyond `max_keys`. With `shared=True` a request that
+    passes the local bucket is also checked against its row in the UNLOGGED
+    rate_limit_buckets table, so the limit holds across gunicorn workers;
+    requests over the local limit are rejected without touching the database.
+    """
+
+    def __init__(self, name, rate, capacity=None, max_keys=100000, shared=False):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.max_keys = max_keys
+        self.shared = shared
+        # key -> [tokens, last refill (monotonic)]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._checks = 0
+        self.allowed = 0
+        self.rejected = 0
+
+    def _check_local(self, key, cost):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / self.rate
+
+    def _shared_params(self, key, cost):
+        return {'key': f"{self.name}:{key}", 'interval': cost / self.rate, 'window': self.capacity / self.rate}
+
+    def _count(self, retry_after):
+        with self._lock:
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+            self._checks += 1
+            return self.shared and self._checks % SHARED_PURGE_EVERY == 0
+
+    def check(self, key, cursor=None, cost=1):
+        """Take `cost` tokens for `key`. Returns 0 if allowed, else seconds until it would be."""
+        retry_after = self._check_local(key, cost)
+        if not retry_after and self.shared and cursor is not None:
+            cursor.execute(SHARED_CHECK_QUERY, self._shared_params(key, cost))
+            if cursor.fetchone() is None:
+                retry_after = cost / self.rate
+        if self._count(retry_after) and cursor is not None:
+            cursor.execute(SHARED_PURGE_QUERY)
+        return retry_after
+
+    async def check_async(self, key, conn=None, cost=1):
+        """check() for the ASGI app, through an asyncpg connection."""
+        retry_after = self._check_local(key, cost)
+        if not retry_after and self.shared and conn is not None:
+            if await conn.fetchrow(*pg_query(SHARED_CHECK_QUERY, self._shared_params(key, cost))) is None:
+                retry_after = cost / self.rate
+        if self._count(retry_after) and conn is not None:
+            await conn.execute(SHARED_PURGE_QUERY)
+        return retry_after
+
+    def stats(self):
+        with self._lock:
+            keys = len(self._buckets)
+        return {'keys': keys, 'allowed': self.allowed, 'rejected': self.rejected, 'rate': self.rate,
+                'capacity': self.capacity, 'shared': self.shared}
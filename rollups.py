@@ -0,0 +1,229 @@
+"""
+Hourly and daily call rollups for historical analytics.
+
+Each call is folded into its hour and day bucket (by start_time, UTC) once,
+when it reaches a terminal status. Rollup rows are keyed by
+(bucket_start, agent_id, status) and hold counts, duration sums and a fixed
+duration histogram, which is enough to answer avg/p50/p95 for any range
+without touching the calls table. Time-series reads cost O(buckets).
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import psycopg2.extras
+
+import call_archive
+
+# Upper bounds (seconds) of the duration histogram buckets; the last bucket is open-ended
+DURATION_BOUNDS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2700, 3600)
+HISTOGRAM_SIZE = len(DURATION_BOUNDS) + 1
+
+TERMINAL_STATUSES = ('completed', 'failed', 'busy', 'no-answer', 'canceled')
+
+# Rollup tables by bucket name, with the width of one bucket
+BUCKETS = {
+    'hour': ('call_rollups_hourly', timedelta(hours=1)),
+    'day': ('call_rollups_daily', timedelta(days=1)),
+}
+
+# agent_id is part of the primary key, so calls without an agent are stored under 0
+NO_AGENT = 0
+
+MAX_SERIES_BUCKETS = 5000
+
+
+def histogram_index(duration):
+    """Index of the histogram bucket a duration (seconds) falls in."""
+    return bisect.bisect_left(DURATION_BOUNDS, duration)
+
+
+def truncate(ts, bucket):
+    ts = ts.astimezone(timezone.utc)
+    if bucket == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _new_entry():
+    return {'call_count': 0, 'completed_count': 0, 'duration_sum': 0, 'duration_count': 0,
+            'histogram': [0] * HISTOGRAM_SIZE}
+
+
+def _aggregate(calls):
+    """Group finished calls into per-bucket rollup deltas.
+
+    `calls` yields (agent_id, start_time, status, duration) tuples.
+    Returns {bucket_name: {(bucket_start, agent_id, status): entry}}.
+    """
+    deltas = {name: defaultdict(_new_entry) for name in BUCKETS}
+    for agent_id, start_time, status, duration in calls:
+        if start_time is None or status not in TERMINAL_STATUSES:
+            continue
+        for name in BUCKETS:
+            entry = deltas[name][(truncate(start_time, name), agent_id or NO_AGENT, status)]
+            entry['call_count'] += 1
+            if status == 'completed':
+                entry['completed_count'] += 1
+            if duration is not None:
+                entry['duration_sum'] += duration
+                entry['duration_count'] += 1
+                entry['histogram'][histogram_index(duration)] += 1
+    return deltas
+
+
+def record_calls(cursor, calls):
+    """Fold newly finished calls into the rollups, inside the caller's transaction.
+
+    Callers must pass each call exactly once (e.g. only the rows whose
+    UPDATE moved them into a terminal status), otherwise it is double counted.
+    """
+    deltas = _aggregate(calls)
+    for name, (table, _) in BUCKETS.items():
+        rows = [
+            (bucket_start, agent_id, status, e['call_count'], e['completed_count'],
+             e['duration_sum'], e['duration_count'], e['histogram'])
+            for (bucket_start, agent_id, status), e in deltas[name].items()
+        ]
+        if not rows:
+            continue
+        # Sorted so concurrent writers lock rollup rows in the same order (no deadlocks)
+        rows.sort(key=lambda r: (r[0], r[1], r[2]))
+        psycopg2.extras.execute_values(cursor, f"""
+            INSERT INTO {table} AS r (bucket_start, agent_id, status, call_count, completed_count,
+                                      duration_sum, duration_count, duration_histogram)
+            VALUES %s
+            ON CONFLICT (bucket_start, agent_id, status) DO UPDATE SET
+                call_count = r.call_count + EXCLUDED.call_count,
+                completed_count = r.completed_count + EXCLUDED.completed_count,
+                duration_sum = r.duration_sum + EXCLUDED.duration_sum,
+                duration_count = r.duration_count + EXCLUDED.duration_count,
+                duration_histogram = int_array_add(r.duration_histogram, EXCLUDED.duration_histogram)
+        """, rows, template="(%s, %s, %s, %s, %s, %s, %s, %s::integer[])")
+
+
+def rebuild(conn, since=None):
+    """Recompute the rollups from the raw calls table (backfill or repair).
+
+    Only buckets from the UTC day containing `since` onwards are rebuilt;
+    everything still in the calls table is rebuilt when it is None (rollups
+    of archived months are kept, their calls are gone). Commits.
+    """
+    if since is None:
+        with conn.cursor() as cursor:
+            since = call_archive.archived_until(cursor)
+    if since is not None:
+        since = truncate(since, 'day')
+    params = {'terminal': list(TERMINAL_STATUSES), 'since': since}
+    since_clause = "AND start_time >= %(since)s" if since else ""
+    with conn.cursor(name='rollup_rebuild') as source:
+        source.itersize = 5000
+        source.execute(f"""
+            SELECT agent_id, start_time, status, duration FROM calls
+            WHERE status = ANY(%(terminal)s) AND start_time IS NOT NULL {since_clause}
+        """, params)
+        deltas = _aggregate(source)
+    with conn.cursor() as cursor:
+        for table, _ in BUCKETS.values():
+            cursor.execute(f"DELETE FROM {table} WHERE %(since)s IS NULL OR bucket_start >= %(since)s", params)
+        # Reuse the incremental upsert on freshly emptied tables
+        for name, (table, _) in BUCKETS.items():
+            rows = [
+                (k[0], k[1], k[2], e['call_count'], e['completed_count'], e['duration_sum'],
+                 e['duration_count'], e['histogram'])
+                for k, e in deltas[name].items()
+            ]
+            psycopg2.extras.execute_values(cursor, f"""
+                INSERT INTO {table} (bucket_start, agent_id, status, call_count, completed_count,
+                                     duration_sum, duration_count, duration_histogram)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s, %s, %s, %s, %s::integer[])")
+    conn.commit()
+    return {name: len(d) for name, d in deltas.items()}
+
+
+def percentile(histogram, fraction):
+    """Estimate a duration percentile from a histogram, interpolating inside the bucket."""
+    total = sum(histogram)
+    if total == 0:
+        return None
+    target = fraction * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        if count and seen + count >= target:
+            lower = DURATION_BOUNDS[i - 1] if i > 0 else 0
+            # The open-ended last bucket is reported at its lower bound
+            upper = DURATION_BOUNDS[i] if i < len(DURATION_BOUNDS) else lower
+            return round(lower + (upper - lower) * (target - seen) / count, 1)
+        seen += count
+    return None
+
+
+def timeseries(cursor, date_from, date_to, bucket='day', agent_id=None, status=None):
+    """Return one point per bucket in [date_from, date_to), read only from the rollups."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(BUCKETS)}")
+    table, width = BUCKETS[bucket]
+    start = truncate(date_from, bucket)
+    if date_to <= start:
+        raise ValueError("'to' must be after 'from'")
+    if (date_to - start) / width > MAX_SERIES_BUCKETS:
+        raise ValueError(f"Range too large: at most {MAX_SERIES_BUCKETS} {bucket} buckets per request")
+
+    clauses = ["bucket_start >= %(start)s", "bucket_start < %(end)s"]
+    params = {'start': start, 'end': date_to}
+    if agent_id is not None:
+        clauses.append("agent_id = %(agent_id)s")
+        params['agent_id'] = agent_id
+    if status:
+        clauses.append("status = ANY(%(statuses)s)")
+        params['statuses'] = status
+    cursor.execute(f"""
+        SELECT bucket_start, SUM(call_count), SUM(completed_count), SUM(duration_sum), SUM(duration_count),
+               array_agg(duration_histogram)
+        FROM {table}
+        WHERE {' AND '.join(clauses)}
+        GROUP BY bucket_start
+    """, params)
+    by_bucket = {row[0]: row for row in cursor.fetchall()}
+
+    points = []
+    current = start
+    while current < date_to:
+        row = by_bucket.get(current)
+        if row is None:
+            points.append({'bucket_start': current.isoformat(), 'count': 0, 'completed': 0,
+                           'avg_duration': None, 'p50_duration': None, 'p95_duration': None})
+        else:
+            _, count, completed, duration_sum, duration_count, histograms = row
+            merged = [sum(h[i] for h in histograms) for i in range(HISTOGRAM_SIZE)]
+            points.append({
+                'bucket_start': current.isoformat(),
+                'count': int(count),
+                'completed': int(completed),
+                'avg_duration': round(float(duration_sum) / int(duration_count), 1) if duration_count else None,
+                'p50_duration': percentile(merged, 0.5),
+                'p95_duration': percentile(merged, 0.95),
+            })
+        current += width
+    return points
+
+
+def parse_range(args, bucket):
+    """Read from/to query args, defaulting to the last 24 hours (hour) or 7 days (day)."""
+    now = datetime.now(timezone.utc)
+    default_span = timedelta(hours=24) if bucket == 'hour' else timedelta(days=7)
+
+    def parse(name, default):
+        value = args.get(name)
+        if not value:
+            return default
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO 8601 date or timestamp")
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    date_to = parse('to', now)
+    date_from = parse('from', date_to - default_span)
+    return date_from, date_to
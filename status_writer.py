@@ -0,0 +1,336 @@
+"""
+Write-behind persistence for Twilio call status callbacks.
+
+The webhook only parses the callback and puts a StatusEvent on a bounded
+in-process queue. A background thread drains the queue and applies events
+in batches: one multi-row INSERT into call_events (which makes delivery
+idempotent per (CallSid, status)), one multi-row UPDATE of calls guarded by
+status rank (so late or out-of-order callbacks never move a call backwards),
+then agent release and rollups for calls that just finished.
+
+Twilio can deliver the first callbacks before the calls row exists (the
+outbound call is placed before its row is inserted). Their events are still
+recorded in call_events, and insert_calls() replays them onto the row when
+it is inserted; a per-call advisory lock orders the two so neither misses
+the other's uncommitted write.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import psycopg2.extras
+
+import call_queue
+import rollups
+from advisory_locks import CALL_ROW_NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+StatusEvent = namedtuple('StatusEvent', 'call_sid status event_time duration sequence_number')
+
+# Position of each status in the call state machine. Terminal statuses share
+# the top rank: once a call has ended, no later callback changes its status.
+STATUS_RANKS = {
+    'queued': 0,
+    'initiated': 1,
+    'ringing': 2,
+    'answered': 3,
+    'transferred': 4,
+    'completed': 10,
+    'failed': 10,
+    'busy': 10,
+    'no-answer': 10,
+    'canceled': 10,
+}
+TERMINAL_RANK = 10
+
+# Twilio reports an answered call as 'in-progress'
+TWILIO_STATUS_ALIASES = {'in-progress': 'answered'}
+
+# A finished call only frees its agent if the agent hasn't been linked to a newer call since
+AGENT_RELEASE_WINDOW = '4 hours'
+
+# Moves each call to its event's status; rank-guarded, so never backwards
+UPDATE_CALLS_QUERY = """
+    UPDATE calls AS c SET
+        status = v.status,
+        end_time = CASE WHEN v.terminal THEN v.event_time ELSE c.end_time END,
+        duration = CASE WHEN v.terminal
+                        THEN COALESCE(v.duration, GREATEST(EXTRACT(EPOCH FROM (v.event_time - c.start_time)), 0)::INTEGER)
+                        ELSE c.duration END
+    FROM (VALUES %s) AS v(call_sid, status, event_time, duration, rank, terminal)
+    WHERE c.call_sid = v.call_sid AND call_status_rank(c.status) < v.rank
+    RETURNING c.call_sid, c.agent_id, c.start_time, c.status, c.duration, v.terminal
+"""
+UPDATE_CALLS_TEMPLATE = "(%s, %s, %s::timestamptz, %s::integer, %s, %s)"
+# Callers pass the call_sids sorted, so two transactions always lock in the same order
+LOCK_CALL_ROWS_QUERY = "SELECT pg_advisory_xact_lock(%s, hashtext(t.call_sid)) FROM unnest(%s::text[]) AS t(call_sid)"
+# Highest-ranked recorded event per call
+RECORDED_EVENTS_QUERY = """
+    SELECT DISTINCT ON (call_sid) call_sid, status, event_time, duration
+    FROM call_events
+    WHERE call_sid = ANY(%s)
+    ORDER BY call_sid, call_status_rank(status) DESC, event_time DESC
+"""
+INSERT_CALLS_QUERY = "INSERT INTO calls (call_sid, caller_number, start_time, status) VALUES %s"
+
+
+def event_from_twilio(form):
+    """Build a StatusEvent from a Twilio status callback form, or None if it has no CallSid/status."""
+    call_sid = form.get('CallSid')
+    status = form.get('CallStatus')
+    if not call_sid or not status:
+        return None
+    status = TWILIO_STATUS_ALIASES.get(status, status)
+    if status not in STATUS_RANKS:
+        logger.warning(f"Ignoring unknown call status {status!r} for {call_sid}")
+        return None
+    event_time = None
+    timestamp = form.get('Timestamp')
+    if timestamp:
+        try:
+            event_time = parsedate_to_datetime(timestamp)
+        except (TypeError, ValueError):
+            pass
+    duration = form.get('CallDuration')
+    sequence_number = form.get('SequenceNumber')
+    return StatusEvent(
+        call_sid=call_sid,
+        status=status,
+        event_time=event_time or datetime.now(timezone.utc),
+        duration=int(duration) if duration and duration.isdigit() else None,
+        sequence_number=int(sequence_number) if sequence_number and sequence_number.isdigit() else None,
+    )
+
+
+def apply_events(cursor, events):
+    """Persist a batch of status events inside the caller's transaction.
+
+    Returns a dict with the calls that changed status ('updated') and the
+    ids of agents released back to 'available' ('released_agents').
+    """
+    # Collapse duplicates inside the batch; Twilio retries can land in the same flush
+    unique = {}
+    for event in events:
+        unique.setdefault((event.call_sid, event.status), event)
+    if not unique:
+        return {'updated': [], 'released_agents': []}
+
+    inserted = psycopg2.extras.execute_values(cursor, """
+        INSERT INTO call_events (call_sid, status, event_time, duration, sequence_number)
+        VALUES %s
+        ON CONFLICT (call_sid, status) DO NOTHING
+        RETURNING call_sid, status, event_time, duration
+    """, [tuple(e) for e in unique.values()], fetch=True)
+
+    # Highest-ranked new event per call; earlier stages arriving late are dropped here
+    latest = {}
+    for call_sid, status, event_time, duration in inserted:
+        current = latest.get(call_sid)
+        if current is None or STATUS_RANKS[status] > STATUS_RANKS[current[0]]:
+            latest[call_sid] = (status, event_time, duration)
+    if not latest:
+        return {'updated': [], 'released_agents': []}
+
+    updated = _update_calls(cursor, latest)
+    # No row (yet), or already past this status. Wait out any insert_calls() in flight for these
+    # calls and look again: either its row is visible now, or it will see our events once we commit.
+    missed = sorted(set(latest) - {row[0] for row in updated})
+    if missed:
+        cursor.execute(LOCK_CALL_ROWS_QUERY, (CALL_ROW_NAMESPACE, missed))
+        updated += _update_calls(cursor, {call_sid: latest[call_sid] for call_sid in missed})
+    return _finish_calls(cursor, updated)
+
+
+def insert_calls(cursor, rows):
+    """Insert calls rows (call_sid, caller_number, start_time, status) inside the caller's transaction.
+
+    Status callbacks recorded before a row existed are applied to it straight
+    away. Returns the same dict as apply_events().
+    """
+    if not rows:
+        return {'updated': [], 'released_agents': []}
+    call_sids = sorted(row[0] for row in rows)
+    cursor.execute(LOCK_CALL_ROWS_QUERY, (CALL_ROW_NAMESPACE, call_sids))
+    psycopg2.extras.execute_values(cursor, INSERT_CALLS_QUERY, rows)
+    cursor.execute(RECORDED_EVENTS_QUERY, (call_sids,))
+    recorded = {call_sid: (status, event_time, duration) for call_sid, status, event_time, duration in cursor.fetchall()}
+    if not recorded:
+        return {'updated': [], 'released_agents': []}
+    return _finish_calls(cursor, _update_calls(cursor, recorded))
+
+
+def _update_calls(cursor, latest):
+    """Apply {call_sid: (status, event_time, duration)} to the calls rows; returns the rows that moved."""
+    values = sorted(
+        (call_sid, status, event_time, duration, STATUS_RANKS[status], STATUS_RANKS[status] == TERMINAL_RANK)
+        for call_sid, (status, event_time, duration) in latest.items()
+    )
+    return psycopg2.extras.execute_values(cursor, UPDATE_CALLS_QUERY, values, template=UPDATE_CALLS_TEMPLATE,
+                                          fetch=True)
+
+
+def _finish_calls(cursor, updated):
+    """Release agents and record rollups for the calls among `updated` that just finished."""
+    finished = [row for row in updated if row[5]]
+    released = []
+    agent_ids = sorted({row[1] for row in finished if row[1] is not None})
+    if agent_ids:
+        cursor.execute(f"""
+            UPDATE agents a
+            SET status = 'available', last_status_update = CURRENT_TIMESTAMP
+            WHERE a.id = ANY(%(agent_ids)s) AND a.status = 'on_call'
+              AND NOT EXISTS (
+                  SELECT 1 FROM calls c
+                  WHERE c.agent_id = a.id
+                    AND call_status_rank(c.status) < {TERMINAL_RANK}
+                    AND c.start_time > CURRENT_TIMESTAMP - INTERVAL '{AGENT_RELEASE_WINDOW}'
+              )
+            RETURNING a.id
+        """, {'agent_ids': agent_ids})
+        released = [row[0] for row in cursor.fetchall()]
+    if finished:
+        rollups.record_calls(cursor, [(row[1], row[2], row[3], row[4]) for row in finished])
+        # A caller who hung up on hold; the <Enqueue> action callback may never come
+        call_queue.abandon_ended(cursor, sorted(row[0] for row in finished))
+    return {'updated': updated, 'released_agents': released}
+
+
+class StatusWriteBehind:
+    """Bounded queue plus background thread that applies status events in batches."""
+
+    def __init__(self, pool, max_queue=10000, batch_size=500, flush_interval=0.05,
+                 on_flush=None, after_commit=None):
+        self.pool = pool
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        # How long the writer waits to fill a batch once the first event arrives
+        self.flush_interval = flush_interval
+        # on_flush(cursor, result) runs inside the batch transaction, after_commit(result) after it
+        self.on_flush = on_flush
+        self.after_commit = after_commit
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'flushed_events': 0, 'batches': 0, 'failed_batches': 0,
+                       'dropped_events': 0}
+        atexit.register(self.drain)
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each gunicorn worker starts its own writer
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='status-write-behind', daemon=True)
+            self._thread.start()
+
+    def submit(self, event):
+        """Queue an event without blocking. Returns False when the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._stats['rejected'] += 1
+            return False
+        self._stats['submitted'] += 1
+        return True
+
+    def _next_batch(self, block=True):
+        try:
+            batch = [self._queue.get(block=block, timeout=1.0 if block else None)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch, attempts=3):
+        """Apply one batch, retrying transient database errors with backoff.
+
+        Any other error (bad data, a violated constraint) would fail the same
+        way on every retry, so the batch is split in halves and each applied on
+        its own: only the offending event is dropped, not every other call's
+        callbacks with it.
+        """
+        for attempt in range(1, attempts + 1):
+            conn = None
+            try:
+                conn = self.pool.getconn()
+                with conn.cursor() as cursor:
+                    result = apply_events(cursor, batch)
+                    if self.on_flush and result['updated']:
+                        self.on_flush(cursor, result)
+                conn.commit()
+                self.pool.putconn(conn)
+                self._stats['batches'] += 1
+                self._stats['flushed_events'] += len(batch)
+                if self.after_commit:
+                    try:
+                        self.after_commit(result)
+                    except Exception as e:
+                        logger.error(f"Status write-behind after_commit hook failed: {str(e)}")
+                return result
+            except Exception as e:
+                transient = conn is None or isinstance(e, psycopg2.OperationalError)
+                if conn is not None:
+                    self.pool.putconn(conn, close=isinstance(e, psycopg2.OperationalError))
+                logger.error(f"Status write-behind flush of {len(batch)} events failed (attempt {attempt}/{attempts}): {str(e)}")
+                if not transient:
+                    return self._flush_split(batch, attempts)
+                time.sleep(0.1 * 2 ** attempt)
+        self._stats['failed_batches'] += 1
+        self._stats['dropped_events'] += len(batch)
+        # Twilio won't resend these, so keep enough in the log to replay them by hand
+        logger.error(f"Dropped status events after {attempts} attempts: {batch}")
+        return None
+
+    def _flush_split(self, batch, attempts):
+        if len(batch) == 1:
+            self._stats['dropped_events'] += 1
+            logger.error(f"Dropped status event that can't be applied: {batch[0]}")
+            return None
+        middle = len(batch) // 2
+        results = [result for result in (self.flush(batch[:middle], attempts), self.flush(batch[middle:], attempts))
+                   if result is not None]
+        if not results:
+            return None
+        return {key: [item for result in results for item in result[key]] for key in ('updated', 'released_agents')}
+
+    def drain(self):
+        """Flush everything still queued in this process (used at shutdown)."""
+        if self._pid != os.getpid():
+            return
+        while True:
+            batch = self._next_batch(block=False)
+            if not batch:
+                return
+            self.flush(batch)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self.max_queue
+        return stats
@@ -1,17 +1,41 @@
-from flask import Flask, request, jsonify, send_from_directory, g, session
-from twilio.twiml.voice_response import VoiceResponse, Say
-from twilio.jwt.access_token import AccessToken
-from twilio.jwt.access_token.grants import VoiceGrant
-from twilio.rest import Client
+from flask import Flask, Response, stream_with_context, request, jsonify, send_from_directory, g, session
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-import sqlite3
-from datetime import datetime, timedelta
+import math
+import json
+import queue
+import time
+import threading
+from datetime import datetime
 from functools import wraps
+from contextlib import contextmanager
 import logging
+import click
 from dotenv import load_dotenv
 import psycopg2 # Import psycopg2
 import psycopg2.extras # Import psycopg2.extras for DictCursor
+from db_pool import ConnectionPool
+import agent_assignment
+import call_queries
+import db_setup
+import call_archive
+import dashboard_metrics
+import rollups
+import status_writer
+import campaigns
+import call_dispatch
+import call_queue
+from agent_presence import AgentPresenceRegistry
+from ivr_sessions import IVRSessionStore
+import ivr_flow
+from metrics_cache import SharedTTLCache
+import instrumentation
+import http_cache
+import change_tracking
+import fast_json
+import rate_limit
+import idempotency
 
 # Load environment variables
 load_dotenv()
@@ -21,17 +45,31 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# orjson-backed jsonify() when orjson is installed; also encodes raw cursor rows (fast_json.RowSet)
+app.json = fast_json.FastJSONProvider(app)
 # Configure CORS to allow requests from the Next.js frontend
 CORS(app, resources={
     r"/*": {
         "origins": "*", # Allow all origins temporarily
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", idempotency.HEADER],
+        "expose_headers": ["Retry-After", "Idempotent-Replayed"]
     }
 })
+# Number of reverse proxies in front of the app whose X-Forwarded-For is trusted for
+# request.remote_addr; the per-IP rate limit would otherwise see only the proxy. Render (which
+# sets RENDER=true on its services) puts exactly one in front; set 0 when exposed directly,
+# since a client could then forge the header.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1 if os.environ.get('RENDER') else 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 # Replace with a real secret key in production!
 app.secret_key = os.environ.get('SECRET_KEY', 'a_very_secret_key_for_dev')
 
+# Agent assignment strategy used by /gather_age (longest_idle, round_robin, least_calls_today)
+AGENT_ASSIGNMENT_STRATEGY = os.environ.get('AGENT_ASSIGNMENT_STRATEGY', agent_assignment.DEFAULT_STRATEGY)
+agent_assignment.get_strategy(AGENT_ASSIGNMENT_STRATEGY) # Fail fast on a misconfigured strategy name
+
 # Database configuration - Use DATABASE_URL environment variable for PostgreSQL
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
@@ -40,38 +78,75 @@ if not DATABASE_URL:
     # In a real app, you might want to raise an error or exit here
     # For now, let's allow it to run, but db operations will fail.
 
+# Connection pool settings (per gunicorn worker process)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))  # seconds before idle connections are closed
+
+# Query instrumentation: share of statements recorded in /metrics, and an optional slow-query log
+instrumentation.configure(
+    sample_rate=float(os.environ.get('QUERY_METRICS_SAMPLE_RATE', 1.0)),
+    slow_query_ms=float(os.environ.get('SLOW_QUERY_MS', 0)) or None # 0 disables the slow-query log
+)
+
+# The pool connects lazily, so creating it here does not touch the database.
+# Its connections hand out timed cursors, so every query shows up in /metrics.
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    connection_factory=instrumentation.InstrumentedConnection,
+) if DATABASE_URL else None
+
+# Agents indexed by status in memory, kept current through LISTEN/NOTIFY (one listener per worker)
+agent_registry = AgentPresenceRegistry(DATABASE_URL) if DATABASE_URL else None
+
+def live_agent_availability():
+    """Agent counts from the presence registry, or None until it has synchronized."""
+    if agent_registry is None or not agent_registry.ensure_started():
+        return None
+    counts = agent_registry.counts()
+    return {
+        'available': counts.get('available', 0),
+        'on_call': counts.get('on_call', 0),
+        'offline': counts.get('offline', 0),
+        'total': counts['total']
+    }
+
 def get_db():
-    """Get database connection for PostgreSQL."""
+    """Check out a pooled PostgreSQL connection for the current app context."""
     if not DATABASE_URL:
         logger.error("Cannot connect to database, DATABASE_URL is not set.")
         return None # Or raise an exception
         
+    # If there was a connection error on a previous call within the same request context
+    if getattr(g, '_database_error', None) is not None:
+         raise g._database_error # Re-raise the stored error
+
     if not hasattr(g, '_database'):
         try:
-            # Connect to PostgreSQL using the URL
-            # Use DictCursor to fetch rows as dictionaries
-            g._database = psycopg2.connect(DATABASE_URL)
+            g._database = db_pool.getconn()
         except Exception as e:
             logger.error(f"Database connection error: {str(e)}")
             # Store the error on g so we don't try to reconnect repeatedly
             g._database_error = e
             raise # Re-raise the exception after logging
-    
-    # If there was a connection error on a previous call within the same request context
-    if hasattr(g, '_database_error') and g._database_error is not None:
-         raise g._database_error # Re-raise the stored error
          
     return g._database
 
 def close_connection(exception=None):
-    """Close database connection for PostgreSQL."""
-    db = getattr(g, '_database', None)
+    """Return the app context's connection to the pool."""
+    db = g.pop('_database', None)
     if db is not None:
         try:
-            db.close()
-            logger.info("Database connection closed.")
+            # Connections that saw an error may be broken, so don't reuse them
+            db_pool.putconn(db, close=isinstance(exception, psycopg2.OperationalError))
+            logger.debug("Database connection returned to pool.")
         except Exception as e:
-            logger.error(f"Error closing database connection: {str(e)}")
+            logger.error(f"Error returning database connection to pool: {str(e)}")
     # Clear any stored error on this context
     if hasattr(g, '_database_error'):
         del g._database_error
@@ -79,88 +154,38 @@ def close_connection(exception=None):
 # Register the close_connection function with the app teardown
 app.teardown_appcontext(close_connection)
 
+@contextmanager
+def db_pool_connection():
+    """Borrow a pooled connection outside of a request (background jobs, CLI commands)."""
+    conn = db_pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        db_pool.putconn(conn)
+
 def init_db():
-    """Initialize PostgreSQL database tables if they don't exist."""
+    """Apply pending schema migrations and seed mock agents into an empty database.
+
+    Not run at import: gunicorn.conf.py does it once in the master before
+    workers fork, and `flask init-db` does it on demand.
+    """
     if not DATABASE_URL:
         logger.error("Cannot initialize database, DATABASE_URL is not set.")
         return
-        
+
     try:
-        # Connect and create tables outside of request context
-        with app.app_context():
-            db = get_db()
-            if db is None: # Handle case where get_db returns None due to missing URL
-                 logger.error("Failed to get DB connection for initialization.")
-                 return
-                 
-            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            
-            # Create agents table with PostgreSQL syntax (SERIAL for auto-increment)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS agents (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    phone_number VARCHAR(255) NOT NULL UNIQUE,
-                    status VARCHAR(50) NOT NULL DEFAULT 'offline',
-                    last_status_update TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            
-            # Create calls table with PostgreSQL syntax
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS calls (
-                    id SERIAL PRIMARY KEY,
-                    call_sid VARCHAR(255) UNIQUE,
-                    caller_number VARCHAR(255) NOT NULL,
-                    agent_id INTEGER REFERENCES agents(id),
-                    start_time TIMESTAMP WITH TIME ZONE,
-                    end_time TIMESTAMP WITH TIME ZONE,
-                    duration INTEGER, -- in seconds
-                    status VARCHAR(50),
-                    recording_url VARCHAR(255),
-                    ai_interaction_summary TEXT
-                );
-            ''')
-            
-            db.commit()
-            logger.info("PostgreSQL database tables checked/created.")
-            
-            # Add mock agents only if the table is empty
-            cursor.execute("SELECT COUNT(*) FROM agents;")
-            count = cursor.fetchone()[0]
-            if count == 0:
-                mock_agents = [
-                    ("Sarah Johnson", "+919325484855", "available"),
-                    ("Mike Chen", "+15552345678", "offline"),
-                    ("Emily Rodriguez", "+15553456789", "available"),
-                    ("David Kim", "+15554567890", "offline"),
-                ]
-                # Use executemany with a list of tuples
-                cursor.executemany(
-                    "INSERT INTO agents (name, phone_number, status) VALUES (%s, %s, %s);",
-                    mock_agents
-                )
-                db.commit()
-                logger.info("PostgreSQL database initialized with mock agents.")
-            else:
-                logger.info("PostgreSQL agents table already contains data.")
-                
+        db_setup.setup_database(DATABASE_URL)
     except Exception as e:
         logger.error(f"PostgreSQL database initialization error: {str(e)}")
-        # Depending on severity, you might want to exit the app here
-        # import sys
-        # sys.exit(1)
         # For now, we log and let the app try to run (though db operations will fail)
 
-# Initialize database when app starts (ensure this runs on import by Gunicorn)
-init_db()
-
 # Add error handler for PostgreSQL errors
 @app.errorhandler(psycopg2.Error)
 def handle_db_error(error):
     logger.error(f"PostgreSQL database error: {str(error)}")
-    # Ensure connection is closed in case of error during request
-    close_connection()
+    # Ensure connection is returned to the pool in case of error during request
+    close_connection(error)
     return jsonify({
         "error": "Database error occurred",
         "details": str(error)
@@ -190,6 +215,129 @@ def json_response(f):
             return handle_error(e)
     return decorated_function
 
+# ETag/Last-Modified for the polling endpoints, validated against the table change counters
+conditional_get = http_cache.ConditionalGet(lambda: get_db().cursor())
+
+# gzip/brotli for large JSON and CSV bodies
+app.after_request(http_cache.compress_response)
+
+# Per-client limits on /request_call, where every accepted request dials a paid Twilio call.
+# 'postgres' shares the buckets between gunicorn workers; 'memory' limits each worker on its own.
+# RATE_LIMIT_ENABLED=false turns them off, e.g. for load tests that send every call from one address.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() not in ('0', 'false', 'no', 'off')
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'postgres' if DATABASE_URL else 'memory')
+request_call_ip_limiter = rate_limit.KeyedRateLimiter(
+    'request_call_ip',
+    rate=float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', 30)) / 60,
+    capacity=int(os.environ.get('RATE_LIMIT_IP_BURST', 10)),
+    shared=RATE_LIMIT_BACKEND == 'postgres'
+)
+request_call_number_limiter = rate_limit.KeyedRateLimiter(
+    'request_call_number',
+    rate=float(os.environ.get('RATE_LIMIT_NUMBER_PER_MINUTE', 2)) / 60,
+    capacity=int(os.environ.get('RATE_LIMIT_NUMBER_BURST', 3)),
+    shared=RATE_LIMIT_BACKEND == 'postgres'
+)
+
+# First responses replayed for retries that carry the same idempotency key
+IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'postgres' if DATABASE_URL else 'memory')
+idempotency_store = idempotency.IdempotencyStore(
+    ttl=float(os.environ.get('IDEMPOTENCY_TTL', 86400)), # seconds
+    max_entries=int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000)),
+    shared=IDEMPOTENCY_BACKEND == 'postgres'
+)
+
+def check_rate_limit(limiter, key):
+    """Take a token for `key`; returns None if allowed, else a 429 response with Retry-After."""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if limiter.shared:
+        db = get_db()
+        retry_after = limiter.check(key, db.cursor())
+        db.commit()
+    else:
+        retry_after = limiter.check(key)
+    if not retry_after:
+        return None
+    instrumentation.RATE_LIMITED_REQUESTS.inc(labels=(limiter.name,))
+    response = jsonify({"error": "Too many requests, please retry later.", "retry_after": math.ceil(retry_after)})
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
+def rate_limited_by_ip(limiter):
+    """Reject a client IP over `limiter` before the view (or anything else) runs."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            return check_rate_limit(limiter, request.remote_addr) or f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def idempotency_cursor():
+    """Cursor for the idempotency store, or None when keys are kept in memory only."""
+    return get_db().cursor() if idempotency_store.shared else None
+
+def release_idempotency_key(key):
+    try:
+        if idempotency_store.shared:
+            db = get_db()
+            db.rollback() # The view's transaction failed; don't commit any of it
+            idempotency_store.release(key, db.cursor())
+            db.commit()
+        else:
+            idempotency_store.release(key)
+    except Exception as e:
+        # The claim still expires after in_progress_ttl
+        logger.error(f"Could not release idempotency key {key}: {str(e)}")
+
+def idempotent(header=idempotency.HEADER):
+    """Replay the first response to a request for every retry carrying the same `header` value.
+
+    Requests without the header run as usual. Responses worth retrying
+    (5xx, 429) and exceptions give the key back instead of storing them.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get(header)
+            if not key:
+                return f(*args, **kwargs)
+            if len(key) > idempotency.MAX_KEY_LENGTH:
+                return jsonify({"error": f"{header} must be at most {idempotency.MAX_KEY_LENGTH} characters"}), 400
+            key = f"{request.endpoint}:{key}"
+            fingerprint = idempotency.fingerprint(request.method, request.full_path, request.get_data())
+            cursor = idempotency_cursor()
+            state, stored = idempotency_store.begin(key, fingerprint, cursor)
+            if cursor is not None:
+                get_db().commit() # Other workers must see the claim before the view runs
+            instrumentation.IDEMPOTENT_REQUESTS.inc(labels=(state,))
+            if state == idempotency.REPLAY:
+                response = Response(stored.body, status=stored.status_code, headers=stored.headers)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if state == idempotency.IN_PROGRESS:
+                response = jsonify({"error": "A request with this key is still being processed."})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            if state == idempotency.MISMATCH:
+                return jsonify({"error": f"{header} was already used for a different request."}), 422
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except Exception:
+                release_idempotency_key(key)
+                raise
+            if response.is_streamed or not idempotency.cacheable(response.status_code):
+                release_idempotency_key(key)
+                return response
+            cursor = idempotency_cursor()
+            idempotency_store.complete(key, idempotency.StoredResponse.capture(
+                response.status_code, response.headers.items(), response.get_data()), cursor)
+            if cursor is not None:
+                get_db().commit()
+            return response
+        return decorated_function
+    return decorator
+
 # Twilio credentials
 # Load from environment variables for security
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
@@ -200,84 +348,314 @@ if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
     logger.error("TWILIO_ACCOUNT_SID or TWILIO_AUTH_TOKEN environment variables are not set.")
     # Depending on requirements, you might want to raise an exception or exit here
 
-# Initialize Twilio client
-# Ensure credentials are not None before initializing
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN) if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else None
+# Twilio REST calls from request threads, the dispatcher and the campaign dialer share one
+# keep-alive HTTP session, so each call reuses a warm TLS connection
+CALL_DISPATCH_WORKERS = int(os.environ.get('CALL_DISPATCH_WORKERS', 8))
+TWILIO_HTTP_TIMEOUT = float(os.environ.get('TWILIO_HTTP_TIMEOUT', 15)) # seconds
+
+# Points the REST client at another host, e.g. the fake Twilio server of benchmarks/load_test.py
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', '').rstrip('/')
+
+_twilio_client = None
+_twilio_client_lock = threading.Lock()
+
+def get_twilio_client():
+    """The shared Twilio REST client, built on first use (None without credentials).
+
+    twilio.rest is slow to import, so workers that never place a call don't pay for it.
+    """
+    global _twilio_client
+    if _twilio_client is None and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        with _twilio_client_lock:
+            if _twilio_client is None:
+                import twilio_client
+                _twilio_client = twilio_client.create_client(
+                    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, timeout=TWILIO_HTTP_TIMEOUT,
+                    pool_maxsize=CALL_DISPATCH_WORKERS + 4, base_url=TWILIO_API_BASE_URL or None)
+    return _twilio_client
+
+TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', "+19787836427") # Your Twilio US number
+# Replace with your deployed backend URL on Render (e.g., https://your-app-name.onrender.com)
+DEPLOYED_BACKEND_URL = os.environ.get('DEPLOYED_BACKEND_URL', "https://ai-call-centre-backend.onrender.com")
+STATUS_CALLBACK_EVENTS = ['initiated', 'ringing', 'answered', 'completed', 'failed', 'no-answer', 'busy', 'canceled']
+
+def place_outbound_call(to_phone_number):
+    """Start an outbound call that enters the IVR at /voice. Returns the Twilio CallSid."""
+    client = get_twilio_client()
+    if client is None:
+        raise RuntimeError("Twilio client is not configured")
+    call = client.calls.create(
+        to=to_phone_number,
+        from_=TWILIO_PHONE_NUMBER,
+        # Deployed backend URL + /voice endpoint
+        url=f"{DEPLOYED_BACKEND_URL}/voice",
+        # Deployed backend URL + /twilio_status_callback endpoint
+        status_callback=f"{DEPLOYED_BACKEND_URL}/twilio_status_callback",
+        status_callback_event=STATUS_CALLBACK_EVENTS
+    )
+    return call.sid
+
+def find_outbound_call(to_phone_number, since):
+    """CallSid of the first call placed to the number at or after `since`, or None (see CallDispatcher)."""
+    client = get_twilio_client()
+    if client is None:
+        raise RuntimeError("Twilio client is not configured")
+    # Newest first; calls that never started have no start_time, so filter on date_created here
+    calls = [call for call in client.calls.list(to=to_phone_number, from_=TWILIO_PHONE_NUMBER, limit=20)
+             if call.date_created is not None and call.date_created >= since]
+    return calls[-1].sid if calls else None
+
+# IVR answers collected so far, keyed by CallSid. 'postgres' shares them between gunicorn
+# workers (Twilio's next webhook may reach any of them); 'memory' suits a single process.
+IVR_SESSION_BACKEND = os.environ.get('IVR_SESSION_BACKEND', 'postgres' if DATABASE_URL else 'memory')
+ivr_session_store = IVRSessionStore(
+    ttl=float(os.environ.get('IVR_SESSION_TTL', 900)), # seconds
+    max_entries=int(os.environ.get('IVR_SESSION_MAX_ENTRIES', 10000)),
+    shared=IVR_SESSION_BACKEND == 'postgres'
+)
+
+def ivr_session_cursor():
+    """Cursor for the IVR session store, or None when sessions are kept in memory only."""
+    return get_db().cursor() if ivr_session_store.shared else None
+
+# The IVR as data: each step asks one question and stores the answer in the IVR session.
+# TwiML for every step is compiled once here; requests only fill in the {{fields}}.
+IVR_FLOW = ivr_flow.Flow([
+    ivr_flow.Step(
+        'name',
+        prompt="Welcome to our call center. To help us direct your call, please state your full name.",
+        reprompt="I didn't catch your name. Please state your full name.",
+        field='caller_name',
+        next='age'
+    ),
+    ivr_flow.Step(
+        'age',
+        prompt="Thank you, {{caller_name}}. Now, please state your age.",
+        reprompt="I didn't catch your age. Please state your age.",
+        field='age',
+        input='dtmf speech',
+        validator=ivr_flow.age
+    ),
+])
+
+def _connect_template(resp):
+    IVR_FLOW.say(resp, "Thank you, {{caller_name}}. You stated your age as {{age}}. Please wait while I connect you to an available agent.")
+    resp.dial('{{agent_phone_number}}')
+
+def _no_agent_template(resp):
+    IVR_FLOW.say(resp, "Thank you, {{caller_name}}. You stated your age as {{age}}. Unfortunately, no agents are currently available. Please try again later.")
+    resp.hangup()
+
+# Hold queue: callers who find every agent busy wait on hold instead of being hung up on
+CALL_QUEUE_ENABLED = os.environ.get('CALL_QUEUE_ENABLED', 'true').lower() == 'true'
+CALL_QUEUE_NAME = os.environ.get('CALL_QUEUE_NAME', 'support')
+CALL_QUEUE_WAIT_MUSIC_URL = os.environ.get('CALL_QUEUE_WAIT_MUSIC_URL', "http://com.twilio.sounds.music.s3.amazonaws.com/MARKOVICHAMP-Borghestral.mp3")
+CALL_QUEUE_POLL_INTERVAL = float(os.environ.get('CALL_QUEUE_POLL_INTERVAL', 5)) # seconds
+
+def _enqueue_template(resp):
+    IVR_FLOW.say(resp, "Thank you, {{caller_name}}. All of our agents are busy right now. Please stay on the line and you will be connected to the next available agent.")
+    resp.enqueue(CALL_QUEUE_NAME, action='/queue/leave', method='POST', wait_url='/queue/wait', wait_url_method='POST')
+
+def _queue_wait_template(resp):
+    IVR_FLOW.say(resp, "You are number {{position}} in line. Your estimated wait time is about {{minutes}} minutes.")
+    resp.play(CALL_QUEUE_WAIT_MUSIC_URL)
+
+def _queue_connect_template(resp):
+    IVR_FLOW.say(resp, "Thank you for waiting. Connecting you to an agent now.")
+    resp.dial('{{agent_phone_number}}')
+
+IVR_FLOW.template('connect', _connect_template)
+IVR_FLOW.template('no_agent', _no_agent_template)
+IVR_FLOW.template('enqueue', _enqueue_template)
+IVR_FLOW.template('queue_wait', _queue_wait_template)
+IVR_FLOW.template('queue_connect', _queue_connect_template)
+IVR_FLOW.template('queue_music', lambda resp: resp.play(CALL_QUEUE_WAIT_MUSIC_URL))
+IVR_FLOW.template('hangup', lambda resp: resp.hangup())
+
+def connect_queued_call(call_sid, agent):
+    """Redirect a caller on hold to dial the agent claimed for them."""
+    client = get_twilio_client()
+    if client is None:
+        raise RuntimeError("Twilio client is not configured")
+    client.calls(call_sid).update(twiml=IVR_FLOW.render('queue_connect', {'agent_phone_number': agent['phone_number']}))
+
+def agents_maybe_available():
+    """False only when the presence registry knows no agent is available."""
+    if agent_registry is None or not agent_registry.ready:
+        return None
+    return agent_registry.count('available') > 0
+
+call_queue_dispatcher = call_queue.CallQueueDispatcher(
+    db_pool,
+    connect_queued_call,
+    strategy=AGENT_ASSIGNMENT_STRATEGY,
+    agents_available=agents_maybe_available,
+    poll_interval=CALL_QUEUE_POLL_INTERVAL,
+) if db_pool and CALL_QUEUE_ENABLED else None
+
+def notify_agents_released(result=None):
+    """Let the hold queue know agents may have been freed (result is a status_writer batch result)."""
+    if call_queue_dispatcher is not None and (result is None or result['released_agents']):
+        call_queue_dispatcher.notify()
+
+def twiml_response(twiml):
+    return Response(twiml, mimetype='text/xml')
+
+def caller_number(values):
+    """The customer's number from Twilio webhook parameters (our number is From on outbound calls)."""
+    return values.get('To') if values.get('Direction', '').startswith('outbound') else values.get('From')
+
+def ivr_summary(answers):
+    return answers.get('caller_name') or 'caller', answers.get('age')
+
+UPDATE_CALL_SUMMARY = "UPDATE calls SET ai_interaction_summary = %s WHERE call_sid = %s"
+
+def complete_ivr(call_sid, answers):
+    """Store the AI summary and hand the caller to an agent (or hang up if none is free)."""
+    caller_name, age = ivr_summary(answers)
+    print(f"Collected Name: {caller_name}, Age: {age} (CallSid: {call_sid})")
+    db = get_db()
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    ai_summary = f"Name: {caller_name}, Age: {age}" if call_sid else None
+    # Claim an agent, link the call to them and store the summary in one atomic statement
+    # (skipped when the presence registry already knows nobody is available)
+    agent = None
+    if agents_maybe_available() is not False:
+         agent = agent_assignment.claim_agent(cursor, call_sid=call_sid, strategy=AGENT_ASSIGNMENT_STRATEGY, ai_summary=ai_summary)
+    if not agent and call_sid:
+         # No agent claimed, so the summary still needs its own write
+         cursor.execute(UPDATE_CALL_SUMMARY, (ai_summary, call_sid))
+    queued = bool(not agent and call_sid and call_queue_dispatcher is not None)
+    if queued:
+         call_queue.enqueue(cursor, call_sid, caller_number(request.values))
+    db.commit()
+    return finish_ivr(call_sid, caller_name, age, agent, queued)
+
+def finish_ivr(call_sid, caller_name, age, agent, queued):
+    """After complete_ivr's transaction committed: drop the session and render the caller's TwiML."""
+    if call_sid:
+         print(f"Updated call {call_sid} with AI summary.")
+         # The shared row expires on its own; just free the local slot
+         ivr_session_store.discard(call_sid)
+    values = {'caller_name': caller_name, 'age': age}
+    if agent:
+         if call_sid:
+              print(f"Linked call {call_sid} to agent {agent['id']} and updated status to transferred.")
+         print(f"Attempting to connect to agent: {agent['phone_number']}")
+         return IVR_FLOW.render('connect', dict(values, agent_phone_number=agent['phone_number']))
+    if queued:
+         # An agent may have been freed since the claim; don't wait for the next poll
+         call_queue_dispatcher.notify()
+         print(f"No agents available. Call {call_sid} placed on hold.")
+         return IVR_FLOW.render('enqueue', values)
+    print("No agents available. Hanging up.")
+    return IVR_FLOW.render('no_agent', values)
+
+def run_ivr_step(step_name, attempt=None):
+    """Run one IVR step for the calling CallSid and return its TwiML."""
+    call_sid = request.values.get('CallSid')
+    cursor = ivr_session_cursor()
+    answers = ivr_session_store.get(call_sid, cursor, require=IVR_FLOW.fields_before.get(step_name, ()))
+    # Older action URLs carried the name in the request itself
+    if 'caller_name' not in answers and request.values.get('caller_name'):
+        answers['caller_name'] = request.values['caller_name']
+    outcome = IVR_FLOW.handle(step_name, request.values, answers, attempt)
+    if outcome.complete:
+        return complete_ivr(call_sid, dict(answers, **outcome.updates))
+    if outcome.updates and call_sid:
+        # One write per step: the answer is merged into the session row
+        ivr_session_store.update(call_sid, cursor, **outcome.updates)
+        if cursor is not None:
+            get_db().commit()
+    return outcome.twiml
+
+@app.route("/ivr/<step>", methods=['GET', 'POST'])
+@idempotent(idempotency.TWILIO_HEADER)
+def ivr_step(step):
+    """Generic Twilio webhook for every step of IVR_FLOW."""
+    if step not in IVR_FLOW.steps:
+        return jsonify({"error": f"Unknown IVR step: {step}"}), 404
+    return twiml_response(run_ivr_step(step, request.args.get('attempt', type=int)))
 
 @app.route("/voice", methods=['GET', 'POST'])
+@idempotent(idempotency.TWILIO_HEADER)
 def voice():
     """
     This endpoint is called by Twilio when an outbound call connects (from /request_call).
-    It initiates the conversation by asking for the user's name.
+    It enters the IVR flow at its first step.
     """
-    resp = VoiceResponse()
-    # Use <Gather> to collect the user's name
-    gather = resp.gather(input='speech', action='/gather_name', method='POST', speechTimeout='auto')
-    gather.say("Welcome to our call center. To help us direct your call, please state your full name.", voice='woman', language='en-US')
-    return str(resp)
+    return twiml_response(run_ivr_step(IVR_FLOW.start))
+
+@app.route("/queue/wait", methods=['GET', 'POST'])
+def queue_wait():
+    """Twilio <Enqueue> waitUrl: announce position and estimated wait, then play hold music."""
+    call_sid = request.values.get('CallSid')
+    if call_queue_dispatcher is None or not call_sid:
+        return twiml_response(IVR_FLOW.render('queue_music'))
+    cursor = get_db().cursor()
+    staffed = None
+    if agent_registry is not None and agent_registry.ready:
+        staffed = agent_registry.count('available') + agent_registry.count('on_call')
+    position, seconds = call_queue_dispatcher.estimate_wait(cursor, call_sid, staffed)
+    if position is None:
+        return twiml_response(IVR_FLOW.render('queue_music'))
+    return twiml_response(IVR_FLOW.render('queue_wait', {'position': position, 'minutes': max(1, round(seconds / 60))}))
+
+@app.route("/queue/leave", methods=['POST'])
+def queue_leave():
+    """Twilio <Enqueue> action URL: records callers who hung up while on hold."""
+    call_sid = request.values.get('CallSid')
+    queue_time = request.values.get('QueueTime')
+    if call_sid:
+        db = get_db()
+        call_queue.mark_left(db.cursor(), call_sid, request.values.get('QueueResult'),
+                             int(queue_time) if queue_time and queue_time.isdigit() else None)
+        db.commit()
+    if request.values.get('QueueResult') in ('error', 'system-error', 'queue-full'):
+        return twiml_response(IVR_FLOW.render('goodbye'))
+    return twiml_response(IVR_FLOW.render('hangup'))
+
+@app.route('/api/queue/metrics', methods=['GET'])
+@json_response
+def get_queue_metrics():
+    """Return hold queue depth, wait-time percentiles and abandonment for the last ?hours= (default 24)."""
+    hours = request.args.get('hours', default=24, type=int)
+    if not 1 <= hours <= 24 * 31:
+        raise ValueError("hours must be between 1 and 744")
+    metrics = call_queue.queue_metrics(get_db().cursor(), window_hours=hours)
+    if call_queue_dispatcher is not None:
+        metrics['dispatcher'] = call_queue_dispatcher.stats()
+    return metrics
+
+@app.route('/api/queue/<call_sid>/priority', methods=['PUT'])
+@json_response
+def update_queue_priority(call_sid):
+    """Move a waiting caller up (or down) the hold queue: {"priority": int}, higher goes first."""
+    data = request.get_json()
+    if not data or not isinstance(data.get('priority'), int):
+        raise ValueError("An integer 'priority' is required")
+    db = get_db()
+    if not call_queue.set_priority(db.cursor(), call_sid, data['priority']):
+        raise ValueError("Call is not waiting in the queue")
+    db.commit()
+    return {"call_sid": call_sid, "priority": data['priority']}
 
+# The original per-step URLs stay routed for calls that were in the IVR during a deploy
 @app.route("/gather_name", methods=['POST'])
 def gather_name():
-    """
-    Processes the collected name (from Twilio's SpeechResult) and asks for the user's age.
-    (No longer uses session; caller_name and CallSid are passed via request.form.)
-    """
-    resp = VoiceResponse()
-    if 'SpeechResult' in request.form:
-        caller_name = request.form['SpeechResult']
-        call_sid = request.form.get('CallSid')
-        gather = resp.gather(input='speech', action='/gather_age', method='POST', speechTimeout='auto')
-        gather.say(f"Thank you, {caller_name}. Now, please state your age.", voice='woman', language='en-US')
-    else:
-        resp.say("I didn't catch your name. Please state your full name.", voice='woman', language='en-US')
-        resp.redirect('/voice')
-    return str(resp)
+    return twiml_response(run_ivr_step('name', attempt=0))
 
 @app.route("/gather_age", methods=['POST'])
 def gather_age():
-    """
-    Processes the collected age (from Twilio's SpeechResult) and (if a CallSid is present) updates the call record (and transfers to an agent) using a DictCursor.
-    (No longer uses session; caller_name (from /gather_name) and CallSid are passed via request.form.)
-    """
-    resp = VoiceResponse()
-    age = request.form.get('SpeechResult')
-    call_sid = request.form.get('CallSid')
-    if not age:
-         resp.say("I didn't catch your age. Please state your age.", voice='woman', language='en-US')
-         resp.redirect('/gather_age')
-         return str(resp)
-    caller_name = request.form.get('caller_name', 'caller')
-    print(f"Collected Name: {caller_name}, Age: {age} (CallSid: {call_sid})")
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    if call_sid:
-         ai_summary = f"Name: {caller_name}, Age: {age}"
-         cursor.execute("UPDATE calls SET ai_interaction_summary = %s WHERE call_sid = %s", (ai_summary, call_sid))
-         db.commit()
-         print(f"Updated call {call_sid} with AI summary.")
-    cursor.execute("SELECT id, phone_number FROM agents WHERE status = %s LIMIT 1", ('available',))
-    agent = cursor.fetchone()
-    if agent:
-         agent_id = agent['id']
-         agent_phone_number = agent['phone_number']
-         cursor.execute("UPDATE agents SET status = %s, last_status_update = CURRENT_TIMESTAMP WHERE id = %s", ('on_call', agent_id))
-         if call_sid:
-              cursor.execute("UPDATE calls SET agent_id = %s, status = %s WHERE call_sid = %s", (agent_id, 'transferred', call_sid))
-              db.commit()
-              print(f"Linked call {call_sid} to agent {agent_id} and updated status to transferred.")
-         resp.say(f"Thank you, {caller_name}. You stated your age as {age}. Please wait while I connect you to an available agent.", voice='woman', language='en-US')
-         resp.dial(agent_phone_number)
-         print(f"Attempting to connect to agent: {agent_phone_number}")
-    else:
-         resp.say(f"Thank you, {caller_name}. You stated your age as {age}. Unfortunately, no agents are currently available. Please try again later.", voice='woman', language='en-US')
-         resp.hangup()
-         print("No agents available. Hanging up.")
-    return str(resp)
+    return twiml_response(run_ivr_step('age', attempt=0))
 
 @app.route("/token", methods=['GET'])
 @json_response
 def get_token():
     """Generate a Twilio Access Token for the client."""
+    # Imported here so worker boot doesn't load the JWT stack
+    from twilio.jwt.access_token import AccessToken
+    from twilio.jwt.access_token.grants import VoiceGrant
     try:
         # Generate a unique identity for the client
         identity = f"agent_{datetime.now().timestamp()}"
@@ -305,21 +683,65 @@ def get_token():
         logger.error(f"Error generating token: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def agent_presence_tag():
+    """ETag source for responses served from the presence registry (None until it has synchronized)."""
+    if agent_registry is None or not agent_registry.ensure_started():
+        return None
+    return agent_registry.state_tag()
+
 @app.route("/api/agents", methods=['GET'])
+@conditional_get('agents', live=agent_presence_tag)
 @json_response
 def get_agents():
     """Retrieve a list of all agents."""
     try:
+         # Served from the presence registry once it has synchronized
+         if agent_registry is not None and agent_registry.ensure_started():
+              return {"data": agent_registry.list_agents()}
          db = get_db()
-         cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+         cursor = db.cursor()
          cursor.execute("SELECT id, name, phone_number, status, last_status_update FROM agents")
-         agents = cursor.fetchall()
-         agents_list = [dict(agent) for agent in agents]
-         return {"data": agents_list}
+         # Plain tuples; the JSON provider turns them into objects while encoding
+         return {"data": fast_json.RowSet.from_cursor(cursor)}
     except Exception as e:
          logger.error(f"Error fetching agents: {e}")
          raise
 
+SSE_HEARTBEAT_SECONDS = 15
+
+@app.route("/api/agents/stream", methods=['GET'])
+def stream_agents():
+    """Server-Sent Events feed of agent changes.
+
+    Sends a 'snapshot' event with every agent first, then an 'agent' event per
+    changed agent ('deleted' for removed ones). Each open stream holds a
+    worker thread, so run gunicorn with threaded (gthread) or async workers.
+    """
+    if agent_registry is None:
+        return jsonify({"error": "DATABASE_URL is not set"}), 500
+    if not agent_registry.ensure_started(wait=5.0):
+        return jsonify({"error": "Agent presence is not available yet"}), 503
+    subscriber = agent_registry.subscribe()
+
+    def generate():
+        try:
+            # Tell EventSource to reconnect quickly if the stream drops
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            agent_registry.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # Stop nginx-style proxies from buffering the stream
+    })
+
 @app.route("/api/agents/<int:agent_id>/status", methods=['PUT'])
 @json_response
 def update_agent_status(agent_id):
@@ -358,10 +780,11 @@ def update_agent_status(agent_id):
         update_values.append(agent_id)
 
         cursor.execute(query, tuple(update_values))
-        db.commit()
-
         if cursor.rowcount == 0:
             raise ValueError("Agent not found")
+        db.commit()
+        if status == 'available':
+            notify_agents_released()
 
         cursor.execute('SELECT id, name, phone_number, status, last_status_update FROM agents WHERE id = %s', (agent_id,))
         agent = cursor.fetchone()
@@ -370,157 +793,437 @@ def update_agent_status(agent_id):
         logger.error(f"Error updating agent status: {e}")
         raise
 
+# 'sync' places the Twilio call inside the request; 'async' queues it and returns 202 right away
+CALL_DISPATCH_MODE = os.environ.get('CALL_DISPATCH_MODE', 'sync')
+if CALL_DISPATCH_MODE not in ('sync', 'async'):
+    raise ValueError("CALL_DISPATCH_MODE must be 'sync' or 'async'")
+
+def record_initiated_call(cursor, call_sid, to_phone_number):
+    """Insert the calls row for a freshly placed outbound call (caller commits).
+
+    Twilio may already have sent its first status callbacks; insert_calls applies them.
+    """
+    status_writer.insert_calls(cursor, [(call_sid, to_phone_number, datetime.now(), 'initiated')])
+
+call_dispatcher = call_dispatch.CallDispatcher(
+    db_pool,
+    place_outbound_call,
+    record_initiated_call,
+    max_workers=CALL_DISPATCH_WORKERS,
+    find_call=find_outbound_call,
+    # Requests still 'dispatching' after this long are reconciled against Twilio
+    dispatch_timeout=float(os.environ.get('CALL_DISPATCH_TIMEOUT', 300)), # seconds
+) if db_pool else None
+
+def wants_async_dispatch(data, mode=None, prefer=''):
+    """Per-request override of CALL_DISPATCH_MODE via {"async": bool}, ?mode= or Prefer: respond-async."""
+    if 'async' in data:
+        return bool(data['async'])
+    if mode in ('sync', 'async'):
+        return mode == 'async'
+    if 'respond-async' in prefer:
+        return True
+    return CALL_DISPATCH_MODE == 'async'
+
+def number_key(phone_number):
+    """Rate-limit key for a phone number, ignoring formatting ('+1 (555) 010-0000' == '+15550100000')."""
+    return ''.join(ch for ch in phone_number if ch.isdigit())
+
 @app.route("/request_call", methods=['POST'])
+@rate_limited_by_ip(request_call_ip_limiter)
+@idempotent()
 def request_call():
-    """Initiate an outbound call to the provided number."""
+    """Initiate an outbound call to the provided number (synchronously, or queued with a 202)."""
     data = request.get_json()
     to_phone_number = data.get('phoneNumber') or data.get('phone_number')
     if not to_phone_number:
         return jsonify({"error": "Phone number is required"}), 400
-    TWILIO_PHONE_NUMBER = "+19787836427" # Your Twilio US number
-    # Replace with your deployed backend URL on Render (e.g., https://your-app-name.onrender.com)
-    DEPLOYED_BACKEND_URL = "https://ai-call-centre-backend.onrender.com"
-
+    rejected = check_rate_limit(request_call_number_limiter, number_key(to_phone_number))
+    if rejected:
+        return rejected
+    if wants_async_dispatch(data, request.args.get('mode'), request.headers.get('Prefer', '')) and call_dispatcher is not None:
+        try:
+            db = get_db()
+            cursor = db.cursor()
+            request_id, start = call_dispatcher.submit(cursor, to_phone_number)
+            db.commit()
+            start()
+        except call_dispatch.DispatchQueueFull as e:
+            return jsonify({"error": str(e)}), 503
+        status_url = f"/api/calls/{request_id}"
+        response = jsonify({
+            "message": "Call request queued.",
+            "request_id": request_id,
+            "status": "queued",
+            "status_url": status_url
+        })
+        response.headers['Location'] = status_url
+        return response, 202
     try:
-        call = client.calls.create(
-            to=to_phone_number,
-            from_=TWILIO_PHONE_NUMBER,
-            # Replace with your deployed backend URL + /voice endpoint
-            url=f"{DEPLOYED_BACKEND_URL}/voice",
-            # Replace with your deployed backend URL + /twilio_status_callback endpoint
-            status_callback=f"{DEPLOYED_BACKEND_URL}/twilio_status_callback",
-            status_callback_event=['initiated', 'ringing', 'answered', 'completed', 'failed', 'no-answer', 'busy', 'canceled']
-        )
+        call_sid = place_outbound_call(to_phone_number)
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("INSERT INTO calls (call_sid, caller_number, start_time, status) VALUES (%s, %s, %s, %s)", (call.sid, to_phone_number, datetime.now(), 'initiated'))
+        record_initiated_call(cursor, call_sid, to_phone_number)
         db.commit()
-        print(f"Logged initiated call for {to_phone_number} with CallSid: {call.sid}")
-        return jsonify({"message": f"Call initiated successfully! Call SID: {call.sid}"}), 200
+        print(f"Logged initiated call for {to_phone_number} with CallSid: {call_sid}")
+        return jsonify({"message": f"Call initiated successfully! Call SID: {call_sid}", "call_sid": call_sid}), 200
     except Exception as e:
         print(f"Error initiating call for {to_phone_number}: {e}")
         return jsonify({"error": f"Error initiating call: {e}"}), 500
 
+@app.route('/api/calls/<uuid:request_id>', methods=['GET'])
+@json_response
+def get_call_request(request_id):
+    """Report the progress of a queued callback request (queued, dispatching, initiated, failed)."""
+    db = get_db()
+    call_request = call_dispatch.get_request(db.cursor(), request_id)
+    if call_request is None:
+        raise ValueError("Call request not found")
+    return call_request
+
 @app.route('/api/calls', methods=['GET'])
+@conditional_get('calls', 'agents')
 @json_response
 def get_calls():
-    """Return all call logs."""
+    """Return one page of call logs, newest first.
+
+    Query params: limit, cursor (from the previous page's next_cursor),
+    fields (comma-separated columns), status (comma-separated), agent_id,
+    from/to (ISO timestamps on start_time) and caller_number (prefix).
+    """
+    sql, params, fields, limit = call_queries.build_page_query(request.args)
     db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM calls ORDER BY start_time DESC")
-    calls = cursor.fetchall()
-    return [dict(call) for call in calls]
+    cursor = db.cursor()
+    cursor.execute(sql, params)
+    return call_queries.page_response(cursor.fetchall(), fields, limit)
+
+@app.route('/api/calls/export', methods=['GET'])
+def export_calls():
+    """Stream every matching call log as NDJSON (default) or CSV.
+
+    Accepts the same filters and fields as /api/calls. Rows are read through a
+    server-side cursor, so memory use stays flat however large the table is.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        sql, params, fields = call_queries.build_export_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if db_pool is None:
+        return jsonify({"error": "DATABASE_URL is not set"}), 500
+
+    def generate():
+        # The export can outlive the request context, so it holds its own connection
+        conn = db_pool.getconn()
+        try:
+            with conn.cursor(name='calls_export') as cursor:
+                cursor.itersize = 2000
+                cursor.execute(sql, params)
+                if export_format == 'csv':
+                    yield from call_queries.iter_csv(cursor, fields)
+                else:
+                    yield from call_queries.iter_ndjson(cursor, fields)
+        finally:
+            db_pool.putconn(conn)
+
+    if export_format == 'csv':
+        mimetype, filename = 'text/csv', 'calls.csv'
+    else:
+        mimetype, filename = 'application/x-ndjson', 'calls.ndjson'
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+@app.route('/api/calls/archives', methods=['GET'])
+@json_response
+def get_call_archives():
+    """List archived months (file, row count, checksum) overlapping the optional from/to range."""
+    _, params = call_queries.build_filters({k: request.args[k] for k in ('from', 'to') if k in request.args})
+    archives = call_archive.list_archives(get_db().cursor(), params.get('date_from'), params.get('date_to'))
+    return {'archives': archives, 'retention_days': CALL_RETENTION_DAYS or None}
+
+@app.route('/api/calls/archived', methods=['GET'])
+def export_archived_calls():
+    """Stream archived calls as NDJSON, read from the archive files on demand.
+
+    Takes the status, agent_id, caller_number and from/to filters of /api/calls;
+    only the files whose month overlaps from/to are opened.
+    """
+    try:
+        _, params = call_queries.build_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    archives = call_archive.list_archives(get_db().cursor(), params.get('date_from'), params.get('date_to'))
+    missing = [a['partition_name'] for a in archives if not os.path.exists(a['path'])]
+    if missing:
+        return jsonify({"error": f"Archive files not found on this host: {', '.join(missing)}"}), 404
+    calls = call_archive.iter_archived_calls(
+        archives,
+        date_from=params.get('date_from'),
+        date_to=params.get('date_to'),
+        statuses=params.get('statuses'),
+        agent_id=params.get('agent_id'),
+        caller_prefix=request.args.get('caller_number'),
+    )
+    return Response((fast_json.dumps(call) + b'\n' for call in calls), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': 'attachment; filename=archived_calls.ndjson'
+    })
+
+# Dashboard metrics are cached for all workers and recomputed once calls or agents have changed,
+# at most once per METRICS_REFRESH_INTERVAL while writes keep coming
+METRICS_CACHE_TTL = float(os.environ.get('METRICS_CACHE_TTL', 30))  # seconds
+METRICS_REFRESH_INTERVAL = float(os.environ.get('METRICS_REFRESH_INTERVAL', 2))  # seconds
+metrics_cache = SharedTTLCache(ttl=METRICS_CACHE_TTL, refresh_interval=METRICS_REFRESH_INTERVAL)
+
+# Status callbacks are queued and persisted in batches by a background thread per worker
+STATUS_QUEUE_SIZE = int(os.environ.get('STATUS_QUEUE_SIZE', 10000))
+STATUS_BATCH_SIZE = int(os.environ.get('STATUS_BATCH_SIZE', 500))
+status_event_writer = status_writer.StatusWriteBehind(
+    db_pool,
+    max_queue=STATUS_QUEUE_SIZE,
+    batch_size=STATUS_BATCH_SIZE,
+    after_commit=notify_agents_released,
+) if db_pool else None
+
+def apply_status_events(cursor, events):
+    """Write status events synchronously, bypassing the write-behind queue (caller commits)."""
+    return status_writer.apply_events(cursor, events)
+
+def get_metrics_summary():
+    """Return the cached dashboard summary, computing it in one query on a miss."""
+    return metrics_cache.get_or_compute(get_db(), dashboard_metrics.SUMMARY_CACHE_KEY, dashboard_metrics.compute_summary,
+                                        tables=dashboard_metrics.SUMMARY_TABLES)
+
+def metrics_summary_tag():
+    """ETag source for the metrics endpoints: the cached summary they serve, identified by when it was computed."""
+    return get_metrics_summary()['generated_at']
+
+@app.route('/api/metrics/summary', methods=['GET'])
+@conditional_get(live=lambda: f"{metrics_summary_tag()}/{agent_presence_tag()}")
+@json_response
+def get_metrics_summary_endpoint():
+    """Return every dashboard KPI (daily calls, average duration, agent availability, missed calls)."""
+    summary = dict(get_metrics_summary())
+    # Agent counts change far more often than call stats; take them live when we can
+    availability = live_agent_availability()
+    if availability is not None:
+        summary['agentAvailability'] = availability
+    return summary
 
 @app.route('/api/metrics/daily_calls', methods=['GET'])
+@conditional_get(live=metrics_summary_tag)
 @json_response
 def get_daily_calls():
     """Return call statistics for today and yesterday."""
-    db = get_db()
-    # Ensure DictCursor is used
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Get today's date in UTC
-    today = datetime.utcnow().date()
-    yesterday = today - timedelta(days=1)
-    
-    # Get total calls for today
-    cursor.execute("""
-        SELECT COUNT(*) as total
-        FROM calls
-        WHERE start_time::DATE = %s
-    """, (today,))
-    today_calls = cursor.fetchone()['total']
-    
-    # Get total calls for yesterday
-    cursor.execute("""
-        SELECT COUNT(*) as total
-        FROM calls
-        WHERE start_time::DATE = %s
-    """, (yesterday,))
-    yesterday_calls = cursor.fetchone()['total']
-    
-    # Calculate percentage change
-    change = 0
-    if yesterday_calls > 0:
-        change = ((today_calls - yesterday_calls) / yesterday_calls) * 100
-    
-    return {
-        'total': today_calls,
-        'change': round(change, 1)
-    }
+    return get_metrics_summary()['dailyCalls']
 
 @app.route('/api/metrics/avg_call_duration', methods=['GET'])
+@conditional_get(live=metrics_summary_tag)
 @json_response
 def get_avg_call_duration():
     """Return average call duration for completed calls."""
-    db = get_db()
-    # Ensure DictCursor is used
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Get average duration for completed calls in the last 24 hours
-    # Use EXTRACT(EPOCH FROM ...) for duration in seconds in PostgreSQL
-    cursor.execute("""
-        SELECT AVG(EXTRACT(EPOCH FROM (end_time - start_time))) as avg_duration
-        FROM calls
-        WHERE status = 'completed'
-        AND start_time >= CURRENT_TIMESTAMP - INTERVAL '1 day'
-        AND end_time IS NOT NULL -- Ensure end_time is not null for duration calculation
-    """)
-    result = cursor.fetchone()
-    # Handle None if no completed calls
-    avg_duration = result['avg_duration'] if result and result['avg_duration'] is not None else 0
-    
-    # Get average duration for completed calls in the previous 24 hours
-     # Use EXTRACT(EPOCH FROM ...) for duration in seconds in PostgreSQL
-    cursor.execute("""
-        SELECT AVG(EXTRACT(EPOCH FROM (end_time - start_time))) as avg_duration
-        FROM calls
-        WHERE status = 'completed'
-        AND start_time >= CURRENT_TIMESTAMP - INTERVAL '2 days'
-        AND start_time < CURRENT_TIMESTAMP - INTERVAL '1 day'
-        AND end_time IS NOT NULL -- Ensure end_time is not null for duration calculation
-    """)
-    result = cursor.fetchone()
-    # Handle None if no completed calls in previous period
-    prev_avg_duration = result['avg_duration'] if result and result['avg_duration'] is not None else 0
-    
-    # Calculate percentage change
-    change = 0
-    if prev_avg_duration > 0:
-        change = ((avg_duration - prev_avg_duration) / prev_avg_duration) * 100
-    
-    return {
-        'seconds': round(avg_duration),
-        'change': round(change, 1)
-    }
+    return get_metrics_summary()['avgDuration']
 
 @app.route('/api/metrics/agent_availability', methods=['GET'])
+@conditional_get(live=lambda: agent_presence_tag() or metrics_summary_tag())
 @json_response
 def get_agent_availability():
     """Return current agent availability statistics."""
-    db = get_db()
-    # Ensure DictCursor is used
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Get total number of agents
-    cursor.execute("SELECT COUNT(*) as total FROM agents")
-    total_agents = cursor.fetchone()['total']
-    
-    # Get count of agents by status
-    cursor.execute("""
-        SELECT status, COUNT(*) as count
-        FROM agents
-        GROUP BY status
-    """)
-    status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
-    
+    return live_agent_availability() or get_metrics_summary()['agentAvailability']
+
+@app.route('/api/db/pool_stats', methods=['GET'])
+@json_response
+def get_pool_stats():
+    """Return connection pool counters for this worker process."""
+    if db_pool is None:
+        raise ValueError("DATABASE_URL is not set")
+    return db_pool.stats()
+
+@app.route('/api/ivr_sessions/stats', methods=['GET'])
+@json_response
+def get_ivr_session_stats():
+    """Return size and hit rate of this worker's IVR session cache."""
+    return ivr_session_store.stats()
+
+@app.route('/api/rate_limits/stats', methods=['GET'])
+@json_response
+def get_rate_limit_stats():
+    """Return this worker's rate limiter and idempotency key counters."""
     return {
-        'available': status_counts.get('available', 0),
-        'on_call': status_counts.get('on_call', 0),
-        'offline': status_counts.get('offline', 0),
-        'total': total_agents
+        'enabled': RATE_LIMIT_ENABLED,
+        'limiters': {limiter.name: limiter.stats() for limiter in (request_call_ip_limiter, request_call_number_limiter)},
+        'idempotency': idempotency_store.stats()
     }
 
+@app.route('/api/status_writer/stats', methods=['GET'])
+@json_response
+def get_status_writer_stats():
+    """Return write-behind queue counters for this worker process."""
+    if status_event_writer is None:
+        raise ValueError("DATABASE_URL is not set")
+    return status_event_writer.stats()
+
+# Outbound campaign dialer (one leader process dials; the rest stand by)
+CAMPAIGN_CALLS_PER_SECOND = float(os.environ.get('CAMPAIGN_CALLS_PER_SECOND', 1)) # Twilio's default account CPS
+CAMPAIGN_DIAL_WORKERS = int(os.environ.get('CAMPAIGN_DIAL_WORKERS', 4))
+CAMPAIGN_MAX_ATTEMPTS = int(os.environ.get('CAMPAIGN_MAX_ATTEMPTS', 3))
+CAMPAIGN_DIALER_ENABLED = os.environ.get('CAMPAIGN_DIALER_ENABLED', 'true').lower() == 'true'
+campaign_dialer = campaigns.CampaignDialer(
+    db_pool,
+    place_outbound_call,
+    calls_per_second=CAMPAIGN_CALLS_PER_SECOND,
+    max_workers=CAMPAIGN_DIAL_WORKERS,
+    max_attempts=CAMPAIGN_MAX_ATTEMPTS,
+) if db_pool else None
+
+# calls is partitioned by month; months older than CALL_RETENTION_DAYS are moved to gzip'd NDJSON
+# files in CALL_ARCHIVE_DIR and dropped from the table (0 keeps everything in the database)
+CALL_RETENTION_DAYS = int(os.environ.get('CALL_RETENTION_DAYS', 365))
+CALL_ARCHIVE_DIR = os.environ.get('CALL_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'calls'))
+CALL_ARCHIVE_INTERVAL = float(os.environ.get('CALL_ARCHIVE_INTERVAL', 6 * 3600)) # seconds
+call_archiver = call_archive.CallArchiver(
+    db_pool,
+    CALL_ARCHIVE_DIR,
+    retain_days=CALL_RETENTION_DAYS or None,
+    interval=CALL_ARCHIVE_INTERVAL,
+) if db_pool else None
+
+# Folds the table change log (the ETag versions) into its counters so version reads stay cheap
+CHANGE_LOG_COMPACT_INTERVAL = float(os.environ.get('CHANGE_LOG_COMPACT_INTERVAL', 10)) # seconds
+change_log_compactor = change_tracking.ChangeLogCompactor(db_pool, interval=CHANGE_LOG_COMPACT_INTERVAL) if db_pool else None
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('_request_started', None)
+    if started is not None:
+        # Label by route pattern (not raw path) to keep the series count bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        instrumentation.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started, (route, request.method, str(response.status_code))
+        )
+    return response
+
+# Gauges read at scrape time from this worker's pools, queues and caches
+instrumentation.Gauge(
+    'db_pool_connections', "Connections in this worker's pool by state.",
+    lambda: {(state,): db_pool.stats()[state] for state in ('idle', 'in_use')} if db_pool else None,
+    ('state',))
+instrumentation.Gauge(
+    'db_pool_checkout_wait_ms_avg', "Average wait for a pooled connection.",
+    lambda: db_pool.stats()['avg_wait_ms'] if db_pool else None)
+instrumentation.Gauge(
+    'status_writer_queue_depth', "Status callbacks waiting to be written.",
+    lambda: status_event_writer.stats()['queue_depth'] if status_event_writer else None)
+instrumentation.Gauge(
+    'call_dispatch_pending', "Callback requests queued or being dispatched in this worker.",
+    lambda: call_dispatcher.stats()['pending'] if call_dispatcher else None)
+instrumentation.Gauge(
+    'ivr_sessions', "IVR sessions held in this worker's cache.",
+    lambda: ivr_session_store.stats()['size'])
+instrumentation.Gauge(
+    'agents', "Agents by status, from the presence registry.",
+    lambda: {(status,): count for status, count in agent_registry.counts().items() if status != 'total'}
+    if agent_registry is not None and agent_registry.ready else None,
+    ('status',))
+instrumentation.Gauge(
+    'metrics_cache_requests', "Dashboard metrics cache lookups in this worker by result.",
+    lambda: {('hit',): metrics_cache.stats()['hits'], ('miss',): metrics_cache.stats()['misses']},
+    ('result',))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format) for this worker process."""
+    return Response(instrumentation.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+_background_workers_pid = None
+
+@app.before_request
+def start_background_workers():
+    # Started on the first request so the threads belong to the (forked) worker process
+    global _background_workers_pid
+    if _background_workers_pid == os.getpid():
+        return
+    _background_workers_pid = os.getpid()
+    if CAMPAIGN_DIALER_ENABLED and campaign_dialer is not None:
+        campaign_dialer.start()
+    if agent_registry is not None:
+        agent_registry.ensure_started()
+    if call_queue_dispatcher is not None:
+        call_queue_dispatcher.start()
+    if call_archiver is not None:
+        call_archiver.start()
+    if change_log_compactor is not None:
+        change_log_compactor.start()
+    if call_dispatcher is not None:
+        try:
+            # Pick up callback requests a previous worker queued but never dispatched
+            with db_pool_connection() as conn:
+                with conn.cursor() as cursor:
+                    call_dispatcher.resubmit_stale(cursor)
+        except Exception as e:
+            logger.error(f"Could not resubmit stale call requests: {str(e)}")
+        call_dispatcher.start_recovery()
+
+@app.route('/api/campaigns', methods=['POST'])
+@json_response
+def create_campaign():
+    """Create a callback campaign from JSON {name, numbers} or a CSV upload (multipart field 'file')."""
+    if 'file' in request.files:
+        name = request.form.get('name') or request.files['file'].filename or 'Campaign'
+        raw_numbers = campaigns.parse_numbers_csv(request.files['file'].read().decode('utf-8-sig'))
+    else:
+        data = request.get_json()
+        if not data:
+            raise ValueError("No JSON data or CSV file provided")
+        name = data.get('name') or 'Campaign'
+        raw_numbers = data.get('numbers') or []
+        if not isinstance(raw_numbers, list):
+            raise ValueError("numbers must be a list of phone numbers")
+    numbers, invalid = campaigns.normalize_numbers(raw_numbers)
+    db = get_db()
+    cursor = db.cursor()
+    campaign = campaigns.create_campaign(cursor, name, numbers)
+    db.commit()
+    logger.info(f"Created campaign {campaign['id']} with {len(numbers)} numbers ({len(invalid)} invalid).")
+    campaign['invalid_numbers'] = invalid
+    return campaign, 201
+
+@app.route('/api/campaigns', methods=['GET'])
+@json_response
+def get_campaigns():
+    """List recent campaigns with dialing progress."""
+    db = get_db()
+    return {"data": campaigns.list_campaigns(db.cursor())}
+
+@app.route('/api/campaigns/<int:campaign_id>', methods=['GET'])
+@json_response
+def get_campaign(campaign_id):
+    """Return one campaign with counts of pending, dialing, dialed and failed numbers."""
+    db = get_db()
+    campaign = campaigns.get_campaign(db.cursor(), campaign_id)
+    if campaign is None:
+        raise ValueError("Campaign not found")
+    return campaign
+
+@app.route('/api/campaigns/<int:campaign_id>/status', methods=['PUT'])
+@json_response
+def update_campaign_status(campaign_id):
+    """Pause, resume (running) or cancel a campaign."""
+    data = request.get_json()
+    if not data or not data.get('status'):
+        raise ValueError("No status provided")
+    db = get_db()
+    cursor = db.cursor()
+    campaigns.set_campaign_status(cursor, campaign_id, data['status'])
+    db.commit()
+    return campaigns.get_campaign(cursor, campaign_id)
+
 @app.route("/")
 def index():
     """Serve the request_callback.html file."""
@@ -532,11 +1235,98 @@ def twilio_status_callback():
     Receives call status updates from Twilio.
     Twilio sends details about the call progress to this endpoint.
     """
-    call_sid = request.form.get('CallSid')
-    call_status = request.form.get('CallStatus')
-    logger.info(f"Twilio Call Status Callback received for CallSID: {call_sid}, Status: {call_status}")
+    event = status_writer.event_from_twilio(request.form)
+    if event is None:
+        return "", 204
+    logger.debug(f"Twilio Call Status Callback received for CallSID: {event.call_sid}, Status: {event.status}")
+    if status_event_writer is None or not status_event_writer.submit(event):
+        # Write-behind queue is full (or there is no pool): apply this one synchronously
+        db = get_db()
+        result = apply_status_events(db.cursor(), [event])
+        db.commit()
+        notify_agents_released(result)
     # Respond with a 204 No Content to acknowledge the callback
     return "", 204
 
+@app.route('/api/metrics/timeseries', methods=['GET'])
+@conditional_get('call_rollups', per_day=True)
+@json_response
+def get_metrics_timeseries():
+    """Return call counts and duration stats per hour or day, read from the rollup tables.
+
+    Query params: bucket (hour|day, default day), from/to (ISO timestamps,
+    default the last 24 hours or 7 days), agent_id, status (comma-separated).
+    """
+    bucket = request.args.get('bucket', 'day')
+    date_from, date_to = rollups.parse_range(request.args, bucket)
+    agent_id = request.args.get('agent_id', type=int)
+    status = request.args.get('status')
+    statuses = [s.strip() for s in status.split(',') if s.strip()] if status else None
+    db = get_db()
+    cursor = db.cursor()
+    points = rollups.timeseries(cursor, date_from, date_to, bucket=bucket, agent_id=agent_id, status=statuses)
+    return {
+        'bucket': bucket,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'data': points
+    }
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the call rollup tables from the calls table."""
+    with app.app_context():
+        counts = rollups.rebuild(get_db())
+    print(f"Rebuilt rollups: {counts}")
+
+@app.cli.command('archive-calls')
+@click.option('--retain-days', type=int, default=None, help="Defaults to CALL_RETENTION_DAYS.")
+def archive_calls_command(retain_days):
+    """Create upcoming calls partitions and archive the months past retention."""
+    retain_days = CALL_RETENTION_DAYS if retain_days is None else retain_days
+    with app.app_context():
+        db = get_db()
+        with db.cursor() as cursor:
+            created = call_archive.ensure_partitions(cursor)
+        db.commit()
+        archived = call_archive.archive_expired(db, CALL_ARCHIVE_DIR, retain_days) if retain_days else []
+    print(f"Created partitions: {created or 'none'}")
+    for entry in archived:
+        print(f"Archived {entry['rows']} calls from {entry['partition']} to {entry['path']}")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Apply pending migrations and seed the demo agents."""
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL is not set.")
+    applied = db_setup.setup_database(DATABASE_URL)
+    print(f"Applied {len(applied)} migration(s).")
+
+def create_app(init_database=None, warm=None):
+    """Return the app, optionally doing startup work up front.
+
+    Used as `gunicorn 'test_call_app:create_app()'`. By default nothing is
+    done at boot: the schema is set up by gunicorn.conf.py or `flask init-db`,
+    pool connections and the Twilio client are created on first use.
+    init_database runs the migrations/seed in this process; warm opens a pool
+    connection and builds the Twilio client before the first request. Both
+    default to the INIT_DB_ON_START and WARM_ON_START environment variables.
+    """
+    if init_database is None:
+        init_database = os.environ.get('INIT_DB_ON_START', 'false').lower() == 'true'
+    if warm is None:
+        warm = os.environ.get('WARM_ON_START', 'false').lower() == 'true'
+    if init_database:
+        init_db()
+    if warm:
+        get_twilio_client()
+        if db_pool is not None:
+            try:
+                with db_pool_connection():
+                    pass
+            except psycopg2.Error as e:
+                logger.warning(f"Could not open a database connection at startup: {str(e)}")
+    return app
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app(init_database=True).run(debug=True)
\ No newline at end of file
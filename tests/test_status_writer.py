@@ -0,0 +1,111 @@
+"""
+Status callbacks that reach the database before their calls row.
+
+These run against a real PostgreSQL database (the ordering is enforced in
+SQL), so they are skipped unless TEST_DATABASE_URL points at one. The
+schema is migrated to the latest version; only rows created here are removed.
+"""
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+import migrations  # noqa: E402
+import status_writer  # noqa: E402
+from status_writer import StatusEvent  # noqa: E402
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture(scope='module')
+def connect():
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    migrations.run_migrations(conn)
+    conn.close()
+    opened = []
+
+    def _connect():
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        opened.append(conn)
+        return conn
+    yield _connect
+    for conn in opened:
+        conn.close()
+
+
+@pytest.fixture
+def call_sid(connect):
+    call_sid = f"CAtest{uuid.uuid4().hex}"
+    yield call_sid
+    conn = connect()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM calls WHERE call_sid = %s", (call_sid,))
+        cursor.execute("DELETE FROM call_events WHERE call_sid = %s", (call_sid,))
+    conn.commit()
+
+
+def event(call_sid, status):
+    return StatusEvent(call_sid, status, datetime.now(timezone.utc), None, None)
+
+
+def call_status(conn, call_sid):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT status FROM calls WHERE call_sid = %s", (call_sid,))
+        return cursor.fetchone()[0]
+
+
+def insert_call(conn, call_sid):
+    with conn.cursor() as cursor:
+        result = status_writer.insert_calls(cursor, [(call_sid, '+15550100', datetime.now(timezone.utc), 'initiated')])
+    conn.commit()
+    return result
+
+
+def test_callback_before_row_is_applied_on_insert(connect, call_sid):
+    conn = connect()
+    with conn.cursor() as cursor:
+        result = status_writer.apply_events(cursor, [event(call_sid, 'initiated'), event(call_sid, 'ringing')])
+    conn.commit()
+    assert result['updated'] == []
+
+    result = insert_call(conn, call_sid)
+    assert [row[0] for row in result['updated']] == [call_sid]
+    assert call_status(conn, call_sid) == 'ringing'
+
+
+def test_callback_after_row_still_updates_it(connect, call_sid):
+    conn = connect()
+    assert insert_call(conn, call_sid)['updated'] == []
+    with conn.cursor() as cursor:
+        status_writer.apply_events(cursor, [event(call_sid, 'ringing')])
+    conn.commit()
+    assert call_status(conn, call_sid) == 'ringing'
+
+
+def test_callback_racing_an_uncommitted_insert(connect, call_sid):
+    inserter, writer = connect(), connect()
+    with inserter.cursor() as cursor:
+        status_writer.insert_calls(cursor, [(call_sid, '+15550100', datetime.now(timezone.utc), 'initiated')])
+
+    # The writer can't see the uncommitted row, so it has to wait for the insert to commit
+    def apply():
+        with writer.cursor() as cursor:
+            status_writer.apply_events(cursor, [event(call_sid, 'answered')])
+        writer.commit()
+    thread = threading.Thread(target=apply)
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive()
+
+    inserter.commit()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert call_status(inserter, call_sid) == 'answered'
@@ -0,0 +1,62 @@
+"""
+Twilio REST client construction.
+
+Kept out of the app module so the (heavy) twilio.rest import only happens
+when the first outbound call is placed, not while a worker boots. The HTTP
+client shares one keep-alive session between request threads, the
+dispatcher and the campaign dialer, records request latency in /metrics
+and can be pointed at another host (e.g. the fake Twilio server used by
+benchmarks/load_test.py).
+"""
+import time
+
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+import instrumentation
+
+TWILIO_API_URL = 'https://api.twilio.com'
+
+
+class InstrumentedTwilioHttpClient(TwilioHttpClient):
+    """Records the latency of every Twilio REST request in /metrics."""
+
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            instrumentation.TWILIO_API_DURATION.observe(time.perf_counter() - started, (method.upper(), status))
+
+
+class RedirectedTwilioHttpClient(InstrumentedTwilioHttpClient):
+    """Sends requests meant for api.twilio.com to `base_url` instead."""
+
+    def __init__(self, base_url, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, *args, **kwargs):
+        url = url.replace(TWILIO_API_URL, self.base_url, 1)
+        return super().request(method, url, *args, **kwargs)
+
+
+def create_http_client(timeout=15.0, pool_maxsize=12, base_url=None):
+    """Build a pooled Twilio HTTP client; `pool_maxsize` bounds concurrent keep-alive connections."""
+    if base_url:
+        http_client = RedirectedTwilioHttpClient(base_url, pool_connections=True, timeout=timeout)
+    else:
+        http_client = InstrumentedTwilioHttpClient(pool_connections=True, timeout=timeout)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    http_client.session.mount('https://', adapter)
+    if base_url and base_url.startswith('http://'):
+        http_client.session.mount('http://', adapter)
+    return http_client
+
+
+def create_client(account_sid, auth_token, **http_options):
+    return Client(account_sid, auth_token, http_client=create_http_client(**http_options))